@@ -2,21 +2,28 @@
 import asyncio
 import json
 from collections import namedtuple
+from contextlib import contextmanager
+from functools import partial
+from types import MappingProxyType
 
 from requests.structures import CaseInsensitiveDict
 
 from tornado.httpclient import AsyncHTTPClient
 
+from . import Metrics
 from .AppConfig import AppConfig, Expose
 from .Config import Config
 from .Containers import Containers
 from .Exceptions import StoryscriptError
 from .Logger import Logger
 from .Stories import Stories
+from .TaskGraph import TaskGraph
 from .Types import StreamingService
+from .constants.LineConstants import LineConstants
 from .constants.ServiceConstants import ServiceConstants
 from .entities.Release import Release
 from .processing import Story
+from .processing.Compiler import Compiler
 from .processing.Services import Command, Service, Services
 from .utils import Dict
 from .utils.HttpUtils import HttpUtils
@@ -32,6 +39,16 @@ AppData = namedtuple('AppData', {
     'release': Release
 })
 
+BOOTSTRAP_CONCURRENCY = 20
+"""
+The number of containers, exposes and stories of an app which are
+started at once when it's bootstrapped. See App#bootstrap.
+"""
+
+PHASE_CONTAINERS = 'containers'
+PHASE_EXPOSES = 'exposes'
+PHASE_STORIES = 'stories'
+
 
 class App:
     app_config: AppConfig = None
@@ -44,9 +61,27 @@ class App:
     The runtime config for this app.
     """
 
+    base_context: MappingProxyType = None
+    """
+    The bottom (read only) layer of the context of every story executed
+    for this app. See Stories#set_context.
+    """
+
+    service_spec_hashes: dict = None
+    """
+    The hashes of the specs of the services of this app, by service and
+    action. See Containers#hash_service_spec.
+    """
+
     def __init__(self, app_data: AppData):
         self._subscriptions = {}
+        self._swapped_subscriptions = {}
+        self._containers = {}
+        self.service_spec_hashes = {}
+        self._executions = 0
+        self._drained = None
         release = app_data.release
+        self.release = release
         self.app_id = release.app_uuid
         self.app_name = release.app_name
         self.app_dns = release.app_dns
@@ -63,7 +98,8 @@ class App:
             self.environment = release.environment
 
         self.environment = CaseInsensitiveDict(data=self.environment)
-        self.stories = release.stories['stories']
+        self.stories = Compiler.compile_stories(release.stories['stories'],
+                                                app_data.services)
         self.entrypoint = release.stories['entrypoint']
         self.services = app_data.services
         self.always_pull_images = release.always_pull_images
@@ -71,11 +107,22 @@ class App:
         for k, v in self.environment.items():
             if not isinstance(v, dict):
                 secrets[k] = v
-        self.app_context = {
+        self.set_app_context({
             'secrets': secrets,
             'hostname': f'{self.app_dns}.{self.config.APP_DOMAIN}',
             'version': self.version
-        }
+        })
+
+    def set_app_context(self, app_context: dict):
+        """
+        Replaces the context of the app (and App#base_context). It's
+        never changed in place, since the stories being executed keep
+        reading from the one they started with (see Stories#set_context).
+        """
+        self.app_context = app_context
+        self.base_context = MappingProxyType({
+            'app': MappingProxyType(app_context)
+        })
 
     def image_pull_policy(self):
         if self.always_pull_images is True:
@@ -85,17 +132,88 @@ class App:
 
     async def bootstrap(self):
         """
-        Executes all stories found in stories.json.
+        Starts the services of the app, exposes them, and executes all
+        stories found in stories.json.
         This enables the story to listen to pub/sub,
         register with the gateway, and queue cron jobs.
+
+        All of these run concurrently (see TaskGraph): the exposes
+        alongside the services, and every story as soon as the
+        containers it uses have started.
         """
-        await self.start_services()
-        await self.expose_services()
-        await self.run_stories()
+        graph = TaskGraph(BOOTSTRAP_CONCURRENCY)
+        self.add_container_tasks(graph)
+        self.add_expose_tasks(graph)
+        self.add_story_tasks(graph)
+        await self.run_tasks(graph)
 
-    async def expose_services(self):
-        for expose in self.app_config.get_expose_config():
-            await self._expose_service(expose)
+    async def prepare(self):
+        """
+        Starts and exposes the services of the app, so that it's ready
+        to run its stories. See Apps#deploy_release.
+        """
+        graph = TaskGraph(BOOTSTRAP_CONCURRENCY)
+        self.add_container_tasks(graph)
+        self.add_expose_tasks(graph)
+        await self.run_tasks(graph)
+
+    def add_container_tasks(self, graph: TaskGraph):
+        """
+        Adds a task for every container which is started when the app is
+        bootstrapped, named after the container.
+        """
+        for story, line, container_name in self.get_service_containers():
+            graph.add(container_name, PHASE_CONTAINERS,
+                      partial(Services.start_container, story, line))
+
+    def add_expose_tasks(self, graph: TaskGraph):
+        """
+        Adds a task for every expose, which runs once the container it
+        exposes has started (adding a task for the container, unless
+        it's used by a story too).
+        """
+        for i, expose in enumerate(self.app_config.get_expose_config()):
+            container_name = Containers.get_container_name(
+                self, None, None, expose.service)
+            graph.add(container_name, PHASE_CONTAINERS,
+                      partial(Containers.start_exposed, self,
+                              expose.service))
+            graph.add(f'expose:{i}', PHASE_EXPOSES,
+                      partial(self._expose_service, expose),
+                      depends_on=[container_name])
+
+    def add_story_tasks(self, graph: TaskGraph):
+        """
+        Adds a task for every entrypoint story, which runs once the
+        containers it uses have started (if they're tasks of the graph).
+        """
+        for story_name in self.entrypoint:
+            container_names = [
+                container_name for _, _, container_name
+                in self.get_service_containers([story_name])
+            ]
+            graph.add(f'story:{story_name}', PHASE_STORIES,
+                      partial(Story.run, self, self.logger, story_name),
+                      depends_on=container_names)
+
+    async def run_tasks(self, graph: TaskGraph):
+        """
+        Runs the tasks of a graph, and reports how long every phase took.
+        """
+        try:
+            await graph.run()
+        finally:
+            for phase, seconds in graph.phase_seconds.items():
+                Metrics.app_bootstrap_phase_seconds.labels(
+                    app_id=self.app_id, phase=phase).observe(seconds)
+
+            if len(graph.phase_seconds) > 0:
+                timings = ', '.join([
+                    f'{phase} in {seconds:.2f}s'
+                    for phase, seconds in graph.phase_seconds.items()
+                ])
+                self.logger.info(f'Bootstrapped app {self.app_id}: '
+                                 f'{timings}')
 
     async def _expose_service(self, e: Expose):
         self.logger.info(f'Exposing service {e.service}/'
@@ -120,10 +238,147 @@ class App:
 
         await Containers.expose_service(self, e)
 
-    async def start_services(self):
-        tasks = []
+    async def adopt(self):
+        """
+        Bootstraps the app on the containers which are already running in
+        its namespace (eg: when the engine has been restarted), instead of
+        starting them again. This is only possible if the containers are
+        exactly the ones this version of the app needs.
+
+        Returns False (having done nothing) if it isn't possible.
+        """
+        if not await Containers.adopt(self, self.get_container_names()):
+            return False
+
+        # Subscriptions made by the engine before it went down are stale.
+        await self.clear_subscriptions_synapse()
+        await self.bootstrap()
+        return True
+
+    async def hot_swap(self, release: Release, logger: Logger) -> bool:
+        """
+        Swaps the stories of the app for the ones of a release which
+        changes nothing else (see Apps#is_story_only_change), without
+        destroying the app.
+
+        The new stories must use the same containers: services with a run
+        section have containers per story line (see
+        Containers#get_container_name), so adding or moving lines might
+        need new ones. If so, nothing is swapped, and False is returned,
+        so that the release is deployed instead (which starts the new
+        containers before the switch, and removes the old ones after).
+
+        Executions in progress finish on the stories they started with
+        (see Stories#__init__). The new stories are run, and the when
+        blocks whose subscriptions haven't changed keep them (see
+        App#reuse_subscription). The other subscriptions are unsubscribed.
+
+        If that fails, the app is put back on the release it had before,
+        so that it can be replaced by a new deployment of the release
+        (see Apps#reload_app).
+        """
+        stories = Compiler.compile_stories(release.stories['stories'],
+                                           self.services)
+        if not self.uses_same_containers(stories):
+            return False
+
+        # Swapped all at once, without yielding to the event loop.
+        previous = (self.release, self.stories, self.entrypoint,
+                    self.version, self.logger, self.app_context)
+        self.release = release
+        self.stories = stories
+        self.entrypoint = release.stories['entrypoint']
+        self.version = release.version
+        self.logger = logger
+        self.set_app_context({**self.app_context, 'version': release.version})
+        swapped = self._subscriptions
+        self._subscriptions = {}
+        for sub in swapped.values():
+            key = self.get_subscription_key(sub.payload)
+            self._swapped_subscriptions.setdefault(key, []).append(sub)
+
+        try:
+            await self.run_stories()
+        except BaseException as e:
+            (self.release, self.stories, self.entrypoint,
+             self.version, self.logger, app_context) = previous
+            self.set_app_context(app_context)
+            # The app will be destroyed (see Apps#reload_app), which
+            # unsubscribes from all of them.
+            self._subscriptions.update(self._pop_swapped_subscriptions())
+            raise e
+
+        for sub in self._pop_swapped_subscriptions().values():
+            await self.unsubscribe(sub)
+
+        return True
+
+    def uses_same_containers(self, stories: dict) -> bool:
+        """
+        Returns whether the given (compiled) stories use the same
+        containers as the stories of the app (see App#get_container_names).
+        """
+        container_names = self.get_container_names()
+        current = self.stories
+        # Restored without yielding to the event loop.
+        self.stories = stories
+        try:
+            return self.get_container_names() == container_names
+        finally:
+            self.stories = current
+
+    def _pop_swapped_subscriptions(self) -> dict:
+        subs = {}
+        for swapped in self._swapped_subscriptions.values():
+            for sub in swapped:
+                subs[sub.id] = sub
+
+        self._swapped_subscriptions = {}
+        return subs
+
+    @staticmethod
+    def get_subscription_key(body: dict) -> str:
+        """
+        Returns the parameters of a subscription (see Services#when),
+        which are the same for subscriptions to the same events of the
+        same when block, apart from their ids.
+        """
+        key = dict(body)
+        key.pop('sub_id')
+        key['sub_body'] = dict(body['sub_body'])
+        key['sub_body'].pop('id')
+        return json.dumps(key, sort_keys=True, default=str)
+
+    def reuse_subscription(self, body: dict):
+        """
+        Keeps the subscription made before the stories were hot swapped
+        (see App#hot_swap) with the same parameters as the given one,
+        if there's one, so that it doesn't need to be made again.
+        Returns it (or None).
+        """
+        if len(self._swapped_subscriptions) == 0:
+            return None
+
+        subs = self._swapped_subscriptions.get(
+            self.get_subscription_key(body))
+        if not subs:
+            return None
+
+        sub = subs.pop()
+        self._subscriptions[sub.id] = sub
+        return sub
+
+    def get_service_lines(self, story_names=None):
+        """
+        Yields the story and line of every service which is started
+        when the app is bootstrapped (or only the ones used by the given
+        stories). See App#add_container_tasks.
+        """
+        if story_names is None:
+            story_names = self.stories.keys()
+
         reusable_services = set()
-        for story_name in self.stories.keys():
+        for story_name in story_names:
             story = Stories(self, story_name, self.logger)
             line = story.first_line()
             while line is not None:
@@ -149,28 +404,80 @@ class App:
                         reusable_services.add(service)
 
                     if not Services.is_internal(chain[0].name, chain[1].name):
-                        tasks.append(Services.start_container(story, line))
+                        yield story, line
                 finally:
                     line = line.get('next')
 
-        if len(tasks) > 0:
-            completed, pending = await asyncio.wait(tasks)
-            # Pending must never be greater than zero.
-            assert len(pending) == 0
+    def get_service_containers(self, story_names=None):
+        """
+        Yields the story and line of every service which runs in a
+        container (see App#get_service_lines), along with the name of
+        the container (see Containers#get_container_name).
+        """
+        for story, line in self.get_service_lines(story_names):
+            if Services.resolve_chain(story, line)[0].name == 'http':
+                # Served by the gateway.
+                continue
 
-            for task in completed:
-                exc = task.exception()
-                if exc is not None:
-                    raise exc
+            yield story, line, Containers.get_container_name(
+                self, story.name, line, line[LineConstants.service])
+
+    def get_container_names(self) -> set:
+        """
+        Returns the names of all the containers which are started when
+        the app is bootstrapped (see Containers#get_container_name).
+        """
+        names = set()
+        for _, _, container_name in self.get_service_containers():
+            names.add(container_name)
+
+        for expose in self.app_config.get_expose_config():
+            names.add(Containers.get_container_name(
+                self, None, None, expose.service))
+
+        return names
 
     async def run_stories(self):
         """
-        Executes all the stories.
+        Executes all the entrypoint stories, concurrently.
         This enables the story to listen to pub/sub,
         register with the gateway, and queue cron jobs.
         """
-        for story_name in self.entrypoint:
-            await Story.run(self, self.logger, story_name)
+        graph = TaskGraph(BOOTSTRAP_CONCURRENCY)
+        self.add_story_tasks(graph)
+        await self.run_tasks(graph)
+
+    @contextmanager
+    def execution(self):
+        """
+        Tracks a story which is executing for this app. See App#drain.
+        """
+        self._executions += 1
+        try:
+            yield
+        finally:
+            self._executions -= 1
+            if self._executions == 0 and self._drained is not None:
+                self._drained.set_result(None)
+                self._drained = None
+
+    async def drain(self, timeout: float) -> bool:
+        """
+        Waits for the stories which are executing to finish (eg: after
+        the app has been replaced by a new release), for up to timeout
+        seconds. Returns whether they did.
+        """
+        if self._executions == 0:
+            return True
+
+        if self._drained is None:
+            self._drained = asyncio.get_event_loop().create_future()
+
+        try:
+            await asyncio.wait_for(asyncio.shield(self._drained), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
 
     def add_subscription(self, sub_id: str,
                          streaming_service: StreamingService,
@@ -184,6 +491,23 @@ class App:
     def remove_subscription(self, sub_id: str):
         self._subscriptions.pop(sub_id)
 
+    def add_container(self, container_name: str, hostname: str):
+        """
+        Records a container which has been started (and is ready to be
+        used) for this app. See Containers#start.
+        """
+        self._containers[container_name] = hostname
+
+    def get_container_hostname(self, container_name: str):
+        """
+        Returns the hostname of a container which has been started,
+        or None if it hasn't been started (yet).
+        """
+        return self._containers.get(container_name)
+
+    def clear_containers(self):
+        self._containers.clear()
+
     async def clear_subscriptions_synapse(self):
         url = f'http://{self.config.ASYNCY_SYNAPSE_HOST}:' \
               f'{self.config.ASYNCY_SYNAPSE_PORT}/clear_all'
@@ -207,43 +531,46 @@ class App:
             return False
 
     async def unsubscribe_all(self):
-        for sub_id, sub in self._subscriptions.items():
-            assert isinstance(sub, Subscription)
-            assert isinstance(sub.streaming_service, StreamingService)
-            conf = Dict.find(
-                self.services, f'{sub.streaming_service.name}'
-                               f'.{ServiceConstants.config}'
-                               f'.actions.{sub.streaming_service.command}'
-                               f'.events.{sub.event}.http')
-
-            http_conf = conf.get('unsubscribe')
-            if not http_conf:
-                self.logger.debug(f'No unsubscribe call required for {sub}')
-                continue
-
-            url = f'http://{sub.streaming_service.hostname}' \
-                  f':{http_conf.get("port", conf.get("port", 80))}' \
-                  f'{http_conf["path"]}'
+        for sub in self._subscriptions.values():
+            await self.unsubscribe(sub)
+
+    async def unsubscribe(self, sub: Subscription):
+        assert isinstance(sub, Subscription)
+        assert isinstance(sub.streaming_service, StreamingService)
+        conf = Dict.find(
+            self.services, f'{sub.streaming_service.name}'
+                           f'.{ServiceConstants.config}'
+                           f'.actions.{sub.streaming_service.command}'
+                           f'.events.{sub.event}.http')
+
+        http_conf = conf.get('unsubscribe')
+        if not http_conf:
+            self.logger.debug(f'No unsubscribe call required for {sub}')
+            return
+
+        url = f'http://{sub.streaming_service.hostname}' \
+              f':{http_conf.get("port", conf.get("port", 80))}' \
+              f'{http_conf["path"]}'
 
-            client = AsyncHTTPClient()
-            self.logger.debug(f'Unsubscribing {sub}...')
+        client = AsyncHTTPClient()
+        self.logger.debug(f'Unsubscribing {sub}...')
 
-            method = http_conf.get('method', 'post')
+        method = http_conf.get('method', 'post')
 
-            kwargs = {
-                'method': method.upper(),
-                'body': json.dumps(sub.payload['sub_body']),
-                'headers': {
-                    'Content-Type': 'application/json; charset=utf-8'
-                }
+        kwargs = {
+            'method': method.upper(),
+            'body': json.dumps(sub.payload['sub_body']),
+            'headers': {
+                'Content-Type': 'application/json; charset=utf-8'
             }
+        }
 
-            response = await HttpUtils.fetch_with_retry(3, self.logger, url,
-                                                        client, kwargs)
-            if int(response.code / 100) == 2:
-                self.logger.debug(f'Unsubscribed!')
-            else:
-                self.logger.error(f'Failed to unsubscribe {sub}!')
+        response = await HttpUtils.fetch_with_retry(3, self.logger, url,
+                                                    client, kwargs)
+        if int(response.code / 100) == 2:
+            self.logger.debug(f'Unsubscribed!')
+        else:
+            self.logger.error(f'Failed to unsubscribe {sub}!')
 
     async def destroy(self):
         """
@@ -252,3 +579,4 @@ class App:
         """
         await self.clear_subscriptions_synapse()
         await self.unsubscribe_all()
+        self.clear_containers()
@@ -8,10 +8,12 @@ Expose = namedtuple('Expose',
                     ['service', 'service_expose_name', 'http_path'])
 
 KEY_EXPOSE = 'expose'
+KEY_LOOP_CONCURRENCY = 'loops.concurrency'
 
 
 class AppConfig:
     _expose: typing.List[Expose] = None
+    _loop_concurrency: int = 1
 
     def __init__(self, raw: dict):
         self._expose = []
@@ -25,5 +27,16 @@ class AppConfig:
             assert e.http_path is not None
             self._expose.append(e)
 
+        self._loop_concurrency = int(Dict.find(raw, KEY_LOOP_CONCURRENCY, 1))
+        assert self._loop_concurrency >= 1
+
     def get_expose_config(self):
         return self._expose
+
+    def get_loop_concurrency(self):
+        """
+        Returns the number of iterations of a for loop which may run at the
+        same time. Only loops which are safe to run in parallel are affected
+        (see Compiler#index_loops). 1 (the default) disables parallel loops.
+        """
+        return self._loop_concurrency
@@ -1,16 +1,13 @@
 # -*- coding: utf-8 -*-
 import asyncio
-import os
-import select
-import signal
-import threading
-
-import psycopg2
+import time
 
+from . import Metrics
 from .App import App, AppData
 from .AppConfig import AppConfig, KEY_EXPOSE
 from .Config import Config
 from .Containers import Containers
+from .DeployScheduler import DeployScheduler, PRIORITY_NOTIFIED
 from .DeploymentLock import DeploymentLock
 from .Exceptions import StoryscriptError, TooManyActiveApps, TooManyServices, \
     TooManyVolumes
@@ -19,6 +16,7 @@ from .Logger import Logger
 from .Sentry import Sentry
 from .constants.ServiceConstants import ServiceConstants
 from .db.Database import Database
+from .db.Listener import Listener
 from .entities.Release import Release
 from .enums.ReleaseState import ReleaseState
 from .utils.Dict import Dict
@@ -26,7 +24,8 @@ from .utils.Dict import Dict
 MAX_VOLUMES_BETA = 15
 MAX_SERVICES_BETA = 15
 MAX_ACTIVE_APPS = 5
-DEPLOYMENT_BATCH_SIZE = 100
+DEPLOYMENT_CONCURRENCY = 100
+DRAIN_TIMEOUT_SECONDS = 30
 
 
 class Apps:
@@ -37,6 +36,10 @@ class Apps:
 
     deployment_lock = DeploymentLock()
 
+    release_listener: Listener = None
+
+    deploy_scheduler: DeployScheduler = None
+
     apps = {}
     """
     Keeps a reference to all apps. Keyed by their app_id,
@@ -48,7 +51,13 @@ class Apps:
         return AppConfig(raw)
 
     @classmethod
-    async def deploy_release(cls, config: Config, release: Release):
+    async def deploy_release(cls, config: Config, release: Release,
+                             old_app: App = None):
+        """
+        Deploys a release of an app. If a previous release of the app is
+        running (old_app), it keeps running until the new release is ready
+        to take its place (see Apps#switch_over), and is retired afterwards.
+        """
         app_id = release.app_uuid
         stories = release.stories
 
@@ -61,9 +70,9 @@ class Apps:
             return
 
         if release.deleted:
-            Database.update_release_state(logger, config, app_id,
-                                          release.version,
-                                          ReleaseState.NO_DEPLOY)
+            await Database.update_release_state(
+                logger, config, app_id, release.version,
+                ReleaseState.NO_DEPLOY)
             logger.warn(f'Deployment halted {app_id}@{release.version}; '
                         f'deleted={release.deleted}; '
                         f'maintenance={release.maintenance}')
@@ -71,16 +80,20 @@ class Apps:
                         f'{release.version}')
             return
 
-        Database.update_release_state(logger, config, app_id,
-                                      release.version,
-                                      ReleaseState.DEPLOYING)
+        await Database.update_release_state(
+            logger, config, app_id, release.version,
+            ReleaseState.DEPLOYING)
 
         try:
             # Check for the currently active apps by the same owner.
             # Note: This is a super inefficient method, but is OK
             # since it'll last only during beta.
             active_apps = 0
-            for app in cls.apps.values():
+            for other_app_id, app in cls.apps.items():
+                if other_app_id == app_id:
+                    # This app is being replaced.
+                    continue
+
                 if app is not None and app.owner_uuid == release.owner_uuid:
                     active_apps += 1
 
@@ -114,27 +127,150 @@ class Apps:
                 )
             )
 
-            await Containers.clean_app(app)
-            await Containers.init(app)
-            await app.bootstrap()
+            # If this version of the app was deployed already (eg: before
+            # the engine restarted), its containers might still be running.
+            adopted = False
+            if old_app is None and \
+                    release.state == ReleaseState.DEPLOYED.value:
+                adopted = await app.adopt()
+
+            if adopted:
+                logger.info(f'Adopted the running containers of app '
+                            f'{app_id}@{release.version}')
+            else:
+                # Containers which are identical in this release are kept
+                # (see Containers#get_container_name), and only the ones
+                # which have changed are created. The rest are removed
+                # once they've been replaced (see below).
+                await Containers.init(app)
+                if old_app is not None:
+                    await app.prepare()
+                    await cls.switch_over(old_app, app)
+                else:
+                    await app.bootstrap()
 
             cls.apps[app_id] = app
-            Database.update_release_state(logger, config, app_id,
-                                          release.version,
-                                          ReleaseState.DEPLOYED)
+            await Database.update_release_state(
+                logger, config, app_id, release.version,
+                ReleaseState.DEPLOYED)
 
             logger.info(f'Successfully deployed app {app_id}@'
                         f'{release.version}')
         except BaseException as e:
-            Database.update_release_state(logger, config, app_id,
-                                          release.version,
-                                          ReleaseState.FAILED)
+            await Database.update_release_state(
+                logger, config, app_id, release.version,
+                ReleaseState.FAILED)
             if isinstance(e, StoryscriptError):
                 logger.error(str(e))
             else:
                 logger.error(f'Failed to bootstrap app ({e})', exc=e)
                 Sentry.capture_exc(e)
 
+            if old_app is not None:
+                # The old app keeps running, so the containers which were
+                # created for this release (and only those) are removed.
+                try:
+                    await Containers.prune(old_app)
+                except BaseException as prune_exc:
+                    logger.error(f'Failed to remove the containers of app '
+                                 f'{app_id}@{release.version}',
+                                 exc=prune_exc)
+                    Sentry.capture_exc(prune_exc)
+            return
+
+        try:
+            if old_app is not None:
+                await cls.retire_app(old_app)
+
+            if not adopted:
+                await Containers.prune(app)
+        except BaseException as e:
+            logger.error(f'Failed to clean up after deploying app '
+                         f'{app_id}@{release.version}', exc=e)
+            Sentry.capture_exc(e)
+
+    @classmethod
+    async def switch_over(cls, old_app: App, app: App):
+        """
+        Replaces a running app with a new release of it, whose containers
+        are ready: the old app is unsubscribed, the new one takes its
+        place in Apps#apps, and its stories are run (which subscribe it).
+        It takes its place first, since events for the new release may
+        arrive as soon as its first story has subscribed (see
+        StoryEventHandler#run_story). If its stories fail to run, the old
+        app is put back (see Apps#switch_back).
+        Events aren't delivered while this happens, which is measured.
+        """
+        start = time.time()
+        old_app.logger.info(f'Switching app {old_app.app_id} over to '
+                            f'version {app.version}')
+        try:
+            await Database.update_release_state(
+                old_app.logger, old_app.config, old_app.app_id,
+                old_app.version, ReleaseState.TERMINATING)
+            try:
+                await old_app.destroy()
+            except BaseException as e:
+                old_app.logger.error(
+                    f'Failed to unsubscribe app {old_app.app_id}@'
+                    f'{old_app.version}; will eat exception', exc=e)
+
+            cls.apps[app.app_id] = app
+            try:
+                await app.run_stories()
+            except BaseException as e:
+                await cls.switch_back(old_app, app)
+                raise e
+        finally:
+            Metrics.app_switchover_seconds.labels(
+                app_id=app.app_id).observe(time.time() - start)
+
+    @classmethod
+    async def switch_back(cls, old_app: App, app: App):
+        """
+        Puts a running app back in place of a new release of it, whose
+        stories failed to run (see Apps#switch_over): the new app is
+        unsubscribed, and the stories of the old one are run again.
+        """
+        old_app.logger.warn(f'Switching app {old_app.app_id} back to '
+                            f'version {old_app.version}')
+        try:
+            await app.destroy()
+        except BaseException as e:
+            app.logger.error(f'Failed to unsubscribe app {app.app_id}@'
+                             f'{app.version}; will eat exception', exc=e)
+
+        cls.apps[old_app.app_id] = old_app
+        try:
+            await old_app.run_stories()
+        except BaseException as e:
+            old_app.logger.error(f'Failed to run the stories of app '
+                                 f'{old_app.app_id}@{old_app.version} '
+                                 f'again', exc=e)
+            Sentry.capture_exc(e)
+            return
+
+        await Database.update_release_state(
+            old_app.logger, old_app.config, old_app.app_id,
+            old_app.version, ReleaseState.DEPLOYED)
+
+    @classmethod
+    async def retire_app(cls, app: App):
+        """
+        Waits for the stories which a replaced app is executing to finish
+        (see App#drain), before its containers may be removed.
+        """
+        start = time.time()
+        if not await app.drain(DRAIN_TIMEOUT_SECONDS):
+            app.logger.warn(f'Timed out waiting for stories of app '
+                            f'{app.app_id}@{app.version} to finish')
+
+        Metrics.app_drain_seconds.labels(
+            app_id=app.app_id).observe(time.time() - start)
+        await Database.update_release_state(
+            app.logger, app.config, app.app_id, app.version,
+            ReleaseState.TERMINATED)
+
     @classmethod
     def make_logger_for_app(cls, config, app_id, version):
         logger = Logger(config)
@@ -142,20 +278,37 @@ class Apps:
         logger.adapt(app_id, version)
         return logger
 
+    @classmethod
+    def get_deploy_scheduler(cls, config: Config,
+                             glogger: Logger) -> DeployScheduler:
+        if cls.deploy_scheduler is None:
+            async def deploy(app_id, release):
+                await cls.reload_app(config, glogger, app_id, release=release)
+
+            cls.deploy_scheduler = DeployScheduler(
+                deploy, DEPLOYMENT_CONCURRENCY, glogger)
+
+        return cls.deploy_scheduler
+
+    @classmethod
+    def close_deploy_scheduler(cls):
+        if cls.deploy_scheduler is not None:
+            cls.deploy_scheduler.close()
+            cls.deploy_scheduler = None
+
     @classmethod
     async def reload_apps(cls, config, glogger):
         """
-        Split apps in batches, where all apps in a batch
-        are deployed together in parallel
-        and subsequent batches are deployed sequentially
+        Deploys the latest release of every app.
+
+        The releases are streamed from the database as they're read (in a
+        single query), and queued up in the deploy scheduler straight away.
         """
-        apps = Database.get_all_app_uuids_for_deployment(config)
-        for i in range(0, len(apps), DEPLOYMENT_BATCH_SIZE):
-            current_batch = apps[i: i + DEPLOYMENT_BATCH_SIZE]
-            await asyncio.gather(*[
-                cls.reload_app(config, glogger, app['uuid'])
-                for app in current_batch
-            ])
+        scheduler = cls.get_deploy_scheduler(config, glogger)
+        async for release in Database.get_releases_for_deployment(config):
+            scheduler.submit(release.app_uuid, release)
+
+        await scheduler.join()
 
     @classmethod
     async def init_all(cls, sentry_dsn: str, release: str,
@@ -166,17 +319,13 @@ class Apps:
         # before an app is even deployed.
         # If we start listening after all the apps are deployed,
         # then we might miss some notifications about releases.
-        loop = asyncio.get_event_loop()
-        release_listener = threading.Thread(target=cls.listen_to_releases,
-                                            args=[config, glogger, loop],
-                                            daemon=True)
-        release_listener.start()
+        await cls.listen_to_releases(config, glogger)
 
         await cls.reload_apps(config, glogger)
 
     @classmethod
     def get(cls, app_id: str):
-        return cls.apps[app_id]
+        return cls.apps.get(app_id)
 
     @classmethod
     async def get_services(cls, asyncy_yaml, glogger: Logger,
@@ -216,17 +365,23 @@ class Apps:
 
     @classmethod
     async def destroy_app(cls, app: App, silent=False,
-                          update_db_state=False):
+                          update_db_state=False, keep_containers=False):
+        """
+        Unsubscribes the app from all its subscriptions, and removes all
+        its containers, unless keep_containers is True (in which case, they
+        may be adopted when the app is deployed again, see App#adopt).
+        """
         app.logger.info(f'Destroying app {app.app_id}')
         try:
             if update_db_state:
-                Database.update_release_state(app.logger, app.config,
-                                              app.app_id, app.version,
-                                              ReleaseState.TERMINATING)
+                await Database.update_release_state(
+                    app.logger, app.config, app.app_id, app.version,
+                    ReleaseState.TERMINATING)
 
             await app.destroy()
 
-            await Containers.clean_app(app)
+            if not keep_containers:
+                await Containers.clean_app(app)
         except BaseException as e:
             if not silent:
                 raise e
@@ -235,30 +390,52 @@ class Apps:
                 f'will eat exception (silent=True)',
                 exc=e)
         finally:
+            Containers.close_app(app)
             if update_db_state:
-                Database.update_release_state(app.logger, app.config,
-                                              app.app_id, app.version,
-                                              ReleaseState.TERMINATED)
+                await Database.update_release_state(
+                    app.logger, app.config, app.app_id, app.version,
+                    ReleaseState.TERMINATED)
 
         app.logger.info(f'Completed destroying app {app.app_id}')
         cls.apps[app.app_id] = None
 
     @classmethod
-    async def reload_app(cls, config: Config, glogger: Logger, app_id: str):
+    async def reload_app(cls, config: Config, glogger: Logger, app_id: str,
+                         release: Release = None):
+        """
+        Deploys the latest release of an app. If the app is running, it's
+        replaced by the new release once that's ready (see
+        Apps#deploy_release), or destroyed first if the release won't be
+        deployed. If the release has already been read from the database,
+        it may be passed in.
+        """
         glogger.info(f'Reloading app {app_id}')
-        if cls.apps.get(app_id) is not None:
-            await cls.destroy_app(cls.apps[app_id], silent=True,
-                                  update_db_state=True)
-
         can_deploy = False
 
         try:
             can_deploy = await cls.deployment_lock.try_acquire(app_id)
             if not can_deploy:
                 glogger.warn(f'Another deployment for app {app_id} is in '
-                             f'progress. Will not reload.')
+                             f'progress. Will reload once it is done.')
                 return
-            release = Database.get_release_for_deployment(config, app_id)
+
+            if release is None:
+                release = await Database.get_release_for_deployment(
+                    config, app_id)
+
+            app = cls.apps.get(app_id)
+            if app is not None and cls.is_story_only_change(app, release):
+                swapped = await asyncio.wait_for(
+                    cls.hot_swap(config, app, release), timeout=5 * 60)
+                if swapped:
+                    glogger.info(f'Hot swapped the stories of app '
+                                 f'{app_id}@{release.version}')
+                    return
+
+            if app is not None and not cls.is_deployable(release):
+                await cls.destroy_app(app, silent=True, update_db_state=True)
+                app = None
+
             if release.state == ReleaseState.FAILED.value:
                 glogger.warn(f'Cowardly refusing to deploy app '
                              f'{app_id}@{release.version} as it\'s '
@@ -273,7 +450,8 @@ class Apps:
             await asyncio.wait_for(
                 cls.deploy_release(
                     config=config,
-                    release=release
+                    release=release,
+                    old_app=app
                 ),
                 timeout=5 * 60)
             glogger.info(f'Reloaded app {app_id}@{release.version}')
@@ -284,46 +462,129 @@ class Apps:
             if isinstance(e, asyncio.TimeoutError):
                 logger = cls.make_logger_for_app(config, app_id,
                                                  release.version)
-                Database.update_release_state(logger, config, app_id,
-                                              release.version,
-                                              ReleaseState.TIMED_OUT)
+                await Database.update_release_state(
+                    logger, config, app_id, release.version,
+                    ReleaseState.TIMED_OUT)
         finally:
-            if can_deploy:
-                # If we did acquire the lock, then we must release it.
-                await cls.deployment_lock.release(app_id)
+            # If we did acquire the lock, then we must release it.
+            if can_deploy and await cls.deployment_lock.release(app_id):
+                # Releases were pushed during this deployment. Deploy again,
+                # which will pick up the latest one.
+                glogger.info(f'Deploying app {app_id} again, since it was '
+                             f'released during the deployment')
+                cls.get_deploy_scheduler(config, glogger).submit(
+                    app_id, priority=PRIORITY_NOTIFIED)
 
     @classmethod
-    async def destroy_all(cls):
+    def is_deployable(cls, release: Release) -> bool:
+        """
+        Returns whether a release will be deployed (see reload_app and
+        deploy_release), rather than just stopping the app.
+        """
+        return release.stories is not None and not release.deleted and \
+            not release.maintenance and \
+            release.state != ReleaseState.FAILED.value
+
+    @classmethod
+    def is_story_only_change(cls, app: App, release: Release) -> bool:
+        """
+        Returns whether a release changes nothing but the stories of an
+        app which is running, so that they can be hot swapped.
+        """
+        if not cls.is_deployable(release):
+            return False
+
+        if release.always_pull_images is True:
+            # Every release pulls the images again (see
+            # Containers#hash_service_spec).
+            return False
+
+        def without_stories(r: Release):
+            rest = {
+                k: v for k, v in r.stories.items()
+                if k not in ['stories', 'entrypoint']
+            }
+            return r._replace(version=None, state=None, stories=rest)
+
+        return without_stories(app.release) == without_stories(release)
+
+    @classmethod
+    async def hot_swap(cls, config: Config, app: App,
+                       release: Release) -> bool:
+        """
+        Swaps the stories of a running app for the ones of a release
+        which changes nothing else (see App#hot_swap), instead of
+        destroying and deploying it again.
+
+        Returns False if that failed (or the new stories need other
+        containers), in which case the app must be deployed again.
+        """
+        old_version = app.version
+        logger = cls.make_logger_for_app(config, app.app_id, release.version)
+        logger.info(f'Hot swapping the stories of app '
+                    f'{app.app_id}@{release.version}')
+        await Database.update_release_state(
+            logger, config, app.app_id, release.version,
+            ReleaseState.DEPLOYING)
+
+        try:
+            swapped = await app.hot_swap(release, logger)
+        except BaseException as e:
+            # The app is still on the old release, which stays deployed
+            # until it's replaced.
+            logger.error(f'Failed to hot swap the stories ({e}), '
+                         f'deploying the app again', exc=e)
+            return False
+
+        if not swapped:
+            logger.info(f'The stories of app {app.app_id}@{release.version} '
+                        f'use other containers; deploying the app again')
+            return False
+
+        await Database.update_release_state(
+            logger, config, app.app_id, old_version, ReleaseState.TERMINATED)
+        await Database.update_release_state(
+            logger, config, app.app_id, release.version,
+            ReleaseState.DEPLOYED)
+        return True
+
+    @classmethod
+    async def destroy_all(cls, keep_containers=False):
         copy = cls.apps.copy()
         for app in copy.values():
             try:
-                await cls.destroy_app(app)
+                await cls.destroy_app(app, keep_containers=keep_containers)
             except BaseException as e:
                 Sentry.capture_exc(e)
 
     @classmethod
-    def listen_to_releases(cls, config: Config, glogger: Logger, loop):
+    async def reload_queued_apps(cls, config: Config, glogger: Logger):
+        """
+        Reloads the apps which have a release queued for deployment.
+        Used to catch up on the releases which were notified while the
+        release listener was disconnected.
+        """
+        scheduler = cls.get_deploy_scheduler(config, glogger)
+        for app in await Database.get_queued_app_uuids(config):
+            scheduler.submit(app['uuid'])
+
+    @classmethod
+    async def listen_to_releases(cls, config: Config, glogger: Logger):
         glogger.info('Listening for new releases...')
-        conn = Database.new_pg_conn(config)
-        conn.set_isolation_level(
-            psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
 
-        cur = conn.cursor()
-        cur.execute('listen release;')
+        def on_notify(app_id):
+            cls.get_deploy_scheduler(config, glogger).submit(
+                app_id, priority=PRIORITY_NOTIFIED)
 
-        while True:
-            try:
-                if select.select([conn], [], [], 5) == ([], [], []):
-                    continue
-                else:
-                    conn.poll()
-                    while conn.notifies:
-                        notify = conn.notifies.pop(0)
-                        asyncio.run_coroutine_threadsafe(
-                            cls.reload_app(config, glogger, notify.payload),
-                            loop)
-            except (psycopg2.InterfaceError, psycopg2.OperationalError):
-                glogger.error('Connection to the DB has failed. Exiting.')
-                # Because _thread.interrupt_main() doesn't work.
-                os.kill(os.getpid(), signal.SIGINT)
-                break
+        async def on_reconnect():
+            await cls.reload_queued_apps(config, glogger)
+
+        cls.release_listener = Listener(config.POSTGRES, 'release', glogger,
+                                        on_notify, on_reconnect)
+        await cls.release_listener.start()
+
+    @classmethod
+    def stop_listening_to_releases(cls):
+        if cls.release_listener is not None:
+            cls.release_listener.close()
+            cls.release_listener = None
@@ -16,10 +16,18 @@ class Config:
         'POSTGRES': 'options='
                     '--search_path=app_public,app_hidden,app_private,public '
                     'dbname=postgres user=postgres',
+        'POSTGRES_POOL_SIZE': 10,
         'ENGINE_HOST': socket.gethostname(),
         'CLUSTER_CERT': '',
         'CLUSTER_AUTH_TOKEN': '',
-        'CLUSTER_HOST': 'kubernetes.default.svc'
+        'CLUSTER_HOST': 'kubernetes.default.svc',
+        'K8S_MAX_CLIENTS': 50,
+        'K8S_QPS': 50,
+        'K8S_BURST': 100,
+        'STORY_SLICE_LINES': 1000,
+        'STORY_SLICE_MICROSECONDS': 10000,
+        'STORY_MAX_STEPS': 0,
+        'STORY_MAX_SECONDS': 0
     }
 
     ENGINE_PORT = None
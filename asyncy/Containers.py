@@ -25,6 +25,7 @@ class Containers:
 
     @classmethod
     async def prepare_for_deployment(cls, story):
+        story.app.clear_containers()
         await Kubernetes.clean_namespace(story.app)
 
     @classmethod
@@ -42,6 +43,38 @@ class Containers:
         omg = app.services[service][ServiceConstants.config]
         image = omg.get('image', service)
 
+        start_command = cls.get_start_command(app, line, service)
+        shutdown_command = Dict.find(omg, f'lifecycle.shutdown.command')
+
+        volumes = []
+        if omg.get('volumes'):
+            for name, data in omg['volumes'].items():
+                vol_name = cls.hash_volume_name(app, line, service, name)
+                persist = data.get('persist', False)
+                target = data.get('target', False)
+
+                volumes.append(Volume(persist=persist, name=vol_name,
+                                      mount_path=target))
+
+        registry_url = cls.get_registry_url(image)
+        container_configs = list(map(lambda config: ContainerConfig(
+            name=cls.get_containerconfig_name(config),
+            data=config.data
+        ), await Database.get_container_configs(app, registry_url)))
+
+        env = cls.get_environment(app, service)
+
+        await Kubernetes.create_pod(app=app, service=service, image=image,
+                                    container_name=container_name,
+                                    start_command=start_command,
+                                    shutdown_command=shutdown_command, env=env,
+                                    volumes=volumes,
+                                    container_configs=container_configs)
+
+    @classmethod
+    def get_start_command(cls, app, line, service):
+        omg = app.services[service][ServiceConstants.config]
+
         action = None
         if line is not None:
             action = line[LineConstants.command]
@@ -53,8 +86,6 @@ class Containers:
             if command_conf is None:
                 raise ActionNotFound(service=service, action=action)
 
-        shutdown_command = Dict.find(omg, f'lifecycle.shutdown.command')
-
         if command_conf is not None and command_conf.get('run'):
             start_command = Dict.find(command_conf, 'run.command')
         else:
@@ -63,21 +94,11 @@ class Containers:
         if start_command is None:
             start_command = ['tail', '-f', '/dev/null']
 
-        volumes = []
-        if omg.get('volumes'):
-            for name, data in omg['volumes'].items():
-                vol_name = cls.hash_volume_name(app, line, service, name)
-                persist = data.get('persist', False)
-                target = data.get('target', False)
+        return start_command
 
-                volumes.append(Volume(persist=persist, name=vol_name,
-                                      mount_path=target))
-
-        registry_url = cls.get_registry_url(image)
-        container_configs = list(map(lambda config: ContainerConfig(
-            name=cls.get_containerconfig_name(app, config.name),
-            data=config.data
-        ), Database.get_container_configs(app, registry_url)))
+    @classmethod
+    def get_environment(cls, app, service):
+        omg = app.services[service][ServiceConstants.config]
 
         env = {}
         for key, omg_config in omg.get('environment', {}).items():
@@ -91,17 +112,53 @@ class Containers:
             if actual_val is not None:
                 env[key] = actual_val
 
-        await Kubernetes.create_pod(app=app, service=service, image=image,
-                                    container_name=container_name,
-                                    start_command=start_command,
-                                    shutdown_command=shutdown_command, env=env,
-                                    volumes=volumes,
-                                    container_configs=container_configs)
+        return env
 
     @classmethod
     async def clean_app(cls, app):
         await Kubernetes.clean_namespace(app)
 
+    @classmethod
+    async def prune(cls, app):
+        """
+        Removes the containers and ingresses left over from the previous
+        releases of an app, which this release doesn't use.
+        Must be called once the app has been bootstrapped.
+        """
+        ingress_names = set()
+        for expose in app.app_config.get_expose_config():
+            container_name = cls.get_container_name(app, None, None,
+                                                    expose.service)
+            ingress_names.add(cls.hash_ingress_name(
+                expose, container_name, cls.get_ingress_hostname(app, expose)))
+
+        await Kubernetes.prune_namespace(app, app.get_container_names(),
+                                         ingress_names)
+
+    @classmethod
+    def close_app(cls, app):
+        """
+        Stops caching the Kubernetes resources of an app which has been
+        destroyed.
+        """
+        Kubernetes.close_informer(app)
+
+    @classmethod
+    async def adopt(cls, app, container_names: set) -> bool:
+        """
+        Registers the containers of an app which are already running,
+        if they're exactly the given ones, and they're all ready.
+        Returns whether they were. See App#adopt.
+        """
+        deployments = await Kubernetes.get_deployments_readiness(app)
+        if deployments != {name: True for name in container_names}:
+            return False
+
+        for name in container_names:
+            app.add_container(name, Kubernetes.get_hostname(app, name))
+
+        return True
+
     @classmethod
     async def init(cls, app):
         await Kubernetes.create_namespace(app)
@@ -138,13 +195,25 @@ class Containers:
         else:
             return image[:i]
 
+    @classmethod
+    async def start_exposed(cls, app, service):
+        """
+        Creates and starts the container of an exposed service, unless
+        it's been started already. Returns its name.
+        """
+        container_name = cls.get_container_name(app, None, None, service)
+        if app.get_container_hostname(container_name) is None:
+            await cls.create_and_start(app, None, service, container_name)
+            app.add_container(container_name,
+                              Kubernetes.get_hostname(app, container_name))
+
+        return container_name
+
     @classmethod
     async def expose_service(cls, app, expose: Expose):
-        container_name = cls.get_container_name(app, None, None,
-                                                expose.service)
-        await cls.create_and_start(app, None, expose.service, container_name)
-        ingress_name = cls.hash_ingress_name(expose)
-        hostname = f'{app.app_dns}--{cls.get_simple_name(expose.service)}'
+        container_name = await cls.start_exposed(app, expose.service)
+        hostname = cls.get_ingress_hostname(app, expose)
+        ingress_name = cls.hash_ingress_name(expose, container_name, hostname)
         await Kubernetes.create_ingress(ingress_name, app,
                                         expose, container_name,
                                         hostname=hostname)
@@ -153,26 +222,36 @@ class Containers:
                         f'https://{hostname}.{app.config.APP_DOMAIN}'
                         f'{expose.http_path}')
 
+    @classmethod
+    def get_ingress_hostname(cls, app, expose: Expose):
+        return f'{app.app_dns}--{cls.get_simple_name(expose.service)}'
+
     @classmethod
     async def start(cls, story, line):
         """
         Creates and starts a container as declared by line['service'].
 
         If a container already exists, then it will be reused.
+        Containers which have been started by this app already are looked
+        up in it's registry (see App#add_container), without calling
+        the database or Kubernetes.
         """
         service = line[LineConstants.service]
-        story.logger.info(f'Starting container {service}')
         container_name = cls.get_container_name(story.app, story.name,
                                                 line, service)
-        await cls.create_and_start(story.app, line, service, container_name)
-        hostname = await cls.get_hostname(story, line, service)
+        hostname = story.app.get_container_hostname(container_name)
 
-        ss = StreamingService(name=service, command=line['command'],
-                              container_name=container_name,
-                              hostname=hostname)
+        if hostname is None:
+            story.logger.info(f'Starting container {service}')
+            await cls.create_and_start(story.app, line, service,
+                                       container_name)
+            hostname = await cls.get_hostname(story, line, service)
+            story.app.add_container(container_name, hostname)
+            story.logger.info(f'Started container {container_name}')
 
-        story.logger.info(f'Started container {container_name}')
-        return ss
+        return StreamingService(name=service, command=line['command'],
+                                container_name=container_name,
+                                hostname=hostname)
 
     @classmethod
     def format_command(cls, story, line, container_name, command):
@@ -214,9 +293,9 @@ class Containers:
         return command_parts
 
     @classmethod
-    def get_containerconfig_name(cls, app, name):
-        simple_name = cls.get_simple_name(name)[:20]
-        h = cls.hash_containerconfig_name(app, name)
+    def get_containerconfig_name(cls, config: ContainerConfig):
+        simple_name = cls.get_simple_name(config.name)[:20]
+        h = cls.hash_containerconfig_name(config)
         return f'{simple_name}-{h}'
 
     @classmethod
@@ -224,11 +303,15 @@ class Containers:
         """
         If a container can be reused (where reuse is defined as a command
         without a run section in it's config), it'll return a generic name
-        like twitter-hash(twitter), otherwise something derived:
-        twitter-hash(twitter, story name, line number).
+        like twitter-hash(twitter, spec), otherwise something derived:
+        twitter-hash(twitter, spec, story name, line number).
 
         Why a hash? Story names can have DNS reserved characters in them,
         and hence to normalise it, we need to create a hash here.
+
+        The spec (see hash_service_spec) is used instead of the version of
+        the app, so that the containers which a new release doesn't change
+        are kept, instead of being created again.
         """
         # simple_name is included in the container name to aid debugging only.
         # It's 20 chars at max because 41 chars consists
@@ -244,10 +327,47 @@ class Containers:
 
     @classmethod
     def hash_service_name_and_story_line(cls, app, story_name, line, name):
-        return hashlib.sha1(f'{name}-{app.version}-'
+        spec = cls.hash_service_spec(app, line, name)
+        return hashlib.sha1(f'{name}-{spec}-'
                             f'{story_name}-{line["ln"]}'
                             .encode('utf-8')).hexdigest()
 
+    @classmethod
+    def hash_service_spec(cls, app, line, service):
+        """
+        Hashes everything which a container is created from: the OMG
+        of its service (which includes the image and the lifecycle),
+        its environment and start command. The credentials of the
+        registry aren't included, since they're only used for pulling.
+        If the app always pulls its images, the version of the app is
+        included too, so that every release pulls them again (eg: the
+        latest tag).
+
+        None of these change for as long as the app runs (its stories
+        may be hot swapped, but not its services), so the hash is
+        computed once per service and action, and then kept in
+        app.service_spec_hashes, since it's needed for every call made
+        to a service (see Containers#get_container_name).
+        """
+        key = (service, None if line is None else line[LineConstants.command])
+        h = app.service_spec_hashes.get(key)
+        if h is not None:
+            return h
+
+        spec = {
+            'omg': app.services[service][ServiceConstants.config],
+            'environment': cls.get_environment(app, service),
+            'start_command': cls.get_start_command(app, line, service),
+            'image_pull_policy': app.image_pull_policy()
+        }
+        if app.always_pull_images is True:
+            spec['version'] = app.version
+
+        h = hashlib.sha1(ujson.dumps(spec, sort_keys=True)
+                         .encode('utf-8')).hexdigest()
+        app.service_spec_hashes[key] = h
+        return h
+
     @classmethod
     def get_simple_name(cls, string):
         parts = re.findall('[a-zA-Z]*', string)
@@ -260,13 +380,16 @@ class Containers:
 
     @classmethod
     def hash_service_name(cls, app, name):
-        return hashlib.sha1(f'{name}-{app.version}'
+        spec = cls.hash_service_spec(app, None, name)
+        return hashlib.sha1(f'{name}-{spec}'
                             .encode('utf-8')).hexdigest()
 
     @classmethod
-    def hash_ingress_name(cls, expose: Expose):
+    def hash_ingress_name(cls, expose: Expose, container_name: str,
+                          hostname: str):
         simple_name = cls.get_simple_name(expose.service_expose_name)[:20]
-        h = hashlib.sha1(f'{expose.service}-{expose.service_expose_name}'
+        h = hashlib.sha1(f'{expose.service}-{expose.service_expose_name}-'
+                         f'{expose.http_path}-{container_name}-{hostname}'
                          .encode('utf-8')).hexdigest()
         return f'{simple_name}-{h}'
 
@@ -282,8 +405,9 @@ class Containers:
         return f'{simple_name}-{h}'
 
     @classmethod
-    def hash_containerconfig_name(cls, app, name):
-        return hashlib.sha1(f'{app.version}-{name}'
+    def hash_containerconfig_name(cls, config: ContainerConfig):
+        data = ujson.dumps(config.data, sort_keys=True)
+        return hashlib.sha1(f'{config.name}-{data}'
                             .encode('utf-8')).hexdigest()
 
     @classmethod
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import itertools
+import time
+
+from . import Metrics
+from .Logger import Logger
+from .entities.Release import Release
+
+PRIORITY_NOTIFIED = -1
+"""
+Releases which have just been pushed are deployed ahead of everything else.
+"""
+
+
+class DeployScheduler:
+    """
+    Deploys apps with a bounded pool of workers, which pull from a priority
+    queue. A slow deployment only ever holds up its own worker, so the time
+    taken to deploy many apps is proportional to the total work divided by
+    the concurrency.
+
+    Lower priorities are deployed first. Unless given, the priority is the
+    number of services the app uses, so that small apps come up first.
+    Apps with the same priority are deployed in the order submitted.
+
+    An app which is submitted again while still queued is only deployed
+    once, with the release (and the highest priority) submitted last.
+    """
+
+    def __init__(self, deploy, concurrency: int, logger: Logger):
+        """
+        deploy is a coroutine function, called with the app_id and the
+        release (which may be None, if it hasn't been read yet).
+        """
+        assert concurrency >= 1
+        self.deploy = deploy
+        self.concurrency = concurrency
+        self.logger = logger
+        self.queue = asyncio.PriorityQueue()
+        self.workers = []
+        self.queued = {}
+        """
+        The release and the priority of the apps which are queued,
+        keyed by app_id.
+        """
+        self._sequence = itertools.count()
+
+    @staticmethod
+    def priority(release: Release):
+        if release is None or not isinstance(release.stories, dict):
+            return 0
+
+        return len(release.stories.get('services', []))
+
+    def submit(self, app_id: str, release: Release = None, priority=None):
+        if priority is None:
+            priority = self.priority(release)
+
+        queued = self.queued.get(app_id)
+        if queued is not None and queued[1] <= priority:
+            # Already queued (to be deployed at least as soon).
+            self.queued[app_id] = (release, queued[1])
+            return
+
+        self.queued[app_id] = (release, priority)
+        self.queue.put_nowait((priority, next(self._sequence), time.time(),
+                               app_id))
+        Metrics.deploy_queue_size.set(len(self.queued))
+
+        while len(self.workers) < self.concurrency:
+            self.workers.append(asyncio.ensure_future(self.work()))
+
+    async def join(self):
+        """
+        Waits until everything submitted has been deployed.
+        """
+        await self.queue.join()
+
+    def close(self):
+        for worker in self.workers:
+            worker.cancel()
+
+        self.workers = []
+
+    async def work(self):
+        while True:
+            _, _, queued_at, app_id = await self.queue.get()
+            if app_id not in self.queued:
+                # Deployed already, since it was queued again with a
+                # higher priority.
+                self.queue.task_done()
+                continue
+
+            release, _ = self.queued.pop(app_id)
+            Metrics.deploy_queue_size.set(len(self.queued))
+            start = time.time()
+            Metrics.app_deploy_queue_wait_seconds.labels(
+                app_id=app_id
+            ).observe(start - queued_at)
+            try:
+                await self.deploy(app_id, release)
+            except asyncio.CancelledError as e:
+                raise e
+            except BaseException as e:
+                self.logger.error(f'Failed to deploy app {app_id}', exc=e)
+            finally:
+                Metrics.app_deploy_seconds.labels(
+                    app_id=app_id
+                ).observe(time.time() - start)
+                self.queue.task_done()
@@ -6,15 +6,21 @@ class DeploymentLock:
 
     lock = asyncio.Lock()
     apps = {}
+    pending = set()
+    """
+    The apps for which a deployment was attempted while locked.
+    """
 
     async def try_acquire(self, app_id):
         """
         Non blocking acquire. If a deployment can continue, this
         method will return True. If a deployment for an app is already locked,
-        then this will return False.
+        then this will return False, and the app will be marked as pending
+        (see DeploymentLock#release).
         """
         async with self.lock:
             if self.apps.get(app_id):
+                self.pending.add(app_id)
                 return False
 
             self.apps[app_id] = True
@@ -22,5 +28,15 @@ class DeploymentLock:
         return True
 
     async def release(self, app_id):
+        """
+        Releases the lock, and returns True if another deployment was
+        attempted meanwhile (in which case the app must be deployed again).
+        Any number of such attempts collapse into a single one.
+        """
         async with self.lock:
             self.apps.pop(app_id)
+            if app_id in self.pending:
+                self.pending.remove(app_id)
+                return True
+
+        return False
@@ -68,6 +68,11 @@ class ContainerSpecNotRegisteredError(StoryscriptError):
         )
 
 
+class AppNotDeployedError(StoryscriptError):
+    def __init__(self, app_id):
+        super().__init__(message=f'App {app_id} is not deployed')
+
+
 class TooManyVolumes(StoryscriptError):
     def __init__(self, volume_count, max_volumes):
         super().__init__(
@@ -2,26 +2,50 @@
 import asyncio
 import base64
 import json
-import ssl
 import time
 import typing
 import urllib.parse
 from asyncio import TimeoutError
 
-from tornado.httpclient import AsyncHTTPClient, HTTPResponse
+from tornado.httpclient import HTTPResponse
 
 from . import AppConfig
 from .AppConfig import Expose
 from .Exceptions import K8sError
+from .KubernetesClient import KubernetesClient, WATCH_TIMEOUT_SECONDS
+from .KubernetesInformer import KubernetesInformer
+from .RateLimiter import LANE_BULK, LANE_CRITICAL
 from .constants.ServiceConstants import ServiceConstants
 from .entities.ContainerConfig import ContainerConfig, ContainerConfigs
 from .entities.Volume import Volumes
 from .utils.Dict import Dict
-from .utils.HttpUtils import HttpUtils
+
+# List of image pull errors taken from the kubernetes source code
+# github/kubernetes/kubernetes/blob/master/pkg/kubelet/images/types.go
+IMAGE_ERRORS = [
+    'ImagePullBackOff',
+    'ImageInspectError',
+    'ErrImagePull',
+    'ErrImageNeverPull',
+    'RegistryUnavailable',
+    'InvalidImageName'
+]
 
 
 class Kubernetes:
 
+    client: KubernetesClient = None
+    """
+    The client used for all calls to the Kubernetes API.
+    See Kubernetes#get_client.
+    """
+
+    informers: typing.Dict[str, KubernetesInformer] = {}
+    """
+    The cache of the resources in each app's namespace, by app ID.
+    See Kubernetes#get_informer.
+    """
+
     @classmethod
     def is_2xx(cls, res: HTTPResponse):
         return int(res.code / 100) == 2
@@ -97,6 +121,7 @@ class Kubernetes:
             raise K8sError(
                 message=f'Failed to create ingress for expose {expose}!')
 
+        cls.cache_created(app, 'ingresses', res)
         app.logger.debug(f'Kubernetes ingress created')
 
     @classmethod
@@ -126,62 +151,93 @@ class Kubernetes:
         app.logger.debug(f'Kubernetes namespace created')
 
     @classmethod
-    def new_ssl_context(cls):
-        return ssl.SSLContext()
+    def get_client(cls, config) -> KubernetesClient:
+        if cls.client is None:
+            cls.client = KubernetesClient(config)
+        return cls.client
 
     @classmethod
-    async def make_k8s_call(cls, config, logger, path: str,
-                            payload: dict = None,
-                            method: str = 'get') -> HTTPResponse:
-        context = cls.new_ssl_context()
-
-        cert = config.CLUSTER_CERT
-        cert = cert.replace('\\n', '\n')
-        context.load_verify_locations(cadata=cert)
-
-        kwargs = {
-            'ssl_options': context,
-            'headers': {
-                'Authorization': f'bearer {config.CLUSTER_AUTH_TOKEN}',
-                'Content-Type': 'application/json; charset=utf-8'
-            },
-            'method': method.upper()
-        }
+    def get_informer(cls, app) -> KubernetesInformer:
+        informer = cls.informers.get(app.app_id)
+        if informer is None:
+            informer = KubernetesInformer(app)
+            cls.informers[app.app_id] = informer
+        return informer
 
-        if method.lower() == 'patch':
-            kwargs['headers']['Content-Type'] = \
-                'application/merge-patch+json; charset=utf-8'
+    @classmethod
+    def close_informer(cls, app):
+        informer = cls.informers.pop(app.app_id, None)
+        if informer is not None:
+            informer.close()
 
-        if payload is not None:
-            kwargs['body'] = json.dumps(payload)
+    @classmethod
+    def cache_created(cls, app, resource: str, res: HTTPResponse):
+        """
+        Writes a resource which has just been created to the informer,
+        so that it's visible before its watch event arrives.
+        """
+        informer = cls.get_informer(app)
+        if informer.is_synced(resource):
+            informer.put(resource, json.loads(res.body))
 
-            if method == 'get':  # Default value.
-                kwargs['method'] = 'POST'
+    @classmethod
+    def close_client(cls):
+        # Informers watch through the client.
+        for informer in cls.informers.values():
+            informer.close()
+        cls.informers = {}
 
-        client = AsyncHTTPClient()
-        return await HttpUtils.fetch_with_retry(
-            3, logger, f'https://{config.CLUSTER_HOST}{path}',
-            client, kwargs)
+        if cls.client is not None:
+            cls.client.close()
+            cls.client = None
 
     @classmethod
-    async def remove_volume(cls, app, name):
-        await cls._delete_resource(app, 'persistentvolumeclaims', name)
+    async def make_k8s_call(cls, config, logger, path: str,
+                            payload: dict = None, method: str = 'get',
+                            lane: str = LANE_CRITICAL) -> HTTPResponse:
+        """
+        Calls the Kubernetes API. Calls which nothing is waiting for
+        (such as cleaning up) should use LANE_BULK, so that they don't
+        hold up the rest. See RateLimiter.
+        """
+        return await cls.get_client(config).request(logger, path, payload,
+                                                    method, lane)
 
     @classmethod
-    async def _does_resource_exist(cls, app, resource, name):
+    async def watch(cls, app, resource: str, resource_version: str, until,
+                    field_selector: str = None, label_selector: str = None,
+                    timeout_seconds: int = WATCH_TIMEOUT_SECONDS,
+                    lane: str = LANE_CRITICAL) -> bool:
+        """
+        Watches the resources in the app's namespace for changes made
+        after resource_version, until until(event) returns True.
+        See KubernetesClient#watch.
+        """
+        params = {
+            'watch': 'true',
+            'resourceVersion': resource_version,
+            'timeoutSeconds': timeout_seconds
+        }
+        if field_selector is not None:
+            params['fieldSelector'] = field_selector
+
+        if label_selector is not None:
+            params['labelSelector'] = label_selector
+
         prefix = cls._get_api_path_prefix(resource)
-        path = f'{prefix}/{app.app_id}' \
-            f'/{resource}/{name}'
+        qs = urllib.parse.urlencode(params)
+        return await cls.get_client(app.config).watch(
+            app.logger, f'{prefix}/{app.app_id}/{resource}?{qs}', until,
+            timeout_seconds, lane)
 
-        res = await cls.make_k8s_call(app.config, app.logger, path)
-        if res.code == 404:
-            return False
-        elif res.code == 200:
-            return True
+    @classmethod
+    async def remove_volume(cls, app, name):
+        await cls._delete_resource(app, 'persistentvolumeclaims', name)
 
-        raise K8sError(
-            message=f'Failed to check if {resource}/{name} exists! '
-            f'Kubernetes API returned {res.code}.')
+    @classmethod
+    async def _does_resource_exist(cls, app, resource, name):
+        obj = await cls.get_informer(app).get(resource, name)
+        return obj is not None
 
     @classmethod
     async def _update_volume_label(cls, app, name):
@@ -232,6 +288,7 @@ class Kubernetes:
 
         res = await cls.make_k8s_call(app.config, app.logger, path, payload)
         cls.raise_if_not_2xx(res)
+        cls.cache_created(app, 'persistentvolumeclaims', res)
         app.logger.debug(f'Created a Kubernetes volume - {name}')
 
     @classmethod
@@ -249,19 +306,21 @@ class Kubernetes:
             raise Exception(f'Unsupported resource type {resource}')
 
     @classmethod
-    async def _list_resource_names(cls, app, resource) -> typing.List[str]:
-        prefix = cls._get_api_path_prefix(resource)
-        res = await cls.make_k8s_call(
-            app.config, app.logger, f'{prefix}/{app.app_id}/{resource}'
-            f'?includeUninitialized=true')
+    async def _list_resource_names(cls, app, resource,
+                                   label: str = None) -> typing.List[str]:
+        return await cls.get_informer(app).list_names(resource, label)
 
-        body = json.loads(res.body, encoding='utf-8')
-        out = []
-
-        for i in body['items']:
-            out.append(i['metadata']['name'])
-
-        return out
+    @classmethod
+    async def get_deployments_readiness(cls, app) -> typing.Dict[str, bool]:
+        """
+        Returns whether each deployment in the app's namespace is ready,
+        by its name.
+        """
+        deployments = await cls.get_informer(app).get_all('deployments')
+        return {
+            d['metadata']['name']: cls.is_deployment_ready(d)
+            for d in deployments
+        }
 
     @classmethod
     async def _delete_resource(cls, app, resource, name):
@@ -276,10 +335,11 @@ class Kubernetes:
             app.config, app.logger,
             f'{prefix}/{app.app_id}/{resource}/{name}'
             f'?gracePeriodSeconds=0',
-            method='delete')
+            method='delete', lane=LANE_BULK)
 
         if res.code == 404:
             app.logger.debug(f'Resource {resource}/{name} not found')
+            cls.get_informer(app).remove(resource, name)
             return
 
         # Sometimes, the API will throw a 409, indicating that a
@@ -292,44 +352,166 @@ class Kubernetes:
         while True:
             res = await cls.make_k8s_call(
                 app.config, app.logger,
-                f'{prefix}/{app.app_id}/{resource}/{name}')
+                f'{prefix}/{app.app_id}/{resource}/{name}', lane=LANE_BULK)
 
             if res.code == 404:
                 break
 
             app.logger.debug(f'{resource}/{name} is still terminating...')
 
+            body = json.loads(res.body)
+            deleted = await cls.watch(
+                app, resource, body['metadata']['resourceVersion'],
+                lambda event: event['type'] == 'DELETED',
+                field_selector=f'metadata.name={name}', lane=LANE_BULK)
+            if deleted:
+                break
+
+            # The watch ended before the resource was deleted.
             await asyncio.sleep(0.7)
 
+        cls.get_informer(app).remove(resource, name)
+
         app.logger.debug(f'Deleted {resource}/{name} successfully!')
 
     @classmethod
-    async def clean_namespace(cls, app):
-        app.logger.debug(f'Clearing namespace contents...')
-        # Things to delete:
-        # 1. Services
-        # 2. Deployments (should delete all pods internally too)
-        # 3. Volumes which are marked with persist as false
-        # 4. Ingresses
+    async def _delete_collection(cls, app, resource, label: str = None):
+        """
+        Deletes all the resources of a kind immediately (only the ones
+        which have the given label, if any), and waits until they've
+        actually been killed.
+        :param app: An instance of App
+        :param resource: "services"/"deployments"/etc.
+        :param label: The key of a label which the resources must have
+        """
+        params = {
+            'gracePeriodSeconds': 0,
+            # Deployments must wait for their pods to be killed.
+            'propagationPolicy': 'Foreground'
+        }
+        if label is not None:
+            params['labelSelector'] = label
+
+        prefix = cls._get_api_path_prefix(resource)
+        path = f'{prefix}/{app.app_id}/{resource}'
+        res = await cls.make_k8s_call(
+            app.config, app.logger,
+            f'{path}?{urllib.parse.urlencode(params)}', method='delete',
+            lane=LANE_BULK)
+
+        if res.code == 405:
+            # Not all kinds of resources support collection deletes
+            # (eg: services, in older versions of Kubernetes).
+            names = await cls._list_resource_names(app, resource, label)
+            await asyncio.gather(*[
+                cls._delete_resource(app, resource, name) for name in names
+            ])
+            return
+
+        cls.raise_if_not_2xx(res)
+
+        # Wait until the resources have actually been killed.
+        params = {}
+        if label is not None:
+            params['labelSelector'] = label
+
+        while True:
+            res = await cls.make_k8s_call(
+                app.config, app.logger,
+                f'{path}?{urllib.parse.urlencode(params)}', lane=LANE_BULK)
+            cls.raise_if_not_2xx(res)
+            body = json.loads(res.body)
+            remaining = set([i['metadata']['name'] for i in body['items']])
+            if len(remaining) == 0:
+                break
+
+            app.logger.debug(f'{len(remaining)} {resource} are still '
+                             f'terminating...')
 
-        for i in await cls._list_resource_names(app, 'services'):
-            await cls._delete_resource(app, 'services', i)
+            def until(event):
+                if event['type'] == 'DELETED':
+                    remaining.discard(event['object']['metadata']['name'])
+                return len(remaining) == 0
 
-        for i in await cls._list_resource_names(app, 'deployments'):
-            await cls._delete_resource(app, 'deployments', i)
+            deleted = await cls.watch(app, resource,
+                                      body['metadata']['resourceVersion'],
+                                      until, label_selector=label,
+                                      lane=LANE_BULK)
+            if deleted:
+                break
 
-        for i in await cls._list_resource_names(app, 'pods'):
-            await cls._delete_resource(app, 'pods', i)
+            # The watch ended before the resources were deleted.
+            await asyncio.sleep(0.7)
 
-        for i in await cls._list_resource_names(app, 'ingresses'):
-            await cls._delete_resource(app, 'ingresses', i)
+        cls.get_informer(app).invalidate(resource)
+        app.logger.debug(f'Deleted all {resource} successfully!')
 
-        for i in await cls._list_resource_names(app, 'secrets'):
-            await cls._delete_resource(app, 'secrets', i)
+    @classmethod
+    async def clean_namespace(cls, app):
+        app.logger.debug(f'Clearing namespace contents...')
+        # Things to delete (all at once):
+        # 1. Services
+        # 2. Deployments (which delete their pods too)
+        # 3. Pods
+        # 4. Ingresses
+        # 5. Secrets
+        # The services, deployments and pods created by the engine have
+        # an app label; ingresses and secrets aren't labelled.
+        await asyncio.gather(
+            cls._delete_collection(app, 'services', 'app'),
+            cls._delete_collection(app, 'deployments', 'app'),
+            cls._delete_collection(app, 'pods', 'app'),
+            cls._delete_collection(app, 'ingresses'),
+            cls._delete_collection(app, 'secrets')
+        )
 
         # Volumes are not deleted at this moment.
         # See https://github.com/asyncy/platform-engine/issues/189
 
+    @classmethod
+    async def prune_namespace(cls, app, container_names: set,
+                              ingress_names: set):
+        """
+        Deletes everything in the app's namespace which isn't used by
+        the given containers and ingresses (eg: the ones left over from
+        the previous release of the app):
+        1. Deployments and services (created for a container)
+        2. Ingresses
+        3. Image pull secrets which no deployment refers to any more
+        """
+        deletes = []
+        for resource in ['deployments', 'services']:
+            for name in await cls._list_resource_names(app, resource, 'app'):
+                if name not in container_names:
+                    deletes.append(cls._delete_resource(app, resource, name))
+
+        for name in await cls._list_resource_names(app, 'ingresses'):
+            if name not in ingress_names:
+                deletes.append(cls._delete_resource(app, 'ingresses', name))
+
+        if len(deletes) > 0:
+            app.logger.debug(f'Pruning {len(deletes)} unused resources...')
+            await asyncio.gather(*deletes)
+
+        informer = cls.get_informer(app)
+        used_secrets = set()
+        for deployment in await informer.get_all('deployments'):
+            pod_spec = deployment['spec']['template']['spec']
+            for secret in pod_spec.get('imagePullSecrets') or []:
+                used_secrets.add(secret['name'])
+
+        deletes = []
+        for secret in await informer.get_all('secrets'):
+            name = secret['metadata']['name']
+            # Other secrets (eg: service account tokens) are left alone.
+            if secret.get('type') != 'kubernetes.io/dockerconfigjson':
+                continue
+
+            if name not in used_secrets:
+                deletes.append(cls._delete_resource(app, 'secrets', name))
+
+        await asyncio.gather(*deletes)
+
     @classmethod
     def get_hostname(cls, app, container_name):
         return f'{container_name}.' \
@@ -396,6 +578,7 @@ class Kubernetes:
         path = f'/api/v1/namespaces/{app.app_id}/services'
         res = await cls.make_k8s_call(app.config, app.logger, path, payload)
         cls.raise_if_not_2xx(res)
+        cls.cache_created(app, 'services', res)
 
         # Wait until the ports of the destination pod are open.
         hostname = cls.get_hostname(app, container_name)
@@ -409,6 +592,11 @@ class Kubernetes:
 
     @classmethod
     async def create_imagepullsecret(cls, app, config: ContainerConfig):
+        # Secrets are named after their contents (see
+        # Containers#get_containerconfig_name), so one which exists
+        # doesn't need to be updated.
+        if await cls._does_resource_exist(app, 'secrets', config.name):
+            return
 
         b64_container_config = base64.b64encode(
             json.dumps(config.data).encode()
@@ -434,6 +622,8 @@ class Kubernetes:
                 message=f'Failed to create imagePullSecret {config["name"]} '
                         f'in namespace {app.app_id}!')
 
+        cls.cache_created(app, 'secrets', res)
+
     @classmethod
     async def wait_for_port(cls, host, port):
         attempts = 0
@@ -451,16 +641,10 @@ class Kubernetes:
 
     @classmethod
     async def check_for_image_errors(cls, app, container_name):
-        # List of image pull errors taken from the kubernetes source code
-        # github/kubernetes/kubernetes/blob/master/pkg/kubelet/images/types.go
-        image_errors = [
-            'ImagePullBackOff',
-            'ImageInspectError',
-            'ErrImagePull',
-            'ErrImageNeverPull',
-            'RegistryUnavailable',
-            'InvalidImageName'
-        ]
+        """
+        Raises a K8sError if any of the pods of a container can't pull
+        its image. Returns the resource version of the list of pods.
+        """
         prefix = cls._get_api_path_prefix('pods')
         qs = urllib.parse.urlencode({
             'labelSelector': f'app={container_name}'
@@ -470,14 +654,20 @@ class Kubernetes:
         cls.raise_if_not_2xx(res)
         body = json.loads(res.body, encoding='utf-8')
         for pod in body['items']:
-            for container_status in pod['status'].get('containerStatuses', []):
-                is_waiting = Dict.find(container_status,
-                                       'state.waiting', False)
-                if is_waiting and is_waiting['reason'] in image_errors:
-                    raise K8sError(
-                        message=f'{is_waiting["reason"]} - '
-                        f'Failed to pull image {container_status["image"]}'
-                    )
+            cls.raise_for_image_errors(pod)
+
+        return body['metadata']['resourceVersion']
+
+    @classmethod
+    def raise_for_image_errors(cls, pod: dict):
+        for container_status in pod['status'].get('containerStatuses', []):
+            is_waiting = Dict.find(container_status,
+                                   'state.waiting', False)
+            if is_waiting and is_waiting['reason'] in IMAGE_ERRORS:
+                raise K8sError(
+                    message=f'{is_waiting["reason"]} - '
+                    f'Failed to pull image {container_status["image"]}'
+                )
 
     @classmethod
     def get_liveness_probe(cls, app, service: str):
@@ -645,20 +835,60 @@ class Kubernetes:
             await asyncio.sleep(1)
 
         cls.raise_if_not_2xx(res)
+        cls.cache_created(app, 'deployments', res)
+
+        await cls.wait_for_deployment(app, container_name)
 
+    @classmethod
+    def is_deployment_ready(cls, deployment: dict):
+        return deployment['status'].get('readyReplicas', 0) > 0
+
+    @classmethod
+    async def wait_for_deployment(cls, app, container_name: str):
+        """
+        Waits until the deployment has a ready replica, by watching it
+        (and its pods, for image errors) instead of polling it.
+        If the watches end before that, the deployment is read again.
+        """
         path = f'/apis/apps/v1/namespaces/{app.app_id}' \
             f'/deployments/{container_name}'
 
-        # Wait until the deployment is ready.
         app.logger.debug('Waiting for deployment to be ready...')
         while True:
             res = await cls.make_k8s_call(app.config, app.logger, path)
             cls.raise_if_not_2xx(res)
-            body = json.loads(res.body, encoding='utf-8')
-            if body['status'].get('readyReplicas', 0) > 0:
+            body = json.loads(res.body)
+            if cls.is_deployment_ready(body):
+                break
+
+            pods_version = await cls.check_for_image_errors(app,
+                                                            container_name)
+
+            def raise_for_image_errors(event):
+                cls.raise_for_image_errors(event['object'])
+                return False
+
+            watches = [
+                asyncio.ensure_future(cls.watch(
+                    app, 'deployments', body['metadata']['resourceVersion'],
+                    lambda event: cls.is_deployment_ready(event['object']),
+                    field_selector=f'metadata.name={container_name}')),
+                asyncio.ensure_future(cls.watch(
+                    app, 'pods', pods_version, raise_for_image_errors,
+                    label_selector=f'app={container_name}'))
+            ]
+            try:
+                done, _ = await asyncio.wait(
+                    watches, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for task in watches:
+                    task.cancel()
+
+            # Raises image errors found by the watch on the pods.
+            if any([task.result() for task in done]):
                 break
 
-            await cls.check_for_image_errors(app, container_name)
+            # The watches ended before the deployment was ready.
             await asyncio.sleep(1)
 
         app.logger.debug('Deployment is ready')
@@ -669,14 +899,14 @@ class Kubernetes:
                          shutdown_command: [] or str, env: dict,
                          volumes: Volumes,
                          container_configs: ContainerConfigs):
-        res = await cls.make_k8s_call(
-            app.config, app.logger,
-            f'/apis/apps/v1/namespaces/{app.app_id}'
-            f'/deployments/{container_name}')
-
-        if res.code == 200:
+        if await cls._does_resource_exist(app, 'deployments', container_name):
             app.logger.debug(f'Deployment {container_name} '
                              f'already exists, reusing')
+            # It might have been left behind by a deployment which failed.
+            await cls.wait_for_deployment(app, container_name)
+            if not await cls._does_resource_exist(app, 'services',
+                                                  container_name):
+                await cls.create_service(app, service, container_name)
             return
 
         await cls.create_deployment(app, service, image, container_name,
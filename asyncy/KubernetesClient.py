@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from tornado.httpclient import HTTPResponse
+
+from . import Metrics
+from .Config import Config
+from .Logger import Logger
+from .RateLimiter import LANE_CRITICAL, RateLimiter
+from .utils.HttpUtils import HttpUtils
+from .utils.WatchHTTPClient import WatchHTTPClient
+
+WATCH_TIMEOUT_SECONDS = 10
+
+THROTTLED_TRIES = 5
+
+THROTTLED_MAX_DELAY_SECONDS = 30
+
+
+class KubernetesClient:
+    """
+    A long lived client for the Kubernetes API, shared by all calls made
+    through Kubernetes#make_k8s_call.
+
+    The cluster's certificate is loaded once. Requests are limited to
+    K8S_MAX_CLIENTS at a time (the rest are queued by the HTTP client),
+    and to K8S_QPS per second (with bursts of up to K8S_BURST), through
+    the lanes of a RateLimiter. Requests which the API server throttles
+    (429) are retried after the delay it asks for.
+    Requests are made with curl, so that connections to the API server
+    are kept alive and reused across requests.
+
+    Watches are made through a client of their own (one per watch),
+    which is closed as soon as the watch ends, so that its connection
+    doesn't outlive it. Since watches are long lived (an informer keeps
+    one open per kind of resource, per app), they don't count towards
+    K8S_MAX_CLIENTS, which would otherwise leave no room for the other
+    requests once enough apps are running.
+    """
+
+    def __init__(self, config: Config):
+        self.host = config.CLUSTER_HOST
+        self.token = config.CLUSTER_AUTH_TOKEN
+        cert = config.CLUSTER_CERT.replace('\\n', '\n')
+        max_clients = int(config.K8S_MAX_CLIENTS)
+        self.limiter = RateLimiter(float(config.K8S_QPS),
+                                   int(config.K8S_BURST))
+
+        from tornado.curl_httpclient import CurlAsyncHTTPClient
+        self.http_client = CurlAsyncHTTPClient(force_instance=True,
+                                               max_clients=max_clients)
+        # curl requires the certificate to be in a file, which is
+        # removed by KubernetesClient#close.
+        with tempfile.NamedTemporaryFile('w', suffix='.crt',
+                                         delete=False) as f:
+            f.write(cert)
+        self.ca_certs = f.name
+        self.ssl_kwargs = {'ca_certs': self.ca_certs}
+
+    @staticmethod
+    def get_resource(path: str):
+        """
+        Returns the kind of resource a path is for (eg: "deployments"),
+        to be used as a metric label.
+        """
+        parts = path.split('?')[0].strip('/').split('/')
+        if 'namespaces' in parts:
+            i = parts.index('namespaces')
+            if len(parts) > i + 2:
+                return parts[i + 2]
+
+            return 'namespaces'
+
+        return parts[-1]
+
+    def new_request_kwargs(self, method: str) -> dict:
+        return {
+            **self.ssl_kwargs,
+            'headers': {
+                'Authorization': f'bearer {self.token}',
+                'Content-Type': 'application/json; charset=utf-8'
+            },
+            'method': method.upper()
+        }
+
+    @staticmethod
+    def get_retry_after(res: HTTPResponse, attempt: int) -> float:
+        """
+        Returns the number of seconds to wait before retrying a request
+        which was throttled, as asked for by the Retry-After header
+        (if any), or else backing off exponentially.
+        """
+        retry_after = res.headers.get('Retry-After')
+        if retry_after is not None and retry_after.isdigit():
+            delay = int(retry_after)
+        else:
+            delay = 0.5 * 2 ** attempt
+
+        return min(delay, THROTTLED_MAX_DELAY_SECONDS)
+
+    @staticmethod
+    def new_watch_client() -> WatchHTTPClient:
+        return WatchHTTPClient(force_instance=True)
+
+    async def request(self, logger: Logger, path: str, payload: dict = None,
+                      method: str = 'get',
+                      lane: str = LANE_CRITICAL) -> HTTPResponse:
+        kwargs = self.new_request_kwargs(method)
+
+        if method.lower() == 'patch':
+            kwargs['headers']['Content-Type'] = \
+                'application/merge-patch+json; charset=utf-8'
+
+        if payload is not None:
+            kwargs['body'] = json.dumps(payload)
+
+            if method == 'get':  # Default value.
+                kwargs['method'] = 'POST'
+
+        resource = self.get_resource(path)
+        attempt = 0
+        while True:
+            await self.limiter.acquire(lane)
+            res = await self.fetch(logger, path, kwargs)
+            attempt += 1
+            if res.code != 429 or attempt == THROTTLED_TRIES:
+                return res
+
+            delay = self.get_retry_after(res, attempt - 1)
+            logger.warn(f'Kubernetes throttled a request to {path}; '
+                        f'retrying in {delay}s')
+            Metrics.k8s_throttled_total.labels(resource=resource).inc()
+            # The server is overloaded; slow down all requests.
+            self.limiter.pause(delay)
+
+    async def fetch(self, logger: Logger, path: str,
+                    kwargs: dict) -> HTTPResponse:
+        verb = kwargs['method']
+        resource = self.get_resource(path)
+        in_flight = Metrics.k8s_requests_in_flight.labels(
+            verb=verb, resource=resource)
+        in_flight.inc()
+        start = time.time()
+        code = 599
+        try:
+            res = await HttpUtils.fetch_with_retry(
+                3, logger, f'https://{self.host}{path}',
+                self.http_client, kwargs)
+            code = res.code
+            return res
+        finally:
+            in_flight.dec()
+            Metrics.k8s_request_seconds.labels(
+                verb=verb, resource=resource
+            ).observe(time.time() - start)
+            Metrics.k8s_requests_total.labels(
+                verb=verb, resource=resource, code=code
+            ).inc()
+
+    async def watch(self, logger: Logger, path: str, until,
+                    timeout_seconds: int = WATCH_TIMEOUT_SECONDS,
+                    lane: str = LANE_CRITICAL) -> bool:
+        """
+        Watches path (which must have watch=true in its query string),
+        and calls until with every event received, until it returns True.
+
+        Returns True if until returned True, or False if the watch ended
+        before that (it timed out, failed, or the API server sent an
+        ERROR event, such as when the resource version is too old).
+        The caller must then read the resource again, since events might
+        have been missed. Any exception raised by until is raised here.
+
+        However the watch ends (including if it's cancelled), its
+        connection is closed, rather than being left open until the
+        timeoutSeconds given in path (which should be timeout_seconds).
+        """
+        result = asyncio.get_event_loop().create_future()
+        buffer = bytearray()
+
+        def on_chunk(chunk: bytes):
+            if result.done():
+                return
+
+            buffer.extend(chunk)
+            while not result.done():
+                i = buffer.find(b'\n')
+                if i < 0:
+                    return
+
+                line = bytes(buffer[:i])
+                del buffer[:i + 1]
+                if len(line.strip()) == 0:
+                    continue
+
+                try:
+                    event = json.loads(line)
+                    if event['type'] == 'ERROR':
+                        logger.debug(f'Watch on {path} failed: '
+                                     f'{event["object"]}')
+                        result.set_result(False)
+                    elif until(event):
+                        result.set_result(True)
+                except BaseException as e:
+                    result.set_exception(e)
+
+        kwargs = self.new_request_kwargs('get')
+        kwargs['streaming_callback'] = on_chunk
+        kwargs['request_timeout'] = timeout_seconds + 5
+        kwargs['raise_error'] = False
+
+        await self.limiter.acquire(lane)
+        resource = self.get_resource(path)
+        in_flight = Metrics.k8s_requests_in_flight.labels(
+            verb='WATCH', resource=resource)
+        in_flight.inc()
+        start = time.time()
+        http_client = self.new_watch_client()
+        fetch = http_client.fetch(f'https://{self.host}{path}', **kwargs)
+        try:
+            await asyncio.wait([result, fetch],
+                               return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError as e:
+            # Ignore the rest of the stream.
+            result.cancel()
+            raise e
+        finally:
+            # Aborts the request, if it's still streaming.
+            http_client.close()
+            in_flight.dec()
+            Metrics.k8s_request_seconds.labels(
+                verb='WATCH', resource=resource
+            ).observe(time.time() - start)
+
+        if result.done():
+            Metrics.k8s_requests_total.labels(
+                verb='WATCH', resource=resource, code=200
+            ).inc()
+            return result.result()
+
+        res = fetch.result()
+        Metrics.k8s_requests_total.labels(
+            verb='WATCH', resource=resource, code=res.code
+        ).inc()
+        if res.code != 200:
+            logger.debug(f'Watch on {path} failed! code={res.code}; '
+                         f'error={res.error}')
+
+        return False
+
+    def close(self):
+        self.http_client.close()
+        if self.ca_certs is not None:
+            os.remove(self.ca_certs)
+            self.ca_certs = None
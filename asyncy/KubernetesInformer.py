@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import typing
+
+from . import Metrics
+from .RateLimiter import LANE_BULK, LANE_CRITICAL
+
+RESOURCES = [
+    'deployments',
+    'services',
+    'pods',
+    'ingresses',
+    'persistentvolumeclaims',
+    'secrets'
+]
+
+INFORMER_WATCH_SECONDS = 300
+
+
+class KubernetesInformer:
+    """
+    A local cache of the resources in the namespace of an app.
+
+    The first time a kind of resource (see RESOURCES) is needed, it's
+    listed from the Kubernetes API (a cache miss). From then on, it's
+    kept current by watching it, and lookups are served from
+    memory (cache hits). Every time the watch ends (every
+    INFORMER_WATCH_SECONDS, or sooner if it fails), the resources are
+    listed again, since events might have been missed. Watches don't
+    take up any of the (K8S_MAX_CLIENTS) connections of the other
+    Kubernetes requests; see KubernetesClient#watch.
+
+    Resources created or deleted through Kubernetes are also written
+    to the cache right away, so that they're visible before their
+    watch event arrives. See Kubernetes#get_informer.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.objects = {}
+        self.synced = {}
+        self.tasks = {}
+
+    def is_synced(self, resource: str):
+        synced = self.synced.get(resource)
+        return synced is not None and synced.done() and \
+            synced.exception() is None
+
+    async def get(self, resource: str, name: str) -> typing.Optional[dict]:
+        objects = await self._get_objects(resource)
+        return objects.get(name)
+
+    async def list_names(self, resource: str,
+                         label: str = None) -> typing.List[str]:
+        """
+        Returns the names of all the resources of a kind, or only the ones
+        which have the given label (key).
+        """
+        objects = await self._get_objects(resource)
+        if label is None:
+            return list(objects.keys())
+
+        return [
+            name for name, obj in objects.items()
+            if label in obj['metadata'].get('labels', {})
+        ]
+
+    async def get_all(self, resource: str) -> typing.List[dict]:
+        objects = await self._get_objects(resource)
+        return list(objects.values())
+
+    def put(self, resource: str, obj: dict):
+        if self.is_synced(resource):
+            self.objects[resource][obj['metadata']['name']] = obj
+
+    def remove(self, resource: str, name: str):
+        if self.is_synced(resource):
+            self.objects[resource].pop(name, None)
+
+    def invalidate(self, resource: str):
+        """
+        Drops the cache of a kind of resource, after many of them have
+        been changed at once. The next lookup will list them again.
+        """
+        task = self.tasks.pop(resource, None)
+        if task is not None:
+            task.cancel()
+
+        self.synced.pop(resource, None)
+        self.objects.pop(resource, None)
+
+    async def _get_objects(self, resource: str) -> dict:
+        if resource not in RESOURCES:
+            raise Exception(f'Unsupported resource type {resource}')
+
+        synced = self.synced.get(resource)
+        if synced is not None:
+            Metrics.k8s_cache_hits_total.labels(resource=resource).inc()
+            # Wait for the list (if it's in progress).
+            await asyncio.shield(synced)
+            return self.objects[resource]
+
+        Metrics.k8s_cache_misses_total.labels(resource=resource).inc()
+        synced = asyncio.get_event_loop().create_future()
+        self.synced[resource] = synced
+        try:
+            resource_version = await self.list(resource)
+        except BaseException as e:
+            # The next lookup will try again.
+            self.synced.pop(resource)
+            synced.set_exception(e)
+            # Don't warn about this exception not being retrieved,
+            # since it's raised here.
+            synced.exception()
+            raise e
+
+        synced.set_result(None)
+        self.tasks[resource] = asyncio.ensure_future(
+            self.watch(resource, resource_version))
+        return self.objects[resource]
+
+    async def list(self, resource: str, lane: str = LANE_CRITICAL) -> str:
+        """
+        Lists all the resources of a kind into the cache, and returns
+        the resource version to watch them from.
+        """
+        from .Kubernetes import Kubernetes
+        prefix = Kubernetes._get_api_path_prefix(resource)
+        res = await Kubernetes.make_k8s_call(
+            self.app.config, self.app.logger,
+            f'{prefix}/{self.app.app_id}/{resource}'
+            f'?includeUninitialized=true', lane=lane)
+        Kubernetes.raise_if_not_2xx(res)
+
+        body = json.loads(res.body)
+        self.objects[resource] = {
+            i['metadata']['name']: i for i in body['items']
+        }
+        return body['metadata']['resourceVersion']
+
+    def on_event(self, resource: str, event: dict):
+        obj = event['object']
+        if event['type'] == 'DELETED':
+            self.objects[resource].pop(obj['metadata']['name'], None)
+        else:
+            self.objects[resource][obj['metadata']['name']] = obj
+
+        # Never stop watching.
+        return False
+
+    async def watch(self, resource: str, resource_version: str):
+        from .Kubernetes import Kubernetes
+        try:
+            while True:
+                await Kubernetes.watch(
+                    self.app, resource, resource_version,
+                    lambda event: self.on_event(resource, event),
+                    timeout_seconds=INFORMER_WATCH_SECONDS, lane=LANE_BULK)
+
+                # Don't list the resources in a tight loop if the
+                # watch fails right away.
+                await asyncio.sleep(1)
+                resource_version = await self.list(resource, LANE_BULK)
+        except asyncio.CancelledError as e:
+            raise e
+        except BaseException as e:
+            self.app.logger.error(
+                f'Failed to watch {resource} in {self.app.app_id}', exc=e)
+            # The next lookup will list the resources again.
+            self.synced.pop(resource, None)
+            self.tasks.pop(resource, None)
+
+    def close(self):
+        for task in self.tasks.values():
+            task.cancel()
+
+        self.tasks = {}
+        self.synced = {}
+        self.objects = {}
@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-from prometheus_client import Summary
+from prometheus_client import Counter, Gauge, Summary
 
 
 story_request = Summary(
@@ -37,3 +37,110 @@ container_start_seconds_total = Summary(
     'Time spent executing commands in containers',
     ['app_id', 'story_name', 'service']
 )
+
+db_pool_connections = Gauge(
+    'asyncy_engine_db_pool_connections',
+    'Number of connections open in the Postgres pool'
+)
+
+db_pool_idle_connections = Gauge(
+    'asyncy_engine_db_pool_idle_connections',
+    'Number of idle connections in the Postgres pool'
+)
+
+db_pool_wait_seconds = Summary(
+    'asyncy_engine_db_pool_wait_seconds',
+    'Time spent waiting for a connection from the Postgres pool'
+)
+
+db_query_seconds = Summary(
+    'asyncy_engine_db_query_seconds',
+    'Time spent executing (prepared) Postgres statements',
+    ['statement']
+)
+
+deploy_queue_size = Gauge(
+    'asyncy_engine_deploy_queue_size',
+    'Number of apps waiting to be deployed'
+)
+
+app_deploy_queue_wait_seconds = Summary(
+    'asyncy_engine_app_deploy_queue_wait_seconds',
+    'Time an app spent queued before being deployed',
+    ['app_id']
+)
+
+app_deploy_seconds = Summary(
+    'asyncy_engine_app_deploy_seconds',
+    'Time spent deploying an app',
+    ['app_id']
+)
+
+app_bootstrap_phase_seconds = Summary(
+    'asyncy_engine_app_bootstrap_phase_seconds',
+    'Time spent on a phase of bootstrapping an app (starting its '
+    'containers, exposing them, or running its stories)',
+    ['app_id', 'phase']
+)
+
+app_switchover_seconds = Summary(
+    'asyncy_engine_app_switchover_seconds',
+    'Time an app spent without subscriptions, while switching over from '
+    'its previous release to a new one',
+    ['app_id']
+)
+
+app_drain_seconds = Summary(
+    'asyncy_engine_app_drain_seconds',
+    'Time spent waiting for the stories of a previous release of an app '
+    'to finish executing',
+    ['app_id']
+)
+
+app_unavailable_events_total = Counter(
+    'asyncy_engine_app_unavailable_events_total',
+    'Number of events received for an app which was not deployed',
+    ['app_id']
+)
+
+k8s_requests_total = Counter(
+    'asyncy_engine_k8s_requests_total',
+    'Number of requests made to the Kubernetes API',
+    ['verb', 'resource', 'code']
+)
+
+k8s_requests_in_flight = Gauge(
+    'asyncy_engine_k8s_requests_in_flight',
+    'Number of requests to the Kubernetes API which are in progress',
+    ['verb', 'resource']
+)
+
+k8s_request_seconds = Summary(
+    'asyncy_engine_k8s_request_seconds',
+    'Time spent on requests to the Kubernetes API',
+    ['verb', 'resource']
+)
+
+k8s_cache_hits_total = Counter(
+    'asyncy_engine_k8s_cache_hits_total',
+    'Number of lookups of Kubernetes resources served from the cache',
+    ['resource']
+)
+
+k8s_cache_misses_total = Counter(
+    'asyncy_engine_k8s_cache_misses_total',
+    'Number of lookups of Kubernetes resources which listed them',
+    ['resource']
+)
+
+k8s_rate_limiter_wait_seconds = Summary(
+    'asyncy_engine_k8s_rate_limiter_wait_seconds',
+    'Time spent waiting for the rate limit of the Kubernetes API',
+    ['lane']
+)
+
+k8s_throttled_total = Counter(
+    'asyncy_engine_k8s_throttled_total',
+    'Number of requests to the Kubernetes API which got a 429',
+    ['resource']
+)
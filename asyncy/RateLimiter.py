@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+from collections import deque
+
+from . import Metrics
+
+LANE_CRITICAL = 'critical'
+"""
+Calls which something is waiting for, such as starting a container.
+"""
+
+LANE_BULK = 'bulk'
+"""
+Calls which can wait, such as cleaning up a namespace.
+"""
+
+LANES = [LANE_CRITICAL, LANE_BULK]
+
+
+class RateLimiter:
+    """
+    A token bucket, which lets through qps calls per second on average,
+    and up to burst calls at once.
+
+    Calls which have to wait are queued in lanes. Whenever tokens are
+    available, the calls queued in the critical lane go first, and the
+    ones in the bulk lane only get the tokens left over.
+    """
+
+    def __init__(self, qps: float, burst: int):
+        self.qps = qps
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.time()
+        self.waiters = {lane: deque() for lane in LANES}
+        self.timer = None
+
+    async def acquire(self, lane: str = LANE_CRITICAL):
+        start = time.time()
+        self._refill()
+        if self.tokens >= 1 and not self._has_waiters():
+            self.tokens -= 1
+        else:
+            waiter = asyncio.get_event_loop().create_future()
+            self.waiters[lane].append(waiter)
+            self._schedule()
+            try:
+                await waiter
+            except asyncio.CancelledError as e:
+                if waiter.cancelled():
+                    if waiter in self.waiters[lane]:
+                        self.waiters[lane].remove(waiter)
+                else:
+                    # The token was handed to us, but we don't need it.
+                    self.tokens += 1
+                    self._wake()
+                raise e
+
+        Metrics.k8s_rate_limiter_wait_seconds.labels(
+            lane=lane).observe(time.time() - start)
+
+    def pause(self, seconds: float):
+        """
+        Lets no calls through for the given number of seconds (eg: when
+        the server has asked the client to slow down).
+        """
+        self._refill()
+        self.tokens = min(self.tokens, 0) - seconds * self.qps
+        self._wake()
+
+    def _refill(self):
+        now = time.time()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.qps)
+        self.updated = now
+
+    def _has_waiters(self):
+        return any([len(waiters) > 0 for waiters in self.waiters.values()])
+
+    def _wake(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+        self._refill()
+        for lane in LANES:
+            waiters = self.waiters[lane]
+            while len(waiters) > 0 and self.tokens >= 1:
+                waiter = waiters.popleft()
+                if waiter.done():
+                    continue
+
+                self.tokens -= 1
+                waiter.set_result(None)
+
+        self._schedule()
+
+    def _schedule(self):
+        if self.timer is not None or not self._has_waiters():
+            return
+
+        delay = max(0, (1 - self.tokens) / self.qps)
+        self.timer = asyncio.get_event_loop().call_later(delay, self._wake)
@@ -14,8 +14,10 @@ from tornado import web
 from . import Version
 from .Apps import Apps
 from .Config import Config
+from .Kubernetes import Kubernetes
 from .Logger import Logger
 from .Sentry import Sentry
+from .db.Database import Database
 from .http_handlers.StoryEventHandler import StoryEventHandler
 from .processing.Services import Services
 from .processing.internal import File, Http, Json, Log
@@ -105,7 +107,13 @@ class Service:
     @classmethod
     async def shutdown_app(cls):
         logger.info('Unregistering with the gateway...')
-        await Apps.destroy_all()  # All exceptions are handled inside.
+        Apps.stop_listening_to_releases()
+        Apps.close_deploy_scheduler()
+        # The containers are kept running, to be adopted on startup.
+        # All exceptions are handled inside.
+        await Apps.destroy_all(keep_containers=True)
+        Database.close_pool()
+        Kubernetes.close_client()
 
         io_loop = tornado.ioloop.IOLoop.instance()
         io_loop.stop()
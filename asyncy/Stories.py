@@ -1,10 +1,14 @@
 # -*- coding: utf-8 -*-
+import copy
 import pathlib
 import time
 import uuid
+from collections import ChainMap
 from contextlib import contextmanager
 from json import dumps
 
+from .entities.ExecutionBudget import ExecutionBudget
+from .entities.Line import Line
 from .utils import Dict
 from .utils.Resolver import Resolver
 from .utils.StringUtils import StringUtils
@@ -18,8 +22,11 @@ class Stories:
         self.app = app
         self.name = story_name
         self.logger = logger
-        self.tree = app.stories[story_name]['tree']
-        self.entrypoint = app.stories[story_name]['entrypoint']
+        # The story is kept, so that it finishes executing as it started
+        # even if the app's stories are swapped meanwhile (see App#hot_swap).
+        self._story = app.stories[story_name]
+        self.tree = self._story['tree']
+        self.entrypoint = self._story['entrypoint']
         self.results = {}
         self.environment = None
         self.context = None
@@ -29,6 +36,7 @@ class Stories:
         self._stack = []
         self.execution_id = str(uuid.uuid4())
         self._tmp_dir_created = False
+        self.budget = ExecutionBudget()
 
     @contextmanager
     def new_frame(self, line_number: str):
@@ -41,6 +49,17 @@ class Stories:
     def get_stack(self) -> []:
         return self._stack
 
+    def fork(self, context):
+        """
+        Returns a copy of this story, which executes with the given context
+        and it's own stack. Everything else (such as the results of lines)
+        is shared with this story.
+        """
+        story = copy.copy(self)
+        story.context = context
+        story._stack = list(self._stack)
+        return story
+
     def create_tmp_dir(self):
         if self._tmp_dir_created:
             return
@@ -78,6 +97,9 @@ class Stories:
         if parent_line_number == line.get('parent', None):
             return True
 
+        if isinstance(line, Line):
+            return parent_line_number in line.ancestors
+
         while line is not None:
             my_parent_number = line.get('parent', None)
 
@@ -94,6 +116,9 @@ class Stories:
         Given a parent_line, it skips through the block and returns the next
         line after this block.
         """
+        if isinstance(parent_line, Line):
+            return parent_line.exit_line
+
         next_line = parent_line
 
         while next_line.get('next') is not None:
@@ -219,16 +244,32 @@ class Stories:
                 'but no variable found!')
             return
 
-        Dict.set(self.context, assign['paths'], output)
+        paths = assign['paths']
+        if len(paths) > 1 and paths[0] == 'app' and \
+                isinstance(self.context, ChainMap) and \
+                'app' not in self.context.maps[0]:
+            # The context of the app is shared and read only (see
+            # Stories#set_context), so the first write to it gives this
+            # context a copy of its own.
+            self.context.maps[0]['app'] = dict(self.context['app'])
+
+        Dict.set(self.context, paths, output)
 
     def function_line_by_name(self, function_name):
         """
         Returns the line at which the given function_name was defined at.
         """
-        line_number = self.app.stories[self.name]['functions'][function_name]
+        line_number = self._story['functions'][function_name]
         return self.line(line_number)
 
     def argument_by_name(self, line, argument_name, encode=False):
+        if isinstance(line, Line):
+            # Compiled lines have their arguments keyed by name already.
+            if argument_name not in line.arguments:
+                return None
+
+            return self.resolve(line.arguments[argument_name], encode=encode)
+
         args = line.get('args', line.get('arguments', line.get('arg')))
         if args is None:
             return None
@@ -267,11 +308,21 @@ class Stories:
         return new_context
 
     def set_context(self, context):
+        """
+        Sets the context of this story, as a layer over the context of the
+        app (App#base_context), which is shared by all the stories of the
+        app. Variables are written to the top layer, so the given context
+        sees all the writes, and the app's context is only copied if it's
+        written to (see Stories#set_variable).
+        """
         if context is None:
             context = {}
-        self.context = context
-        # Optimise this later.
-        self.context['app'] = self.app.app_context.copy()
+
+        if isinstance(context, ChainMap):
+            # This context is layered already (eg: it's being restored).
+            self.context = context
+        else:
+            self.context = ChainMap(context, self.app.base_context)
 
     def prepare(self, context=None):
         self.set_context(context)
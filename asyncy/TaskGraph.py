@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+import typing
+
+
+class TaskGraph:
+    """
+    Runs tasks as soon as the tasks they depend on have finished, up to
+    concurrency of them at once. The time taken is then the length of the
+    slowest chain of tasks, rather than the sum of all of them.
+
+    Every task belongs to a phase (eg: starting containers), and the time
+    span of every phase (from the start of its first task to the end of
+    its last one) is recorded in phase_seconds. Phases may overlap.
+
+    If a task fails, the ones which haven't finished are cancelled, and
+    the exception is raised by TaskGraph#run.
+    """
+
+    def __init__(self, concurrency: int):
+        assert concurrency >= 1
+        self.concurrency = concurrency
+        self.tasks = {}
+        self.phase_seconds = {}
+
+    def add(self, name: str, phase: str, fn,
+            depends_on: typing.Iterable[str] = ()):
+        """
+        Adds a task, where fn is a coroutine function (taking no
+        arguments). Dependencies which aren't tasks of this graph are
+        ignored, and a task which has been added already isn't replaced.
+        The dependencies must not form a cycle.
+        """
+        if name not in self.tasks:
+            self.tasks[name] = (phase, fn, list(depends_on))
+
+    def has(self, name: str) -> bool:
+        return name in self.tasks
+
+    async def run(self):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        futures = {}
+        spans = {}
+
+        async def run_task(name):
+            phase, fn, depends_on = self.tasks[name]
+            for dependency in depends_on:
+                if dependency in futures and dependency != name:
+                    await futures[dependency]
+
+            async with semaphore:
+                span = spans.setdefault(phase, [time.time(), None])
+                try:
+                    await fn()
+                finally:
+                    span[1] = time.time()
+
+        for name in self.tasks.keys():
+            futures[name] = asyncio.ensure_future(run_task(name))
+
+        try:
+            await asyncio.gather(*futures.values())
+        except BaseException as e:
+            for future in futures.values():
+                future.cancel()
+            raise e
+        finally:
+            for phase, (start, end) in spans.items():
+                # Phases cut short by a failure are left out.
+                if end is not None:
+                    self.phase_seconds[phase] = end - start
@@ -1,47 +1,30 @@
 # -*- coding: utf-8 -*-
 from asyncy.Config import Config
-from asyncy.db.SimpleConnCursor import SimpleConnCursor
+from asyncy.db.Pool import Pool
+from asyncy.db.Statement import Statement
 from asyncy.entities.ContainerConfig import ContainerConfig
 from asyncy.entities.Release import Release
 from asyncy.enums.ReleaseState import ReleaseState
 
-import psycopg2
-
 
 class Database:
 
-    @classmethod
-    def new_pg_conn(cls, config: Config):
-        conn = psycopg2.connect(config.POSTGRES)
-        return conn
-
-    @classmethod
-    def new_pg_cur(cls, config: Config) -> SimpleConnCursor:
-        return SimpleConnCursor(cls.new_pg_conn(config))
-
-    @classmethod
-    def get_all_app_uuids_for_deployment(cls, config: Config):
-        with cls.new_pg_cur(config) as db:
-            query = 'select app_uuid uuid from releases group by app_uuid;'
-            db.cur.execute(query)
-            return db.cur.fetchall()
-
-    @classmethod
-    def update_release_state(cls, glogger, config, app_id, version,
-                             state: ReleaseState):
-        with cls.new_pg_cur(config) as db:
-            query = 'update releases ' \
-                    'set state = %s ' \
-                    'where app_uuid = %s and id = %s;'
-            db.cur.execute(query, (state.value, app_id, version))
-            db.conn.commit()
+    pool: Pool = None
+    """
+    The (lazily created) pool of connections used by all queries.
+    See Database#get_pool.
+    """
 
-        glogger.info(f'Updated state for {app_id}@{version} to {state.name}')
+    release_state_update = Statement(
+        name='release_state_update',
+        query='update releases '
+              'set state = $1 '
+              'where app_uuid = $2 and id = $3;'
+    )
 
-    @classmethod
-    def get_container_configs(cls, app, registry_url):
-        with cls.new_pg_cur(app.config) as db:
-            query = """
+    container_configs = Statement(
+        name='container_configs',
+        query="""
             with containerconfigs as (
             select name,
             owner_uuid, containerconfig,
@@ -52,25 +35,17 @@ class Database:
             )
             select name, containerconfig
             from containerconfigs
-            where owner_uuid = %s and registry = %s
+            where owner_uuid = $1 and registry = $2
             """
-            db.cur.execute(query, (app.owner_uuid, registry_url))
-            data = db.cur.fetchall()
-            result = []
-            for config in data:
-                result.append(ContainerConfig(
-                    name=config['name'],
-                    data=config['containerconfig'])
-                )
-            return result
+    )
 
-    @classmethod
-    def get_release_for_deployment(cls, config, app_id):
-        with cls.new_pg_cur(config) as db:
-            query = """
+    release_for_deployment = Statement(
+        name='release_for_deployment',
+        query="""
             with latest as (select app_uuid, max(id) as id
                             from releases
                             where state != 'NO_DEPLOY'::release_state
+                              and app_uuid = $1
                             group by app_uuid)
             select app_uuid, id as version, config environment,
                    payload stories, apps.name as app_name,
@@ -83,21 +58,114 @@ class Database:
                    inner join app_dns using (app_uuid)
                    left join app_public.owner_emails on
                     (apps.owner_uuid = owner_emails.owner_uuid)
-            where app_uuid = %s;
+            where app_uuid = $1;
+            """
+    )
+
+    releases_for_deployment = Statement(
+        name='releases_for_deployment',
+        query="""
+            with latest as (select app_uuid, max(id) as id
+                            from releases
+                            where state != 'NO_DEPLOY'::release_state
+                            group by app_uuid)
+            select app_uuid, id as version, config environment,
+                   payload stories, apps.name as app_name,
+                   maintenance, always_pull_images,
+                   hostname app_dns, state, deleted,
+                   apps.owner_uuid, owner_emails.email as owner_email
+            from latest
+                   inner join releases using (app_uuid, id)
+                   inner join apps on (latest.app_uuid = apps.uuid)
+                   inner join app_dns using (app_uuid)
+                   left join app_public.owner_emails on
+                    (apps.owner_uuid = owner_emails.owner_uuid);
             """
-            db.cur.execute(query, (app_id,))
-            data = db.cur.fetchone()
-            return Release(
-                app_uuid=data['app_uuid'],
-                app_name=data['app_name'],
-                version=data['version'],
-                environment=data['environment'],
-                stories=data['stories'],
-                maintenance=data['maintenance'],
-                always_pull_images=data['always_pull_images'],
-                app_dns=data['app_dns'],
-                state=data['state'],
-                deleted=data['deleted'],
-                owner_uuid=data['owner_uuid'],
-                owner_email=data['owner_email']
+    )
+
+    queued_app_uuids = Statement(
+        name='queued_app_uuids',
+        query="""
+            with latest as (select app_uuid, max(id) as id
+                            from releases
+                            where state != 'NO_DEPLOY'::release_state
+                            group by app_uuid)
+            select app_uuid uuid
+            from latest
+                   inner join releases using (app_uuid, id)
+            where state = 'QUEUED'::release_state;
+            """
+    )
+
+    @classmethod
+    def get_pool(cls, config: Config) -> Pool:
+        if cls.pool is None:
+            cls.pool = Pool(config.POSTGRES,
+                            max_size=int(config.POSTGRES_POOL_SIZE))
+        return cls.pool
+
+    @classmethod
+    def close_pool(cls):
+        if cls.pool is not None:
+            cls.pool.close()
+            cls.pool = None
+
+    @classmethod
+    async def get_queued_app_uuids(cls, config: Config):
+        """
+        Returns the apps whose latest release is yet to be deployed.
+        """
+        return await cls.get_pool(config).fetch_all(cls.queued_app_uuids)
+
+    @classmethod
+    async def update_release_state(cls, glogger, config, app_id, version,
+                                   state: ReleaseState):
+        await cls.get_pool(config).execute(
+            cls.release_state_update, (state.value, app_id, version))
+
+        glogger.info(f'Updated state for {app_id}@{version} to {state.name}')
+
+    @classmethod
+    async def get_container_configs(cls, app, registry_url):
+        data = await cls.get_pool(app.config).fetch_all(
+            cls.container_configs, (app.owner_uuid, registry_url))
+        result = []
+        for config in data:
+            result.append(ContainerConfig(
+                name=config['name'],
+                data=config['containerconfig'])
             )
+        return result
+
+    @classmethod
+    def release_from_row(cls, data) -> Release:
+        return Release(
+            app_uuid=data['app_uuid'],
+            app_name=data['app_name'],
+            version=data['version'],
+            environment=data['environment'],
+            stories=data['stories'],
+            maintenance=data['maintenance'],
+            always_pull_images=data['always_pull_images'],
+            app_dns=data['app_dns'],
+            state=data['state'],
+            deleted=data['deleted'],
+            owner_uuid=data['owner_uuid'],
+            owner_email=data['owner_email']
+        )
+
+    @classmethod
+    async def get_release_for_deployment(cls, config, app_id):
+        data = await cls.get_pool(config).fetch_one(
+            cls.release_for_deployment, (app_id,))
+        return cls.release_from_row(data)
+
+    @classmethod
+    async def get_releases_for_deployment(cls, config: Config):
+        """
+        Yields the latest release of every app, as they're read from the
+        database (in a single query).
+        """
+        pool = cls.get_pool(config)
+        async for data in pool.stream(cls.releases_for_deployment):
+            yield cls.release_from_row(data)
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from asyncy.Logger import Logger
+from asyncy.db.PooledConnection import PooledConnection
+
+import psycopg2
+
+RECONNECT_MIN_SECONDS = 1
+RECONNECT_MAX_SECONDS = 30
+
+
+class Listener:
+    """
+    Consumes the notifications sent to a Postgres channel (see LISTEN).
+
+    The connection's socket is watched by the event loop, so notifications
+    are handled as soon as they arrive. If the connection is lost, the
+    listener reconnects (with a backoff), listens again, and then calls
+    on_reconnect, so that notifications sent meanwhile can be caught up on.
+    """
+
+    def __init__(self, dsn: str, channel: str, logger: Logger,
+                 on_notify, on_reconnect=None):
+        self.dsn = dsn
+        self.channel = channel
+        self.logger = logger
+        self.on_notify = on_notify
+        self.on_reconnect = on_reconnect
+        self.task = None
+
+    async def start(self):
+        """
+        Listens on the channel, and returns once the first connection
+        has been established (so no notification is missed from then on).
+        """
+        conn = await self.connect()
+        self.task = asyncio.ensure_future(self.run(conn))
+
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def connect(self) -> PooledConnection:
+        conn = await PooledConnection.connect(self.dsn)
+        try:
+            await conn.run(f'listen {self.channel};')
+        except BaseException as e:
+            conn.close()
+            raise e
+
+        return conn
+
+    async def run(self, conn: PooledConnection):
+        while True:
+            try:
+                await self.consume(conn)
+            except psycopg2.Error as e:
+                # Any error of the connection (see Listener#consume).
+                self.logger.error(f'Lost the connection listening on '
+                                  f'{self.channel}; reconnecting', exc=e)
+            finally:
+                conn.close()
+
+            conn = await self.reconnect()
+            if self.on_reconnect is not None:
+                try:
+                    await self.on_reconnect()
+                except BaseException as e:
+                    self.logger.error(f'Failed to catch up on {self.channel}',
+                                      exc=e)
+
+    async def reconnect(self) -> PooledConnection:
+        delay = RECONNECT_MIN_SECONDS
+        while True:
+            try:
+                conn = await self.connect()
+                self.logger.info(f'Listening on {self.channel} again')
+                return conn
+            except psycopg2.Error as e:
+                self.logger.error(f'Failed to reconnect to listen on '
+                                  f'{self.channel}; retrying in {delay}s',
+                                  exc=e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_SECONDS)
+
+    async def consume(self, conn: PooledConnection):
+        """
+        Dispatches notifications until the connection is lost, in which
+        case the error is raised.
+        """
+        loop = asyncio.get_event_loop()
+        lost = loop.create_future()
+        fd = conn.conn.fileno()
+
+        def readable():
+            try:
+                conn.conn.poll()
+            except psycopg2.Error as e:
+                if not lost.done():
+                    lost.set_exception(e)
+                return
+
+            while conn.conn.notifies:
+                notify = conn.conn.notifies.pop(0)
+                self.on_notify(notify.payload)
+
+        loop.add_reader(fd, readable)
+        try:
+            await lost
+        finally:
+            loop.remove_reader(fd)
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+from collections import deque
+
+from asyncy import Metrics
+from asyncy.db.PooledConnection import PooledConnection
+from asyncy.db.Statement import Statement
+
+import psycopg2
+
+
+class Pool:
+    """
+    A pool of asynchronous Postgres connections.
+
+    Connections are opened lazily, up to max_size. Once the pool is full,
+    acquire() waits for a connection to be released (in FIFO order).
+    """
+
+    def __init__(self, dsn: str, max_size: int = 10):
+        assert max_size >= 1
+        self.dsn = dsn
+        self.max_size = max_size
+        self.size = 0
+        self.closed = False
+        self._idle = deque()
+        self._waiters = deque()
+
+    async def acquire(self) -> PooledConnection:
+        assert not self.closed, 'The pool has been closed'
+        start = time.time()
+        try:
+            while True:
+                while len(self._idle) > 0:
+                    conn = self._idle.popleft()
+                    if not conn.closed:
+                        return conn
+                    self.size -= 1
+
+                if self.size < self.max_size:
+                    self.size += 1
+                    try:
+                        return await PooledConnection.connect(self.dsn)
+                    except BaseException as e:
+                        self.size -= 1
+                        self._wake()
+                        raise e
+
+                waiter = asyncio.get_event_loop().create_future()
+                self._waiters.append(waiter)
+                try:
+                    await waiter
+                except BaseException as e:
+                    if waiter.done() and not waiter.cancelled():
+                        # We were woken up, but won't use the connection.
+                        # Pass it on.
+                        self._wake()
+                    elif waiter in self._waiters:
+                        self._waiters.remove(waiter)
+                    raise e
+        finally:
+            Metrics.db_pool_wait_seconds.observe(time.time() - start)
+            self._report()
+
+    def release(self, conn: PooledConnection):
+        if self.closed or conn.closed:
+            conn.close()
+            self.size -= 1
+        else:
+            self._idle.append(conn)
+
+        self._wake()
+        self._report()
+
+    def close(self):
+        self.closed = True
+        while len(self._idle) > 0:
+            self._idle.popleft().close()
+            self.size -= 1
+
+        while len(self._waiters) > 0:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.cancel()
+
+        self._report()
+
+    def _wake(self):
+        while len(self._waiters) > 0:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    def _report(self):
+        Metrics.db_pool_connections.set(self.size)
+        Metrics.db_pool_idle_connections.set(len(self._idle))
+
+    @staticmethod
+    def is_reusable_after(e: BaseException):
+        """
+        Returns False if the connection on which e was raised is either
+        broken, or in an unknown state (eg: the query was cancelled
+        half way), and must be discarded.
+        """
+        return isinstance(e, psycopg2.Error) and \
+            not isinstance(e, (psycopg2.OperationalError,
+                               psycopg2.InterfaceError))
+
+    async def execute(self, statement: Statement, args=(), fetch=None):
+        conn = await self.acquire()
+        start = time.time()
+        try:
+            return await conn.execute(statement, args, fetch)
+        except BaseException as e:
+            if not self.is_reusable_after(e):
+                conn.close()
+            raise e
+        finally:
+            Metrics.db_query_seconds.labels(
+                statement=statement.name
+            ).observe(time.time() - start)
+            self.release(conn)
+
+    async def stream(self, statement: Statement, size=100):
+        """
+        Yields the rows of the statement as they arrive.
+        See PooledConnection#stream.
+        """
+        conn = await self.acquire()
+        start = time.time()
+        try:
+            async for row in conn.stream(statement, size):
+                yield row
+        except BaseException as e:
+            # The transaction of the cursor is still open.
+            conn.close()
+            raise e
+        finally:
+            Metrics.db_query_seconds.labels(
+                statement=statement.name
+            ).observe(time.time() - start)
+            self.release(conn)
+
+    async def fetch_all(self, statement: Statement, args=()):
+        return await self.execute(statement, args, fetch='all')
+
+    async def fetch_one(self, statement: Statement, args=()):
+        return await self.execute(statement, args, fetch='one')
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from asyncy.db.Statement import Statement
+
+import psycopg2
+from psycopg2.extensions import POLL_OK, POLL_READ, POLL_WRITE
+from psycopg2.extras import RealDictCursor
+
+
+class PooledConnection:
+    """
+    Wraps a psycopg2 connection opened in asynchronous mode. Instead of
+    blocking on the socket, every operation polls the connection and waits
+    for it to become readable/writable on the event loop.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.prepared = set()
+
+    @classmethod
+    async def connect(cls, dsn: str):
+        conn = cls(psycopg2.connect(dsn, async_=True))
+        try:
+            await conn.wait()
+        except BaseException as e:
+            conn.close()
+            raise e
+
+        return conn
+
+    @property
+    def closed(self):
+        return self.conn.closed != 0
+
+    def close(self):
+        if not self.closed:
+            self.conn.close()
+
+    async def wait(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            state = self.conn.poll()
+            if state == POLL_OK:
+                return
+            elif state == POLL_READ:
+                await self._wait_fd(loop.add_reader, loop.remove_reader)
+            elif state == POLL_WRITE:
+                await self._wait_fd(loop.add_writer, loop.remove_writer)
+            else:
+                raise psycopg2.OperationalError(
+                    f'Unexpected state from poll(): {state}')
+
+    async def _wait_fd(self, add, remove):
+        fd = self.conn.fileno()
+        future = asyncio.get_event_loop().create_future()
+
+        def ready():
+            if not future.done():
+                future.set_result(None)
+
+        add(fd, ready)
+        try:
+            await future
+        finally:
+            remove(fd)
+
+    async def run(self, query: str, args=None, fetch=None):
+        """
+        Runs a query as is (ie: without preparing it). fetch may be 'all' or
+        'one', to return the rows (as dicts).
+        """
+        cur = self.conn.cursor(cursor_factory=RealDictCursor)
+        try:
+            cur.execute(query, args)
+            await self.wait()
+
+            if fetch == 'all':
+                return cur.fetchall()
+            elif fetch == 'one':
+                return cur.fetchone()
+
+            return None
+        finally:
+            cur.close()
+
+    async def execute(self, statement: Statement, args=(), fetch=None):
+        """
+        Executes the statement, preparing it on this connection first if
+        required. fetch may be 'all' or 'one', to return the rows (as dicts).
+        """
+        if statement.name not in self.prepared:
+            await self.run(f'prepare {statement.name} as {statement.query}')
+            self.prepared.add(statement.name)
+
+        if len(args) > 0:
+            placeholders = ', '.join(['%s'] * len(args))
+            return await self.run(
+                f'execute {statement.name} ({placeholders})', args, fetch)
+
+        return await self.run(f'execute {statement.name}', fetch=fetch)
+
+    async def stream(self, statement: Statement, size=100):
+        """
+        Yields the rows of the statement (which must not take any
+        parameters) as they are read from a server side cursor,
+        size rows at a time.
+
+        The cursor lives in a transaction, which is only committed once all
+        the rows have been read. If the caller stops early, the connection
+        must be discarded.
+        """
+        await self.run('begin;')
+        await self.run(f'declare {statement.name} no scroll cursor '
+                       f'for {statement.query}')
+        while True:
+            rows = await self.run(f'fetch {size} from {statement.name};',
+                                  fetch='all')
+            for row in rows:
+                yield row
+
+            if len(rows) < size:
+                break
+
+        await self.run('commit;')
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+import typing
+
+Statement = typing.NamedTuple('Statement', [
+    ('name', str),
+    ('query', str)
+])
+"""
+A query which is prepared once per pooled connection, and executed by name.
+Parameters in the query must be written as $1, $2, etc.
+"""
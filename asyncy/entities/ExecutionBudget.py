@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+
+from ..Exceptions import StoryscriptRuntimeError
+
+
+class ExecutionBudget:
+    """
+    Keeps track of how much a story has executed, so that a single story
+    can't monopolise the event loop (which is shared by all the apps
+    running on this engine).
+
+    Execution is divided into time slices. Once a slice has used up it's
+    lines or time, the interpreter yields to the event loop (see
+    ExecutionBudget#should_yield). In addition to that, a story which
+    executes more than max_steps lines, or runs for longer than
+    max_seconds, is aborted.
+
+    A limit of 0 means that there's no limit.
+    """
+
+    def __init__(self, slice_lines=0, slice_seconds=0,
+                 max_steps=0, max_seconds=0):
+        self.slice_lines = slice_lines
+        self.slice_seconds = slice_seconds
+        self.max_steps = max_steps
+        self.max_seconds = max_seconds
+
+        self.steps = 0
+        self.started = time.monotonic()
+        self.slice_steps = 0
+        self.slice_started = self.started
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            slice_lines=int(config.STORY_SLICE_LINES),
+            slice_seconds=int(config.STORY_SLICE_MICROSECONDS) / 1000000,
+            max_steps=int(config.STORY_MAX_STEPS),
+            max_seconds=int(config.STORY_MAX_SECONDS))
+
+    def step(self, story=None, line=None):
+        """
+        Accounts for the execution of a single line.
+        Raises a StoryscriptRuntimeError if the story has exceeded it's
+        step or wall clock budget.
+        """
+        self.steps += 1
+        self.slice_steps += 1
+
+        if self.max_steps and self.steps > self.max_steps:
+            raise StoryscriptRuntimeError(
+                message=f'Story exceeded the maximum number of steps '
+                f'({self.max_steps})',
+                story=story, line=line)
+
+        if self.max_seconds and \
+                time.monotonic() - self.started > self.max_seconds:
+            raise StoryscriptRuntimeError(
+                message=f'Story exceeded the maximum execution time '
+                f'({self.max_seconds}s)',
+                story=story, line=line)
+
+    def should_yield(self) -> bool:
+        """
+        Returns True if the current time slice has been used up.
+        """
+        if self.slice_lines and self.slice_steps >= self.slice_lines:
+            return True
+
+        if self.slice_seconds and \
+                time.monotonic() - self.slice_started >= self.slice_seconds:
+            return True
+
+        return False
+
+    async def yield_(self):
+        """
+        Yields to the event loop, and starts a new time slice once
+        this story is resumed.
+        """
+        await asyncio.sleep(0)
+        self.slice_steps = 0
+        self.slice_started = time.monotonic()
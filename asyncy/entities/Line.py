@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+
+class Line(dict):
+    """
+    A line of a story tree, as produced by asyncy.processing.Compiler.
+
+    A Line is still the dict found in stories.json, so everything which
+    reads the raw tree continues to work. In addition to that, it holds
+    direct references to the lines around it, the Lexicon handler which
+    executes it and its arguments keyed by name, so that the interpreter
+    doesn't need to look these up every time the line is executed.
+    """
+    __slots__ = ('handler', 'next_line', 'enter_line', 'parent_line',
+                 'arguments', 'ancestors', 'depth', 'exit_line', 'is_async',
+                 'reads', 'writes', 'batch', 'parallel',
+                 'chain', 'command_conf', 'internal')
+
+    def __init__(self, raw: dict):
+        super().__init__(raw)
+        self.handler = None
+        self.next_line = None
+        self.enter_line = None
+        self.parent_line = None
+        self.arguments = {}
+
+        # The block index of this line (see Compiler#index_blocks).
+        # ancestors holds the line numbers of all the blocks this line is
+        # nested in. exit_line is the first line after this line (and it's
+        # block, if any) which isn't nested inside it. Unlike "exit" in the
+        # raw tree, it's reliable.
+        self.ancestors = frozenset()
+        self.depth = 0
+        self.exit_line = None
+
+        # Whether executing this line (or it's block) may perform I/O,
+        # and must therefore be awaited (see Compiler#index_async_lines).
+        self.is_async = True
+
+        # The variables (by their root name) which this line reads from
+        # and writes to the context. See Compiler#index_dataflow.
+        self.reads = frozenset()
+        self.writes = frozenset()
+
+        # If this line starts a run of independent service calls, the
+        # lines in that run (including this line), which may be executed
+        # concurrently. None otherwise.
+        self.batch = None
+
+        # Whether the iterations of this for loop are independent of each
+        # other, and may run in parallel. See Compiler#index_loops.
+        self.parallel = False
+
+        # The service (and command) which this line calls. These depend on
+        # the tree and the services of the app only, so Services memoises
+        # them here the first time they're resolved.
+        self.chain = None
+        self.command_conf = None
+        self.internal = None
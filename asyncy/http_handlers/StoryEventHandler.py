@@ -11,6 +11,7 @@ import ujson
 from .BaseHandler import BaseHandler
 from .. import Metrics
 from ..Apps import Apps
+from ..Exceptions import AppNotDeployedError
 from ..constants import ContextConstants
 from ..entities.Multipart import FileFormField
 from ..processing import Story
@@ -30,6 +31,9 @@ class StoryEventHandler(BaseHandler):
         }
 
         app = Apps.get(app_id)
+        if app is None:
+            Metrics.app_unavailable_events_total.labels(app_id=app_id).inc()
+            raise AppNotDeployedError(app_id)
 
         for key in self.get_req().files.keys():
             if key == CLOUD_EVENTS_FILE_KEY:
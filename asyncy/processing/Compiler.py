@@ -0,0 +1,406 @@
+# -*- coding: utf-8 -*-
+from .Lexicon import Lexicon
+from .Services import Services
+from ..entities.Line import Line
+from ..utils.ExpressionCompiler import ExpressionCompiler
+
+
+class Compiler:
+    """
+    Compiles the trees found in stories.json into pre-linked Line objects.
+
+    This is done once per story when an app is deployed, so that the
+    interpreter doesn't have to dispatch on the method of a line, or look
+    up its neighbours in the tree, every time the line is executed.
+    """
+
+    handlers = {
+        'if': 'if_condition',
+        'elif': 'if_condition',
+        'else': 'if_condition',
+        'for': 'for_loop',
+        'execute': 'execute',
+        'set': 'set',
+        'expression': 'set',
+        'mutation': 'set',
+        'call': 'call',
+        'function': 'function',
+        'when': 'when',
+        'return': 'ret',
+        'break': 'break_'
+    }
+    """
+    Maps the method of a line to the name of it's handler in Lexicon.
+    """
+
+    async_methods = ('execute', 'when', 'call')
+    """
+    Methods whose handlers are coroutines, because they (may) perform I/O.
+    All the other handlers in Lexicon are plain functions.
+    """
+
+    @classmethod
+    def compile_stories(cls, stories: dict, services: dict = None) -> dict:
+        compiled = {}
+        for story_name, story in stories.items():
+            compiled[story_name] = cls.compile_story(story, services)
+
+        return compiled
+
+    @classmethod
+    def compile_story(cls, story: dict, services: dict = None) -> dict:
+        """
+        Returns a copy of the story, with it's tree compiled.
+        The story itself is not modified.
+        """
+        compiled = dict(story)
+        compiled['tree'] = cls.compile_tree(story['tree'], services)
+        return compiled
+
+    @classmethod
+    def compile_tree(cls, tree: dict, services: dict = None) -> dict:
+        """
+        Compiles a tree into Lines. services are the services of the app
+        (as in App#services), which are required to find the service calls
+        that can be executed concurrently. If they're not given, all the
+        lines are executed one after the other.
+        """
+        lines = {}
+        for line_number, raw in tree.items():
+            lines[line_number] = Line(raw)
+
+        for line in lines.values():
+            line.handler = cls.lookup_handler(line.get('method'))
+            line.next_line = lines.get(line.get('next'))
+            line.enter_line = lines.get(line.get('enter'))
+            line.parent_line = lines.get(line.get('parent'))
+            line.arguments = cls.arguments(line)
+
+            if isinstance(line.get('args'), list):
+                line['args'] = [cls.compile_arg(arg) for arg in line['args']]
+
+        cls.index_blocks(lines)
+        cls.index_async_lines(lines)
+        cls.index_dataflow(lines)
+        cls.index_loops(lines)
+        if services is not None:
+            cls.index_batches(lines, services)
+
+        return lines
+
+    @classmethod
+    def index_blocks(cls, lines: dict):
+        """
+        Builds the block index of a compiled tree.
+
+        For every line, this records the blocks it is nested in, it's depth,
+        and the line which follows it once it (and it's block) is done.
+        This makes Stories#line_has_parent and Stories#next_block
+        constant time lookups during execution.
+        """
+        for line in lines.values():
+            cls._index_ancestors(line)
+
+        for line in lines.values():
+            exit_line = line.next_line
+            while exit_line is not None and line['ln'] in exit_line.ancestors:
+                exit_line = exit_line.next_line
+
+            line.exit_line = exit_line
+
+    @classmethod
+    def index_async_lines(cls, lines: dict):
+        """
+        Marks the lines which can be executed synchronously.
+
+        A line is synchronous if it's handler doesn't perform any I/O.
+        Story#execute and Story#execute_block run synchronous lines
+        without creating a coroutine for each one of them.
+
+        A for loop which is nested inside another for loop, and whose block
+        doesn't contain any asynchronous lines, is executed entirely by
+        Lexicon#for_loop_sync. Outer loops remain asynchronous, so that they
+        can yield to the event loop between iterations (see ExecutionBudget).
+        Synchronous loops switch to executing asynchronously once they've
+        used up the time slice of the story.
+        """
+        async_blocks = set()
+        loops = set()
+        for line in lines.values():
+            line.is_async = line.handler is None or \
+                line.get('method') in cls.async_methods
+            if line.is_async:
+                async_blocks.update(line.ancestors)
+            if line.get('method') == 'for':
+                loops.add(line['ln'])
+
+        for line in lines.values():
+            if line.get('method') == 'for':
+                line.is_async = line['ln'] in async_blocks or \
+                    loops.isdisjoint(line.ancestors)
+                if not line.is_async:
+                    line.handler = Lexicon.for_loop_sync
+
+    @classmethod
+    def index_dataflow(cls, lines: dict):
+        """
+        Records the variables read and written by every line.
+        Variables are identified by their root name, so writing to a.b
+        is considered to be a write to a.
+        """
+        for line in lines.values():
+            reads = set()
+            for key in ('args', 'arguments', 'arg'):
+                cls._collect_reads(line.get(key), reads)
+            line.reads = frozenset(reads)
+
+            writes = set()
+            for key in ('name', 'output'):
+                value = line.get(key)
+                if isinstance(value, list) and len(value) > 0:
+                    if key == 'name':
+                        writes.add(value[0])
+                    else:
+                        writes.update(value)
+            line.writes = frozenset(writes)
+
+    @classmethod
+    def _collect_reads(cls, item, reads: set):
+        if isinstance(item, dict):
+            if item.get('$OBJECT') == 'path':
+                paths = item.get('paths') or []
+                if len(paths) > 0 and isinstance(paths[0], str):
+                    reads.add(paths[0])
+
+            for value in item.values():
+                cls._collect_reads(value, reads)
+        elif isinstance(item, list):
+            for value in item:
+                cls._collect_reads(value, reads)
+
+    @classmethod
+    def index_loops(cls, lines: dict):
+        """
+        Marks the for loops whose iterations may run in parallel
+        (see Lexicon#for_loop_parallel).
+
+        Each parallel iteration writes to it's own frame of the context,
+        so a loop qualifies if no iteration depends on what an earlier
+        iteration has written. That is, the block of the loop:
+        1. Performs I/O (otherwise there is nothing to gain)
+        2. Doesn't read a variable written inside the block, unless an
+           earlier line of the same iteration has definitely written it
+        3. Doesn't mutate values in place, or write to a nested path
+        4. Doesn't start streaming services, or listen to events
+        """
+        for line in lines.values():
+            if line.get('method') != 'for' or not line.is_async:
+                continue
+
+            block = [child for child in lines.values()
+                     if line['ln'] in child.ancestors]
+            line.parallel = cls.is_parallel(line, block)
+
+    @classmethod
+    def is_parallel(cls, loop: Line, block: list) -> bool:
+        if not any(child.get('method') in cls.async_methods
+                   for child in block):
+            return False
+
+        written = set()
+        for child in block:
+            written.update(child.writes)
+
+        # Variables which are written unconditionally by this iteration,
+        # before the line being looked at.
+        defined = set(loop.writes)
+        for child in block:
+            method = child.get('method')
+            if method in ('when', 'function', 'mutation') or \
+                    (method == 'execute' and child.get('enter') is not None):
+                return False
+
+            name = child.get('name')
+            if isinstance(name, list) and len(name) > 1:
+                return False
+
+            if cls._has_mutation(child.get('args')):
+                return False
+
+            if not child.reads.isdisjoint(written - defined):
+                return False
+
+            if child.get('parent') == loop['ln'] or method == 'for':
+                # Lines nested further down (eg: in an if) are conditional.
+                # The variable of a nested loop is defined for it's block.
+                defined.update(child.writes)
+
+        return True
+
+    @classmethod
+    def _has_mutation(cls, item) -> bool:
+        if isinstance(item, dict):
+            if item.get('$OBJECT') == 'mutation':
+                return True
+
+            return any(cls._has_mutation(value) for value in item.values())
+        elif isinstance(item, list):
+            return any(cls._has_mutation(value) for value in item)
+
+        return False
+
+    @classmethod
+    def index_batches(cls, lines: dict, services: dict):
+        """
+        Finds runs of consecutive service calls which don't depend on each
+        other, and records each run on it's first line (see Line#batch).
+        Story#execute_batch executes the lines of a run concurrently.
+
+        Two calls depend on each other if one of them reads or writes a
+        variable written by the other, or if they're calls to the same
+        service (whose state the first call might change, such as a set
+        followed by a get on redis). Only calls to external services
+        are considered; internal services (such as log) have side effects
+        whose ordering is observable, and so do calls to the service which
+        triggered a story (such as http write). These are always executed
+        in order.
+        """
+        concurrent = set()
+        previous = {}
+        for line in lines.values():
+            if cls.is_concurrent(line, services):
+                concurrent.add(line['ln'])
+            if line.next_line is not None:
+                previous[line.next_line['ln']] = line
+
+        def continues(line, prev):
+            # Whether line and prev are concurrent calls, and line comes
+            # right after prev (within the same block).
+            return line is not None and prev is not None and \
+                line['ln'] in concurrent and prev['ln'] in concurrent and \
+                prev.get('parent') == line.get('parent')
+
+        for line in lines.values():
+            if line['ln'] not in concurrent or \
+                    continues(line, previous.get(line['ln'])):
+                continue
+
+            batch = [line]
+            next_line = line.next_line
+            while continues(next_line, batch[-1]):
+                if cls.depends_on(next_line, batch):
+                    cls._set_batch(batch)
+                    batch = []
+
+                batch.append(next_line)
+                next_line = next_line.next_line
+
+            cls._set_batch(batch)
+
+    @staticmethod
+    def _set_batch(batch: list):
+        if len(batch) > 1:
+            batch[0].batch = tuple(batch)
+
+    @staticmethod
+    def depends_on(line: Line, batch: list) -> bool:
+        for other in batch:
+            if line.get('service') == other.get('service') or \
+                    not line.reads.isdisjoint(other.writes) or \
+                    not line.writes.isdisjoint(other.reads) or \
+                    not line.writes.isdisjoint(other.writes):
+                return True
+
+        return False
+
+    @classmethod
+    def is_concurrent(cls, line: Line, services: dict) -> bool:
+        """
+        Returns True if the line is a call to an external service, which
+        may be executed concurrently with other calls.
+        """
+        if line.get('method') != 'execute' or line.get('enter') is not None:
+            return False
+
+        service = line.get('service')
+        if service not in services or \
+                Services.internal_services.get(service) is not None:
+            return False
+
+        try:
+            conf = services[service]['configuration']['actions'][
+                line['command']]
+        except (KeyError, TypeError):
+            return False
+
+        http = conf.get('http') or {}
+        return not http.get('use_event_conn', False)
+
+    @classmethod
+    def _index_ancestors(cls, line: Line):
+        parent = line.get('parent')
+        if parent is None or len(line.ancestors) > 0:
+            return
+
+        parent_line = line.parent_line
+        if parent_line is not None:
+            cls._index_ancestors(parent_line)
+            line.ancestors = parent_line.ancestors | {parent}
+        else:
+            line.ancestors = frozenset([parent])
+
+        line.depth = len(line.ancestors)
+
+    @classmethod
+    def arguments(cls, line: dict) -> dict:
+        """
+        Returns the (unresolved) arguments of a line, keyed by their name.
+        """
+        arguments = {}
+        args = line.get('args', line.get('arguments', line.get('arg')))
+        for arg in args or []:
+            if not isinstance(arg, dict):
+                continue
+
+            if arg.get('$OBJECT') == 'argument' or \
+                    arg.get('$OBJECT') == 'arg':
+                # The first argument wins, as per Stories#argument_by_name.
+                arguments.setdefault(arg['name'],
+                                     ExpressionCompiler.compile_expression(
+                                         arg.get('argument', arg.get('arg'))))
+
+        return arguments
+
+    @classmethod
+    def compile_arg(cls, arg):
+        """
+        Compiles a positional argument of a line into an Expression.
+        Named arguments are compiled in Compiler#arguments, and mutations
+        are applied by Mutations, so these are left as they are.
+        """
+        if isinstance(arg, dict) and \
+                arg.get('$OBJECT') not in ('argument', 'arg', 'mutation'):
+            return ExpressionCompiler.compile_expression(arg)
+
+        return arg
+
+    @classmethod
+    def lookup_handler(cls, method):
+        name = cls.handlers.get(method)
+        if name is None:
+            return None
+
+        return getattr(Lexicon, name)
+
+    @classmethod
+    def handler(cls, line: dict):
+        """
+        Returns the Lexicon handler for the given line.
+
+        Compiled lines carry their handler with them. Lines which have not
+        been compiled are dispatched on their method.
+        """
+        if isinstance(line, Line):
+            return line.handler
+
+        return cls.lookup_handler(line['method'])
@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import inspect
 import time
+from collections import ChainMap
 
 from .Mutations import Mutations
 from .Services import Services
@@ -10,6 +13,7 @@ from ..Stories import Stories
 from ..Types import StreamingService
 from ..constants.LineConstants import LineConstants
 from ..constants.LineSentinels import LineSentinels, ReturnSentinel
+from ..entities.Line import Line
 
 
 class Lexicon:
@@ -64,7 +68,7 @@ class Lexicon:
             return Lexicon.line_number_or_none(story.line(line.get('next')))
 
     @staticmethod
-    async def function(logger, story, line):
+    def function(logger, story, line):
         """
         Functions are not executed when they're encountered.
         This method returns the next block's line number,
@@ -121,7 +125,7 @@ class Lexicon:
                 line = parent_line
 
     @staticmethod
-    async def break_(logger, story, line):
+    def break_(logger, story, line):
         # Ensure that we're in a foreach loop. If we are, return BREAK,
         # otherwise raise an exception.
         if Lexicon._does_line_have_parent_method(story, line, 'for'):
@@ -138,7 +142,7 @@ class Lexicon:
         return None
 
     @staticmethod
-    async def set(logger, story, line):
+    def set(logger, story, line):
         value = story.resolve(line['args'][0])
 
         if len(line['args']) > 1:
@@ -167,7 +171,7 @@ class Lexicon:
         return story.resolve(line['args'][0], encode=False)
 
     @staticmethod
-    async def if_condition(logger, story, line):
+    def if_condition(logger, story, line):
         """
         Evaluates the resolution value to decide whether to enter
         inside an if-block.
@@ -231,13 +235,38 @@ class Lexicon:
         """
         Evaluates a for loop.
         """
+        if isinstance(line, Line) and line.parallel:
+            concurrency = story.app.app_config.get_loop_concurrency()
+            if concurrency > 1:
+                return await Lexicon.for_loop_parallel(logger, story, line,
+                                                       concurrency)
+
         _list = story.resolve(line['args'][0], encode=False)
+        return await Lexicon.for_loop_iterate(logger, story, line,
+                                              iter(_list))
+
+    @staticmethod
+    async def for_loop_iterate(logger, story, line, items, pending=None):
+        """
+        Executes the block of a for loop for every item left in items.
+
+        pending is the rest of the iteration which was in progress (if
+        any), when a loop started by Lexicon#for_loop_sync used up it's
+        time slice. The item of that iteration is in the context already.
+        """
         output = line['output'][0]
 
         from . import Story
 
         try:
-            for item in _list:
+            if pending is not None:
+                result = await pending
+                if LineSentinels.BREAK == result:
+                    return Lexicon.line_number_or_none(story.next_block(line))
+                elif LineSentinels.is_sentinel(result):
+                    return result
+
+            for item in items:
                 story.context[output] = item
 
                 result = await Story.execute_block(logger, story, line)
@@ -248,13 +277,123 @@ class Lexicon:
                     # We do not know what to do with this sentinel,
                     # so bubble it up.
                     return result
+
+                if story.budget.should_yield():
+                    await story.budget.yield_()
         finally:
             # Don't leak the variable to the outer scope.
-            del story.context[output]
+            story.context.pop(output, None)
 
         # Use story.next_block(line), because line["exit"] is unreliable...
         return Lexicon.line_number_or_none(story.next_block(line))
 
+    @staticmethod
+    async def for_loop_parallel(logger, story, line, concurrency):
+        """
+        Evaluates a for loop, running up to concurrency iterations at once.
+        See Compiler#index_loops for the loops which qualify.
+
+        Every iteration runs on a fork of the story, whose context is a new
+        frame on top of the current one. Once the loop is done, the frames
+        are merged into the context in the order of the iterations, so the
+        outcome is the same as if the iterations ran one after the other.
+        A sentinel (such as break) cancels all the iterations after the one
+        which returned it, and their frames are discarded.
+        """
+        _list = story.resolve(line['args'][0], encode=False)
+        output = line['output'][0]
+
+        from . import Story
+
+        semaphore = asyncio.Semaphore(concurrency)
+        frames = [ChainMap({output: item}, story.context) for item in _list]
+        tasks = []
+
+        async def iterate(index, frame):
+            async with semaphore:
+                result = await Story.execute_block(
+                    logger, story.fork(frame), line)
+
+            if LineSentinels.is_sentinel(result):
+                for task in tasks[index + 1:]:
+                    task.cancel()
+
+            return result
+
+        for index, frame in enumerate(frames):
+            tasks.append(asyncio.ensure_future(iterate(index, frame)))
+
+        result = None
+        try:
+            for index, task in enumerate(tasks):
+                result = await task
+                if LineSentinels.is_sentinel(result):
+                    frames = frames[:index + 1]
+                    break
+        finally:
+            # The iterations which are left (or have failed after a
+            # sentinel) are cancelled, and their outcome is retrieved,
+            # so that their exceptions aren't reported as unretrieved.
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        for frame in frames:
+            # Don't leak the variable to the outer scope.
+            frame.maps[0].pop(output, None)
+            story.context.update(frame.maps[0])
+
+        if LineSentinels.is_sentinel(result) and \
+                LineSentinels.BREAK != result:
+            return result
+
+        return Lexicon.line_number_or_none(story.next_block(line))
+
+    @staticmethod
+    def for_loop_sync(logger, story, line):
+        """
+        Evaluates a for loop, whose block doesn't perform any I/O.
+        See Compiler#index_async_lines.
+
+        Once the time slice of the story has been used up (or a nested
+        loop has used it up), the rest of the loop is executed
+        asynchronously, like Lexicon#for_loop does, so that a long
+        loop doesn't block the event loop. The awaitable for it is
+        returned instead of the next line (see Story#await_line).
+        """
+        _list = story.resolve(line['args'][0], encode=False)
+        output = line['output'][0]
+        items = iter(_list)
+
+        from . import Story
+
+        try:
+            for item in items:
+                story.context[output] = item
+
+                result = Story.execute_block_sync(logger, story, line)
+
+                if inspect.isawaitable(result):
+                    # The variable is removed by Lexicon#for_loop_iterate.
+                    return Lexicon.for_loop_iterate(
+                        logger, story, line, items, pending=result)
+                elif LineSentinels.BREAK == result:
+                    break
+                elif LineSentinels.is_sentinel(result):
+                    story.context.pop(output, None)
+                    return result
+
+                if story.budget.should_yield():
+                    return Lexicon.for_loop_iterate(
+                        logger, story, line, items,
+                        pending=story.budget.yield_())
+        except BaseException as e:
+            story.context.pop(output, None)
+            raise e
+
+        story.context.pop(output, None)
+        return Lexicon.line_number_or_none(story.next_block(line))
+
     @staticmethod
     async def when(logger, story, line):
         service = line[LineConstants.service]
@@ -272,7 +411,7 @@ class Lexicon:
                 story=story, line=line)
 
     @classmethod
-    async def ret(cls, logger, story: Stories, line):
+    def ret(cls, logger, story: Stories, line):
         """
         Implementation for return.
         The semantics for return are as follows:
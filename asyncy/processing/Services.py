@@ -19,6 +19,7 @@ from ..Types import Command, Event, InternalCommand, \
 from ..constants.ContextConstants import ContextConstants
 from ..constants.LineConstants import LineConstants
 from ..constants.ServiceConstants import ServiceConstants
+from ..entities.Line import Line
 from ..entities.Multipart import FileFormField, FormField
 from ..omg.ServiceOutputValidator import ServiceOutputValidator
 from ..utils import Dict
@@ -58,12 +59,26 @@ class Services:
         return chain[len(chain) - 1]
 
     @classmethod
-    async def execute(cls, story, line):
+    def is_internal_line(cls, story, line):
+        """
+        Returns True if the line calls an internal service.
+        """
+        if isinstance(line, Line) and line.internal is not None:
+            return line.internal
+
         chain = cls.resolve_chain(story, line)
         assert isinstance(chain, deque)
         assert isinstance(chain[0], Service)
 
-        if cls.is_internal(chain[0].name, cls.last(chain).name):
+        internal = cls.is_internal(chain[0].name, cls.last(chain).name)
+        if isinstance(line, Line):
+            line.internal = internal
+
+        return internal
+
+    @classmethod
+    async def execute(cls, story, line):
+        if cls.is_internal_line(story, line):
             return await cls.execute_internal(story, line)
         else:
             return await cls.execute_external(story, line)
@@ -97,7 +112,7 @@ class Services:
         """
         service = line[LineConstants.service]
         chain = cls.resolve_chain(story, line)
-        command_conf = cls.get_command_conf(story, chain)
+        command_conf = cls.command_conf(story, line)
         await cls.start_container(story, line)
         if command_conf.get('format') is not None:
             return await Containers.exec(story.logger, story, line,
@@ -134,7 +149,11 @@ class Services:
 
         The first entry in the chain will always be a concrete service,
         and the last entry will always be a command.
+
+        The chain of a compiled line is resolved once, and memoised on it.
         """
+        if isinstance(line, Line) and line.chain is not None:
+            return line.chain
 
         def get_owner(line):
             service = line[LineConstants.service]
@@ -171,8 +190,27 @@ class Services:
             assert parent_line is not None
 
         story.logger.debug(f'Chain resolved - {chain}')
+        if isinstance(line, Line):
+            line.chain = chain
+
         return chain
 
+    @classmethod
+    def command_conf(cls, story, line):
+        """
+        Returns the conf for the command called by the line.
+        See Services#get_command_conf.
+        """
+        if isinstance(line, Line) and line.command_conf is not None:
+            return line.command_conf
+
+        command_conf = cls.get_command_conf(story,
+                                            cls.resolve_chain(story, line))
+        if isinstance(line, Line):
+            line.command_conf = command_conf
+
+        return command_conf
+
     @classmethod
     def get_command_conf(cls, story, chain):
         """
@@ -568,6 +606,11 @@ class Services:
             'app_id': story.app.app_id
         }
 
+        if story.app.reuse_subscription(body) is not None:
+            story.logger.debug(f'Subscription to {service} from {s.command} '
+                               f'is unchanged, reusing it')
+            return
+
         # Why request_timeout is set to 120 seconds:
         # Since this is the Synapse, Synapse does multiple internal retries,
         # so we must set this to a really high value.
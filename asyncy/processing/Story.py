@@ -1,13 +1,17 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import inspect
 import time
 
+from .Compiler import Compiler
 from .. import Metrics
 from ..Exceptions import StoryscriptError
 from ..Exceptions import StoryscriptRuntimeError
 from ..Stories import Stories
 from ..constants.ContextConstants import ContextConstants
 from ..constants.LineSentinels import LineSentinels
-from ..processing import Lexicon
+from ..entities.ExecutionBudget import ExecutionBudget
+from ..entities.Line import Line
 
 
 class Story:
@@ -30,7 +34,16 @@ class Story:
         """
         line_number = story.first_line()
         while line_number:
-            result = await Story.execute_line(logger, story, line_number)
+            line = story.line(line_number)
+            if isinstance(line, Line) and not line.is_async:
+                result = Story.execute_line_sync(logger, story, line_number)
+                if inspect.isawaitable(result):
+                    result = await Story.await_line(logger, story,
+                                                    line_number, result)
+            elif isinstance(line, Line) and line.batch is not None:
+                result = await Story.execute_batch(logger, story, line.batch)
+            else:
+                result = await Story.execute_line(logger, story, line_number)
 
             # Sentinels are not allowed to escape from here.
             if LineSentinels.is_sentinel(result):
@@ -41,6 +54,9 @@ class Story:
             line_number = result
             logger.log('story-execution', line_number)
 
+            if story.budget.should_yield():
+                await story.budget.yield_()
+
     @staticmethod
     async def execute_line(logger, story, line_number):
         """
@@ -53,46 +69,102 @@ class Story:
         """
         line: dict = story.line(line_number)
         story.start_line(line_number)
+        story.budget.step(story, line)
 
         with story.new_frame(line_number):
             try:
-                method = line['method']
-                if method == 'if' or method == 'else' or method == 'elif':
-                    return await Lexicon.if_condition(logger, story, line)
-                elif method == 'for':
-                    return await Lexicon.for_loop(logger, story, line)
-                elif method == 'execute':
-                    return await Lexicon.execute(logger, story, line)
-                elif method == 'set' or method == 'expression' \
-                        or method == 'mutation':
-                    return await Lexicon.set(logger, story, line)
-                elif method == 'call':
-                    return await Lexicon.call(logger, story, line)
-                elif method == 'function':
-                    return await Lexicon.function(logger, story, line)
-                elif method == 'when':
-                    return await Lexicon.when(logger, story, line)
-                elif method == 'return':
-                    return await Lexicon.ret(logger, story, line)
-                elif method == 'break':
-                    return await Lexicon.break_(logger, story, line)
-                else:
+                handler = Compiler.handler(line)
+                if handler is None:
                     raise NotImplementedError(
-                        f'Unknown method to execute: {method}'
+                        f'Unknown method to execute: {line["method"]}'
                     )
+
+                result = handler(logger, story, line)
+                if inspect.isawaitable(result):
+                    result = await result
+
+                return result
             except BaseException as e:
-                # Don't wrap StoryscriptError.
-                if isinstance(e, StoryscriptError):
-                    e.story = story  # Always set.
-                    e.line = line  # Always set.
-                    raise e
+                raise Story.wrap_exception(story, line, e)
 
-                raise StoryscriptRuntimeError(
-                    message='Failed to execute line',
-                    story=story, line=line, root=e)
+    @staticmethod
+    def execute_line_sync(logger, story, line_number):
+        """
+        Executes a single line which doesn't perform any I/O, without
+        creating a coroutine for it. See Compiler#index_async_lines.
+
+        :return: Same as Story#execute_line.
+        """
+        line: Line = story.line(line_number)
+        story.start_line(line_number)
+        story.budget.step(story, line)
+
+        with story.new_frame(line_number):
+            try:
+                return line.handler(logger, story, line)
+            except BaseException as e:
+                raise Story.wrap_exception(story, line, e)
+
+    @staticmethod
+    async def await_line(logger, story, line_number, pending):
+        """
+        Awaits the rest of a line which Story#execute_line_sync started,
+        but which has used up the time slice of the story (see
+        Lexicon#for_loop_sync).
+
+        :return: Same as Story#execute_line.
+        """
+        line = story.line(line_number)
+        with story.new_frame(line_number):
+            try:
+                return await pending
+            except BaseException as e:
+                raise Story.wrap_exception(story, line, e)
+
+    @staticmethod
+    async def execute_batch(logger, story, batch):
+        """
+        Executes a run of independent service calls concurrently.
+        See Compiler#index_batches.
+
+        Every call runs on a fork of the story (see Stories#fork), so that
+        they don't share a stack. The lines of a batch don't depend on
+        each other's variables, so they share the context.
+        If any of the calls fails, the others are cancelled.
+
+        :return: The return value of the last line in the batch.
+        """
+        tasks = [asyncio.ensure_future(
+            Story.execute_line(logger, story.fork(story.context), line['ln']))
+            for line in batch]
+
+        try:
+            results = await asyncio.gather(*tasks)
+        except BaseException as e:
+            for task in tasks:
+                task.cancel()
+            raise e
+
+        return results[-1]
+
+    @staticmethod
+    def wrap_exception(story, line, e):
+        """
+        Returns the exception to be raised when executing a line fails.
+        """
+        # Don't wrap StoryscriptError.
+        if isinstance(e, StoryscriptError):
+            e.story = story  # Always set.
+            e.line = line  # Always set.
+            return e
+
+        return StoryscriptRuntimeError(
+            message='Failed to execute line',
+            story=story, line=line, root=e)
 
     @staticmethod
-    async def execute_block(logger, story, parent_line: dict):
+    async def execute_block(logger, story, parent_line: dict,
+                            next_line: dict = None):
         """
         Executes all the lines whose parent is parent_line, and returns
         either one of the following:
@@ -101,23 +173,40 @@ class Story:
 
         The result can have special significance, such as the BREAK
         line sentinel.
+
+        If next_line is given, the block is resumed from it, rather than
+        executed from the start (see Story#resume_block).
         """
-        next_line = story.line(parent_line['enter'])
+        if next_line is None:
+            next_line = story.line(parent_line['enter'])
 
-        # If this block represents a streaming service, copy over it's
-        # output to the context, so that Lexicon can read it later.
-        if parent_line.get('output') is not None \
-                and parent_line.get('method') == 'when':
-            story.context[ContextConstants.service_output] = \
-                parent_line['output'][0]
+            # If this block represents a streaming service, copy over it's
+            # output to the context, so that Lexicon can read it later.
+            if parent_line.get('output') is not None \
+                    and parent_line.get('method') == 'when':
+                story.context[ContextConstants.service_output] = \
+                    parent_line['output'][0]
 
-            if story.context.get(ContextConstants.service_event) is not None:
-                story.context[parent_line['output'][0]] = \
-                    story.context[ContextConstants.service_event].get('data')
+                if story.context.get(ContextConstants.service_event) \
+                        is not None:
+                    story.context[parent_line['output'][0]] = \
+                        story.context[ContextConstants.service_event] \
+                        .get('data')
 
         while next_line is not None \
                 and story.line_has_parent(parent_line['ln'], next_line):
-            result = await Story.execute_line(logger, story, next_line['ln'])
+            if isinstance(next_line, Line) and not next_line.is_async:
+                result = Story.execute_line_sync(logger, story,
+                                                 next_line['ln'])
+                if inspect.isawaitable(result):
+                    result = await Story.await_line(logger, story,
+                                                    next_line['ln'], result)
+            elif isinstance(next_line, Line) and next_line.batch is not None:
+                result = await Story.execute_batch(logger, story,
+                                                   next_line.batch)
+            else:
+                result = await Story.execute_line(logger, story,
+                                                  next_line['ln'])
 
             if result == LineSentinels.RETURN:
                 return None  # Block has completed execution.
@@ -126,8 +215,60 @@ class Story:
 
             next_line = story.line(result)
 
+            if story.budget.should_yield():
+                await story.budget.yield_()
+
+        return None
+
+    @staticmethod
+    def execute_block_sync(logger, story, parent_line: Line):
+        """
+        Same as Story#execute_block, for blocks which don't perform any I/O.
+
+        If a line of the block uses up the time slice of the story (see
+        Lexicon#for_loop_sync), the rest of the block is executed
+        asynchronously, and the awaitable for it is returned.
+        """
+        next_line = story.line(parent_line['enter'])
+
+        while next_line is not None \
+                and story.line_has_parent(parent_line['ln'], next_line):
+            result = Story.execute_line_sync(logger, story, next_line['ln'])
+
+            if inspect.isawaitable(result):
+                return Story.resume_block(logger, story, parent_line,
+                                          next_line['ln'], result)
+            elif result == LineSentinels.RETURN:
+                return None  # Block has completed execution.
+            elif LineSentinels.is_sentinel(result):
+                return result
+
+            next_line = story.line(result)
+
         return None
 
+    @staticmethod
+    async def resume_block(logger, story, parent_line: Line, line_number,
+                           pending):
+        """
+        Finishes executing a block which Story#execute_block_sync started,
+        once the rest of line_number (pending) has been awaited.
+
+        :return: Same as Story#execute_block.
+        """
+        result = await Story.await_line(logger, story, line_number, pending)
+        if result == LineSentinels.RETURN:
+            return None
+        elif LineSentinels.is_sentinel(result):
+            return result
+
+        next_line = story.line(result)
+        if next_line is None:
+            return None
+
+        return await Story.execute_block(logger, story, parent_line,
+                                         next_line)
+
     @classmethod
     async def run(cls,
                   app, logger, story_name, *, story_id=None,
@@ -137,16 +278,21 @@ class Story:
         try:
             logger.log('story-start', story_name, story_id)
 
-            story = cls.story(app, logger, story_name)
-            story.prepare(context)
+            # Tracked, so that a previous release of the app can wait for
+            # its executions to finish before it's retired (see App#drain).
+            with app.execution():
+                story = cls.story(app, logger, story_name)
+                story.prepare(context)
+                story.budget = ExecutionBudget.from_config(app.config)
 
-            if function_name:
-                raise StoryscriptRuntimeError('No longer supported')
-            elif block:
-                with story.new_frame(block):
-                    await cls.execute_block(logger, story, story.line(block))
-            else:
-                await cls.execute(logger, story)
+                if function_name:
+                    raise StoryscriptRuntimeError('No longer supported')
+                elif block:
+                    with story.new_frame(block):
+                        await cls.execute_block(logger, story,
+                                                story.line(block))
+                else:
+                    await cls.execute(logger, story)
 
             logger.log('story-end', story_name, story_id)
             Metrics.story_run_success.labels(app_id=app.app_id,
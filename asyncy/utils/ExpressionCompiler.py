@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+import re
+
+from .TypeResolver import TypeResolver
+from ..Exceptions import StoryscriptRuntimeError
+
+NUMBER = (int, float)
+NUMBER_OR_STRING = (int, float, str)
+
+# Kinds of steps in a path.
+INDEX = 'index'
+RANGE = 'range'
+UNSUPPORTED = 'unsupported'
+
+
+class Expression(dict):
+    """
+    An object from the story tree, along with a closure which evaluates it.
+
+    Expression is still the dict found in the tree, so it can be read like
+    any other object. Resolver#resolve calls evaluate(data) directly,
+    instead of interpreting the object.
+    """
+    __slots__ = ('evaluate',)
+
+    def __init__(self, raw: dict, evaluate):
+        super().__init__(raw)
+        self.evaluate = evaluate
+
+
+class ExpressionCompiler:
+    """
+    Compiles objects from the story tree (the ones with an $OBJECT) into
+    nested closures of the form fn(data) -> value.
+
+    All the dispatching on object types and operators happens once, at
+    compile time. The closures have the exact same semantics as
+    asyncy.utils.Resolver, which remains the reference implementation.
+    """
+
+    @classmethod
+    def compile_expression(cls, item):
+        """
+        Returns an Expression for item, or item as is if it isn't an object.
+        """
+        if type(item) is not dict:
+            return item
+
+        try:
+            return Expression(item, cls.compile(item))
+        except (KeyError, IndexError, TypeError, AttributeError, re.error):
+            # Malformed objects are left to Resolver, which raises
+            # if (and when) they are resolved.
+            return item
+
+    @classmethod
+    def compile(cls, item):
+        if type(item) is dict:
+            return cls.object(item)
+        elif type(item) is list:
+            return cls.list(item)
+        elif type(item) is Expression:
+            return item.evaluate
+
+        return cls.constant(item)
+
+    @staticmethod
+    def constant(value):
+        def evaluate(data):
+            return value
+
+        return evaluate
+
+    @classmethod
+    def object(cls, item):
+        if not isinstance(item, dict):
+            return cls.constant(item)
+
+        object_type = item.get('$OBJECT')
+        if object_type == 'string':
+            return cls.string(item['string'], item.get('values'))
+        elif object_type in ('dot', 'int', 'boolean', 'float', 'value'):
+            return cls.constant(item[object_type])
+        elif object_type == 'path':
+            return cls.path(item['paths'])
+        elif object_type == 'regexp':
+            return cls.constant(re.compile(item['regexp']))
+        elif object_type == 'dict':
+            return cls.dict(item['items'])
+        elif object_type == 'list':
+            return cls.list_object(item['items'])
+        elif object_type == 'expression' or object_type == 'assertion':
+            return cls.expression(item)
+        elif object_type == 'type_cast' or object_type == 'type':
+            return cls.type_cast(item)
+
+        return cls.dictionary(item)
+
+    @classmethod
+    def string(cls, string, values):
+        if not values:
+            return cls.constant(string)
+
+        fns = [cls.compile(value) for value in values]
+
+        def evaluate(data):
+            return string.format(*[fn(data) for fn in fns])
+
+        return evaluate
+
+    @classmethod
+    def path(cls, paths):
+        root = paths[0]
+        steps = []
+        for path in paths[1:]:
+            if not isinstance(path, dict):
+                steps.append((UNSUPPORTED, path))
+            elif path.get('$OBJECT') == 'range':
+                steps.append((RANGE, cls.range(path['range'])))
+            else:
+                steps.append((INDEX, cls.object(path)))
+
+        def evaluate(data):
+            resolved = None
+            try:
+                item = data[root]
+                for kind, fn in steps:
+                    if kind is INDEX:
+                        resolved = fn(data)
+                        item = item[resolved]
+                    elif kind is RANGE:
+                        item = fn(item, data)
+                    else:
+                        # Resolver#path only supports objects past the root.
+                        if isinstance(fn, str):
+                            item = item[fn]
+                        raise AssertionError()
+                return item
+            except IndexError:
+                raise StoryscriptRuntimeError(
+                    message=f'List index out of bounds: {resolved}')
+            except (KeyError, TypeError):
+                return None
+
+        return evaluate
+
+    @classmethod
+    def range(cls, path):
+        start_fn = None
+        end_fn = None
+        if 'start' in path:
+            start_fn = cls.object(path['start'])
+        if 'end' in path:
+            end_fn = cls.object(path['end'])
+
+        def evaluate(item, data):
+            start = 0
+            end = len(item)
+            if start_fn is not None:
+                start = start_fn(data)
+            if end_fn is not None:
+                end = end_fn(data)
+            return item[start:end]
+
+        return evaluate
+
+    @classmethod
+    def dict(cls, items):
+        fns = [(cls.object(k), cls.object(v)) for k, v in items]
+
+        def evaluate(data):
+            result = {}
+            for key_fn, value_fn in fns:
+                k = key_fn(data)
+                if k in (list, tuple, dict):
+                    continue
+                result[k] = value_fn(data)
+            return result
+
+        return evaluate
+
+    @classmethod
+    def list_object(cls, items):
+        fns = [cls.compile(item) for item in items]
+
+        def evaluate(data):
+            return [fn(data) for fn in fns]
+
+        return evaluate
+
+    @classmethod
+    def list(cls, items):
+        fns = [cls.compile(item) for item in items]
+
+        def evaluate(data):
+            return ' '.join([fn(data) for fn in fns])
+
+        return evaluate
+
+    @classmethod
+    def dictionary(cls, dictionary):
+        fns = [(key, cls.compile(value)) for key, value in dictionary.items()]
+
+        def evaluate(data):
+            result = {}
+            for key, fn in fns:
+                result[key] = fn(data)
+            return result
+
+        return evaluate
+
+    @classmethod
+    def type_cast(cls, item):
+        type_ = item['type']
+        value_fn = cls.object(item['value'])
+
+        def evaluate(data):
+            return TypeResolver.type_cast(value_fn(data), type_, data)
+
+        return evaluate
+
+    @classmethod
+    def expression(cls, item):
+        """
+        See Resolver#expression for the supported operations.
+        """
+        a = item.get('assertion', item.get('expression'))
+        fns = [cls.compile(value) for value in item['values']]
+
+        def operand(i):
+            if i < len(fns):
+                return fns[i]
+
+            # A missing operand fails when evaluated, just as in Resolver.
+            def evaluate(data):
+                return fns[i](data)
+
+            return evaluate
+
+        left, right = operand(0), operand(1)
+
+        if a == 'equals' or a == 'equal':
+            return lambda data: left(data) == right(data)
+        elif a == 'not_equal':
+            return lambda data: left(data) != right(data)
+        elif a == 'greater':
+            return lambda data: left(data) > right(data)
+        elif a == 'greater_equal':
+            return lambda data: left(data) >= right(data)
+        elif a == 'less':
+            return lambda data: left(data) < right(data)
+        elif a == 'less_equal':
+            return lambda data: left(data) <= right(data)
+        elif a == 'not':
+            return lambda data: not left(data)
+        elif a == 'or':
+            def evaluate(data):
+                if left(data) is True:
+                    return True
+
+                for fn in fns[1:]:
+                    if fn(data) is True:
+                        return True
+
+                return False
+
+            return evaluate
+        elif a == 'and':
+            def evaluate(data):
+                if left(data) is False:
+                    return False
+
+                for fn in fns[1:]:
+                    if fn(data) is False:
+                        return False
+
+                return True
+
+            return evaluate
+        elif a == 'sum':
+            def evaluate(data):
+                result = left(data)
+                assert type(result) in NUMBER_OR_STRING
+                for fn in fns[1:]:
+                    r = fn(data)
+                    if type(r) in NUMBER and type(result) in NUMBER:
+                        result += r
+                    else:
+                        result = f'{str(result)}{str(r)}'
+
+                return result
+
+            return evaluate
+        elif a == 'subtraction':
+            return cls.arithmetic(left, right, NUMBER,
+                                  lambda x, y: x - y)
+        elif a == 'multiplication':
+            return cls.arithmetic(left, right, NUMBER_OR_STRING,
+                                  lambda x, y: x * y)
+        elif a == 'modulus':
+            return cls.arithmetic(left, right, NUMBER,
+                                  lambda x, y: x % y)
+        elif a == 'division':
+            return cls.arithmetic(left, right, NUMBER_OR_STRING,
+                                  lambda x, y: x / y)
+        elif a == 'exponential':
+            return cls.arithmetic(left, right, NUMBER,
+                                  lambda x, y: x ** y)
+
+        def evaluate(data):
+            left(data)
+            assert False, f'Unsupported operation: {a}'
+
+        return evaluate
+
+    @staticmethod
+    def arithmetic(left, right, types, operator):
+        def evaluate(data):
+            x = left(data)
+            y = right(data)
+            assert type(x) in types
+            assert type(y) in types
+            return operator(x, y)
+
+        return evaluate
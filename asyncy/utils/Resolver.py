@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 import re
 
+from .ExpressionCompiler import Expression
 from .TypeResolver import TypeResolver
 from ..Exceptions import StoryscriptRuntimeError
 
@@ -248,6 +249,8 @@ class Resolver:
     def resolve(cls, item, data):
         if type(item) is dict:
             return cls.object(item, data)
+        elif type(item) is Expression:
+            return item.evaluate(data)
         elif type(item) is list:
             return cls.list(item, data)
         return item
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from tornado import gen
+from tornado.simple_httpclient import SimpleAsyncHTTPClient
+from tornado.tcpclient import TCPClient
+
+
+class _ClosingTCPClient(TCPClient):
+    """
+    Keeps track of the streams it connects, and closes them when it's
+    closed.
+    """
+
+    def __init__(self, resolver=None):
+        super().__init__(resolver=resolver)
+        self.streams = set()
+        self.closed = False
+
+    @gen.coroutine
+    def connect(self, *args, **kwargs):
+        stream = yield super().connect(*args, **kwargs)
+        if self.closed:
+            stream.close()
+        else:
+            # The HTTP connection sets its own close callback on the
+            # stream, so closed streams are only dropped on close.
+            self.streams.add(stream)
+
+        return stream
+
+    def close(self):
+        super().close()
+        self.closed = True
+        for stream in self.streams:
+            stream.close()
+
+        self.streams.clear()
+
+
+class WatchHTTPClient(SimpleAsyncHTTPClient):
+    """
+    An HTTP client for long lived streaming requests (such as watches),
+    which can be aborted: closing the client closes the connections
+    of its requests, which then end (with a 599 response), rather than
+    being left open until their request_timeout.
+
+    Create it with force_instance=True, and use one per request
+    (or per set of requests to abort together).
+    """
+
+    def initialize(self, **kwargs):
+        super().initialize(**kwargs)
+        self.tcp_client = _ClosingTCPClient(resolver=self.resolver)
@@ -39,6 +39,7 @@ setup(
         'ujson==1.35',
         'certifi>=2018.8.24',
         'psycopg2==2.7.5',
+        'pycurl==7.43.0.2',  # Used by the Kubernetes client (keep-alive).
         'requests==2.21.0'  # Used for structures like CaseInsensitiveDict.
     ],
     classifiers=[
@@ -8,6 +8,7 @@ from asyncy.Exceptions import StoryscriptError, StoryscriptRuntimeError, \
     TypeAssertionRuntimeError, TypeValueRuntimeError
 from asyncy.Stories import Stories
 from asyncy.processing import Story
+from asyncy.processing.Compiler import Compiler
 from asyncy.processing.internal import File, Http, Json, Log
 
 from pytest import mark
@@ -645,10 +646,11 @@ async def run_test_case_in_suite(suite: TestSuite, case: TestCase, logger):
 
     app = MagicMock()
 
-    app.stories = {
+    app.stories = Compiler.compile_stories({
         story_name: story.result()
-    }
+    })
     app.environment = {}
+    app.base_context = {'app': {}}
 
     context = {}
 
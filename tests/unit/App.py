@@ -2,8 +2,11 @@
 import asyncio
 import json
 from collections import deque
+from unittest import mock
 
-from asyncy.App import App, AppData
+from asyncy import Metrics
+from asyncy.App import App, AppData, PHASE_CONTAINERS, PHASE_EXPOSES, \
+    PHASE_STORIES
 from asyncy.AppConfig import Expose
 from asyncy.Containers import Containers
 from asyncy.Exceptions import StoryscriptError
@@ -12,6 +15,7 @@ from asyncy.Types import StreamingService
 from asyncy.constants.ServiceConstants import ServiceConstants
 from asyncy.entities.Release import Release
 from asyncy.processing import Story
+from asyncy.processing.Compiler import Compiler
 from asyncy.processing.Services import Command, Service, Services
 from asyncy.utils.HttpUtils import HttpUtils
 
@@ -67,6 +71,172 @@ def test_add_subscription(patch, app, magic):
     assert app.get_subscription('sub_id') is None
 
 
+def test_add_container(app):
+    assert app.get_container_hostname('alpine-1') is None
+    app.add_container('alpine-1', 'alpine.com')
+    assert app.get_container_hostname('alpine-1') == 'alpine.com'
+    app.clear_containers()
+    assert app.get_container_hostname('alpine-1') is None
+
+
+def _sub_body(sub_id, block='1'):
+    return {
+        'sub_id': sub_id,
+        'sub_url': 'http://foo.com:2000/sub',
+        'sub_body': {
+            'endpoint': f'http://engine/story/event?story=a&block={block}',
+            'data': {'foo': 'bar'},
+            'event': 'updates',
+            'id': sub_id
+        }
+    }
+
+
+def test_get_subscription_key():
+    assert App.get_subscription_key(_sub_body('a')) == \
+        App.get_subscription_key(_sub_body('b'))
+    assert App.get_subscription_key(_sub_body('a')) != \
+        App.get_subscription_key(_sub_body('a', block='2'))
+
+
+def test_reuse_subscription(app, magic):
+    assert app.reuse_subscription(_sub_body('new')) is None
+
+    sub = magic(id='old')
+    key = App.get_subscription_key(_sub_body('old'))
+    app._swapped_subscriptions = {key: [sub]}
+
+    assert app.reuse_subscription(_sub_body('new', block='2')) is None
+    assert app.reuse_subscription(_sub_body('new')) == sub
+    assert app.get_subscription('old') == sub
+    assert app.reuse_subscription(_sub_body('new')) is None
+
+
+@mark.parametrize('fail', [False, True])
+@mark.asyncio
+async def test_hot_swap(patch, app, async_mock, magic, fail):
+    streaming_service = magic()
+    app.add_subscription('kept', streaming_service, 'updates',
+                         _sub_body('kept'))
+    app.add_subscription('stale', streaming_service, 'updates',
+                         _sub_body('stale', block='2'))
+    old_stories = app.stories
+    old_release = app.release
+    old_version = app.version
+    old_logger = app.logger
+    old_base_context = app.base_context
+    new_stories = {'a.story': {}}
+    patch.object(Compiler, 'compile_stories', return_value=new_stories)
+    patch.object(app, 'unsubscribe', new=async_mock())
+
+    def run_stories():
+        # Executions see the new stories straight away.
+        assert app.stories == new_stories
+        assert app.reuse_subscription(_sub_body('new')) is not None
+        app.add_subscription('new', streaming_service, 'updates',
+                             _sub_body('new', block='3'))
+        if fail:
+            raise Exception()
+
+    patch.object(app, 'run_stories', new=async_mock(side_effect=run_stories))
+    patch.object(app, 'uses_same_containers', return_value=True)
+
+    release = app.release._replace(
+        version=2, stories={'stories': {'a.story': {}},
+                            'entrypoint': ['a.story']})
+    logger = magic()
+
+    if fail:
+        with pytest.raises(Exception):
+            await app.hot_swap(release, logger)
+    else:
+        assert await app.hot_swap(release, logger) is True
+
+    Compiler.compile_stories.assert_called_with({'a.story': {}},
+                                                app.services)
+    app.uses_same_containers.assert_called_with(new_stories)
+    if fail:
+        # The app is put back on the old release.
+        assert app.stories is old_stories
+        assert app.entrypoint == old_release.stories['entrypoint']
+        assert app.version == old_version
+        assert app.base_context['app']['version'] == old_version
+        assert app.logger == old_logger
+        assert app.release == old_release
+    else:
+        assert app.stories is new_stories
+        assert app.entrypoint == ['a.story']
+        assert app.version == 2
+        assert app.app_context['version'] == 2
+        assert app.base_context['app']['version'] == 2
+        assert app.logger == logger
+        assert app.release == release
+    assert app._swapped_subscriptions == {}
+    # Executions in progress keep the context they started with.
+    assert old_base_context['app']['version'] == old_version
+    assert app.get_subscription('kept') is not None
+    assert app.get_subscription('new') is not None
+    if fail:
+        # Unsubscribed from when the app is destroyed.
+        app.unsubscribe.mock.assert_not_called()
+        assert app.get_subscription('stale') is not None
+    else:
+        app.unsubscribe.mock.assert_called_once()
+        assert app.unsubscribe.mock.call_args[0][0].id == 'stale'
+        assert app.get_subscription('stale') is None
+
+
+@mark.asyncio
+async def test_hot_swap_other_containers(patch, app, async_mock, magic):
+    old_stories = app.stories
+    version = app.version
+    patch.object(Compiler, 'compile_stories', return_value={})
+    patch.object(app, 'uses_same_containers', return_value=False)
+    patch.object(app, 'run_stories', new=async_mock())
+    release = app.release._replace(
+        version=2, stories={'stories': {}, 'entrypoint': []})
+
+    assert await app.hot_swap(release, magic()) is False
+
+    # The release must be deployed instead.
+    app.run_stories.mock.assert_not_called()
+    assert app.stories is old_stories
+    assert app.version == version
+
+
+def _service_story(ln: str) -> dict:
+    return {
+        'a.story': {
+            'tree': {
+                ln: {'method': 'execute', 'service': 'cold_service',
+                     'ln': ln}
+            },
+            'entrypoint': ln
+        }
+    }
+
+
+@mark.parametrize('ln,same', [('1', True), ('2', False)])
+def test_uses_same_containers(patch, app, ln, same):
+    app.stories = _service_story('1')
+    old_stories = app.stories
+    chain = deque()
+    chain.append(Service(name='cold_service'))
+    chain.append(Command(name='command'))
+    patch.object(Services, 'resolve_chain', return_value=chain)
+    patch.object(Services, 'is_internal', return_value=False)
+    # The service has a run section, so its containers are per line.
+    patch.object(Containers, 'is_service_reusable', return_value=False)
+    patch.object(Containers, 'get_container_name',
+                 side_effect=lambda app, story_name, line, name:
+                 f'{name}-{story_name}-{line and line["ln"]}')
+    patch.object(app.app_config, 'get_expose_config', return_value=[])
+
+    # The line moves to another line number.
+    assert app.uses_same_containers(_service_story(ln)) is same
+    assert app.stories is old_stories
+
+
 @mark.asyncio
 @mark.parametrize('response_code', [200, 500])
 async def test_unsubscribe_all(patch, app, async_mock, magic, response_code):
@@ -138,9 +308,10 @@ async def test_unsubscribe_all(patch, app, async_mock, magic, response_code):
 
 @mark.parametrize('env', [{'env': True}, None, {'a': {'nested': '1'}}])
 @mark.parametrize('always_pull_images', [False, True])
-def test_app_init(magic, config, logger, env, always_pull_images):
+def test_app_init(patch, magic, config, logger, env, always_pull_images):
     services = magic()
     stories = magic()
+    patch.object(Compiler, 'compile_stories')
     expected_secrets = {}
     if env:
         for k, v in env.items():
@@ -181,13 +352,17 @@ def test_app_init(magic, config, logger, env, always_pull_images):
     assert app.logger == logger
     assert app.owner_uuid == 'owner_1'
     assert app.owner_email == 'example@example.com'
-    assert app.stories == stories['stories']
+    Compiler.compile_stories.assert_called_with(stories['stories'], services)
+    assert app.stories == Compiler.compile_stories()
     assert app.services == services
     assert app.always_pull_images == always_pull_images
     assert app.environment == env
     assert app.app_context['hostname'] == f'{app.app_dns}.asyncyapp.com'
     assert app.app_context['version'] == version
     assert app.app_context['secrets'] == expected_secrets
+    assert app.base_context['app'] == app.app_context
+    with pytest.raises(TypeError):
+        app.base_context['app']['version'] = 'foo'
     assert app.entrypoint == stories['entrypoint']
     assert app.app_config == app_config
 
@@ -197,107 +372,188 @@ def test_app_init(magic, config, logger, env, always_pull_images):
         assert app.image_pull_policy() == 'IfNotPresent'
 
 
+def _patch_bootstrap(patch, app, async_mock, shared):
+    app.entrypoint = ['a.story', 'b.story']
+    containers = {
+        'a.story': [('a', 'line_a', 'foo')],
+        'b.story': [('b', 'line_b', 'bar')]
+    }
+    exposed = 'foo' if shared else 'baz'
+
+    def get_service_containers(story_names=None):
+        if story_names is None:
+            story_names = app.entrypoint
+
+        for story_name in story_names:
+            yield from containers[story_name]
+
+    patch.object(app, 'get_service_containers',
+                 side_effect=get_service_containers)
+    expose = Expose(service=exposed, service_expose_name='foo',
+                    http_path='foo')
+    patch.object(app.app_config, 'get_expose_config', return_value=[expose])
+    patch.object(Containers, 'get_container_name', return_value=exposed)
+    patch.object(Containers, 'start_exposed', new=async_mock())
+    patch.object(Services, 'start_container', new=async_mock())
+    patch.object(app, '_expose_service', new=async_mock())
+    patch.object(Story, 'run', new=async_mock())
+    patch.object(Metrics, 'app_bootstrap_phase_seconds')
+    return expose
+
+
+@mark.parametrize('shared', [True, False])
 @mark.asyncio
-async def test_app_bootstrap(patch, app, async_mock):
-    patch.object(app, 'run_stories', new=async_mock())
-    patch.object(app, 'start_services', new=async_mock())
-    stories = {'entrypoint': ['foo'], 'stories': {'foo': {}}}
-    app.stories = stories
+async def test_app_bootstrap(patch, app, async_mock, shared):
+    expose = _patch_bootstrap(patch, app, async_mock, shared)
+
     await app.bootstrap()
 
-    assert app.run_stories.mock.call_count == 1
-    assert app.start_services.mock.call_count == 1
+    assert Services.start_container.mock.mock_calls == [
+        mock.call('a', 'line_a'), mock.call('b', 'line_b')
+    ]
+    if shared:
+        # The container is started once, for the story.
+        Containers.start_exposed.mock.assert_not_called()
+    else:
+        Containers.start_exposed.mock.assert_called_once_with(app, 'baz')
+    app._expose_service.mock.assert_called_once_with(expose)
+    assert Story.run.mock.mock_calls == [
+        mock.call(app, app.logger, 'a.story'),
+        mock.call(app, app.logger, 'b.story')
+    ]
+
+    phases = [c[2]['phase'] for c in
+              Metrics.app_bootstrap_phase_seconds.labels.mock_calls
+              if c[0] == '']
+    assert sorted(phases) == [PHASE_CONTAINERS, PHASE_EXPOSES,
+                              PHASE_STORIES]
+    app.logger.info.assert_called()
 
 
 @mark.asyncio
-async def test_start_services_completed(patch, app, async_mock):
-    app.stories = {}
-    patch.object(asyncio, 'wait', new=async_mock(return_value=([], [])))
-    await app.start_services()
+async def test_app_bootstrap_dependencies(patch, app, async_mock):
+    _patch_bootstrap(patch, app, async_mock, False)
+    started = asyncio.Event()
+    order = []
+
+    async def start_container(story, line):
+        await started.wait()
+        order.append(line)
+
+    async def run(app, logger, story_name):
+        order.append(story_name)
+
+    patch.object(Services, 'start_container', new=start_container)
+    patch.object(Story, 'run', new=run)
+
+    bootstrap = asyncio.ensure_future(app.bootstrap())
+    await asyncio.sleep(0.01)
+    # The exposes don't wait for the containers of the stories.
+    app._expose_service.mock.assert_called_once()
+    assert order == []
+
+    started.set()
+    await bootstrap
+    assert order.index('a.story') > order.index('line_a')
+    assert order.index('b.story') > order.index('line_b')
 
 
 @mark.asyncio
-async def test_start_services_completed_exc(patch, app, async_mock, magic):
-    app.stories = {
-        'a': {
-            'tree': {
-                '1': {
-                    'method': 'execute'
-                }
-            },
-            'entrypoint': '1'
-        }
-    }
+async def test_app_bootstrap_exc(patch, app, async_mock):
+    _patch_bootstrap(patch, app, async_mock, False)
+    patch.object(Services, 'start_container',
+                 new=async_mock(side_effect=StoryscriptError()))
 
-    patch.object(Containers, 'is_service_reusable', return_value=True)
-    patch.object(Services, 'is_internal', return_value=False)
-    chain = deque()
-    chain.append(Service(name='foo'))
-    chain.append(Command(name='foo'))
-    patch.object(Services, 'resolve_chain', return_value=chain)
-    task = magic()
-    task.exception.return_value = Exception()
-    patch.object(asyncio, 'wait', new=async_mock(return_value=([task], [])))
-    with pytest.raises(Exception):
-        await app.start_services()
+    with pytest.raises(StoryscriptError):
+        await app.bootstrap()
+
+    Story.run.mock.assert_not_called()
+    # Reported anyway.
+    Metrics.app_bootstrap_phase_seconds.labels.assert_called()
+
+
+@mark.asyncio
+async def test_app_prepare(patch, app, async_mock):
+    expose = _patch_bootstrap(patch, app, async_mock, False)
+
+    await app.prepare()
+
+    assert Services.start_container.mock.call_count == 2
+    app._expose_service.mock.assert_called_once_with(expose)
+    Story.run.mock.assert_not_called()
 
 
-@mark.parametrize('reusable', [True, False])
-@mark.parametrize('internal', [True, False])
 @mark.asyncio
-async def test_start_services(patch, app, async_mock, magic,
-                              reusable, internal):
+async def test_app_drain(app):
+    assert await app.drain(0.01) is True
+
+    with app.execution():
+        with app.execution():
+            assert await app.drain(0.01) is False
+
+        drain = asyncio.ensure_future(app.drain(1))
+        await asyncio.sleep(0)
+        assert drain.done() is False
+
+    assert await drain is True
+    assert app._executions == 0
+
+
+@mark.parametrize('service', ['cold_service', 'http'])
+def test_get_container_names(patch, app, service):
     app.stories = {
         'a.story': {
             'tree': {
                 '1': {
                     'method': 'execute',
+                    'service': service,
+                    'ln': '1',
                     'next': '2'
                 },
-                '2': {
-                    'method': 'execute',
-                    'next': '3'
-                },
-                '3': {'method': 'not_execute'}
+                '2': {'method': 'not_execute'}
             },
             'entrypoint': '1'
         }
     }
     chain = deque()
-    chain.append(Service(name='cold_service'))
-    chain.append(Command(name='cold_command'))
-
-    start_container_result = magic()
-
+    chain.append(Service(name=service))
+    chain.append(Command(name='command'))
     patch.object(Services, 'resolve_chain', return_value=chain)
-    patch.object(Services, 'is_internal', return_value=internal)
-    patch.object(Services, 'start_container',
-                 return_value=start_container_result)
-    patch.object(Containers, 'is_service_reusable', return_value=reusable)
-    patch.object(asyncio, 'wait', new=async_mock(return_value=([], [])))
-
-    await app.start_services()
+    patch.object(Services, 'is_internal', return_value=False)
+    patch.object(Containers, 'is_service_reusable', return_value=False)
+    patch.object(Containers, 'get_container_name',
+                 side_effect=lambda app, story_name, line, name:
+                 f'{name}-{story_name}-{line and line["ln"]}')
+    patch.object(app.app_config, 'get_expose_config', return_value=[
+        Expose(service='exposed', service_expose_name='foo',
+               http_path='foo')
+    ])
 
-    tasks = [start_container_result]
-    if not reusable:
-        tasks = [start_container_result, start_container_result]
+    names = app.get_container_names()
 
-    if not internal:
-        asyncio.wait.mock.assert_called_with(tasks)
+    if service == 'http':
+        assert names == {'exposed-None-None'}
+    else:
+        assert names == {'cold_service-a.story-1', 'exposed-None-None'}
 
 
+@mark.parametrize('adopted', [True, False])
 @mark.asyncio
-async def test_expose_services(patch, app, async_mock):
-    a = Expose(service='foo', service_expose_name='foo',
-               http_path='foo')
-    b = Expose(service='foo', service_expose_name='foo',
-               http_path='foo')
-    patch.object(app.app_config, 'get_expose_config', return_value=[a, b])
-    patch.object(App, '_expose_service', new=async_mock())
-
-    await app.expose_services()
-
-    assert app._expose_service.mock.call_count == 2
+async def test_adopt(patch, app, async_mock, adopted):
+    patch.object(App, 'get_container_names', return_value={'a'})
+    patch.object(Containers, 'adopt', new=async_mock(return_value=adopted))
+    patch.object(App, 'clear_subscriptions_synapse', new=async_mock())
+    patch.object(App, 'bootstrap', new=async_mock())
+
+    assert await app.adopt() is adopted
+
+    Containers.adopt.mock.assert_called_with(app, {'a'})
+    if adopted:
+        app.clear_subscriptions_synapse.mock.assert_called_once()
+        app.bootstrap.mock.assert_called_once()
+    else:
+        app.clear_subscriptions_synapse.mock.assert_not_called()
+        app.bootstrap.mock.assert_not_called()
 
 
 @mark.parametrize('no_config', [True, False])
@@ -346,11 +602,12 @@ async def test_expose_service(patch, app, async_mock, no_config, no_http_path):
 @mark.asyncio
 async def test_app_run_stories(patch, app, async_mock):
     stories = {
-        'foo': {},
-        'bar': {}
+        'foo': {'tree': {}, 'entrypoint': None},
+        'bar': {'tree': {}, 'entrypoint': None}
     }
     app.entrypoint = ['foo', 'bar']
     app.stories = stories
+    patch.object(Metrics, 'app_bootstrap_phase_seconds')
     patch.object(Story, 'run', new=async_mock())
     await app.run_stories()
     assert Story.run.mock.call_count == 2
@@ -367,8 +624,8 @@ async def test_app_destroy_no_stories(patch, async_mock, app):
 @mark.asyncio
 async def test_app_run_stories_exc(patch, app, async_mock, exc):
     app.stories = {
-        'foo': {},
-        'bar': {}
+        'foo': {'tree': {}, 'entrypoint': None},
+        'bar': {'tree': {}, 'entrypoint': None}
     }
     app.entrypoint = ['foo', 'bar']
     patch.object(app, 'logger')
@@ -422,7 +679,9 @@ async def test_app_destroy(patch, app, async_mock):
     app.entrypoint = ['foo', 'bar']
     patch.object(app, 'unsubscribe_all', new=async_mock())
     patch.object(app, 'clear_subscriptions_synapse', new=async_mock())
+    app.add_container('alpine-1', 'alpine.com')
     await app.destroy()
 
     app.unsubscribe_all.mock.assert_called()
     app.clear_subscriptions_synapse.mock.assert_called()
+    assert app.get_container_hostname('alpine-1') is None
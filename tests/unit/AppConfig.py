@@ -30,3 +30,9 @@ def test_app_config():
         assert exposes[i].service == f'service_{i}'
         assert exposes[i].http_path == f'/my_expose_path_{i}'
         assert exposes[i].service_expose_name == f'expose_name_{i}'
+
+
+def test_app_config_loop_concurrency():
+    assert AppConfig({}).get_loop_concurrency() == 1
+    config = AppConfig({'loops': {'concurrency': '10'}})
+    assert config.get_loop_concurrency() == 10
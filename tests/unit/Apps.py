@@ -1,15 +1,13 @@
 # -*- coding: utf-8 -*-
 import asyncio
-import os
-import select
-import signal
-from threading import Thread
 from unittest import mock
 
+from asyncy import Apps as Apps_module, Metrics
 from asyncy.App import App, AppData
 from asyncy.AppConfig import AppConfig
 from asyncy.Apps import Apps
 from asyncy.Containers import Containers
+from asyncy.DeployScheduler import PRIORITY_NOTIFIED
 from asyncy.Exceptions import StoryscriptError, TooManyActiveApps, \
     TooManyServices, TooManyVolumes
 from asyncy.GraphQLAPI import GraphQLAPI
@@ -18,8 +16,11 @@ from asyncy.Logger import Logger
 from asyncy.Sentry import Sentry
 from asyncy.constants.ServiceConstants import ServiceConstants
 from asyncy.db.Database import Database
+from asyncy.db.Listener import Listener
 from asyncy.entities.Release import Release
 from asyncy.enums.ReleaseState import ReleaseState
+from asyncy.http_handlers.StoryEventHandler import StoryEventHandler
+from asyncy.processing import Story
 
 import psycopg2
 
@@ -58,32 +59,73 @@ def db(patch, magic):
     return get
 
 
-def test_listen_to_releases(patch, db, magic, config, logger):
-    conn = db()
+@mark.asyncio
+async def test_listen_to_releases(patch, async_mock, magic, config, logger):
+    patch.init(Listener)
+    patch.object(Listener, 'start', new=async_mock())
+    patch.object(Apps, 'get_deploy_scheduler')
+    patch.object(Apps, 'reload_queued_apps', new=async_mock())
+
+    await Apps.listen_to_releases(config, logger)
+
+    Listener.start.mock.assert_called_once()
+    args = Listener.__init__.call_args[0]
+    assert args[:3] == (config.POSTGRES, 'release', logger)
+    assert isinstance(Apps.release_listener, Listener)
+
+    on_notify, on_reconnect = args[3:]
+    on_notify('app_id')
+    Apps.get_deploy_scheduler.assert_called_with(config, logger)
+    Apps.get_deploy_scheduler().submit.assert_called_with(
+        'app_id', priority=PRIORITY_NOTIFIED)
 
-    def exc(*args, **kwargs):
-        raise psycopg2.InterfaceError()
+    await on_reconnect()
+    Apps.reload_queued_apps.mock.assert_called_with(config, logger)
 
-    patch.object(asyncio, 'run_coroutine_threadsafe', side_effect=exc)
-    patch.object(select, 'select', side_effect=[([], [], []), ([], [], []),
-                                                False])
-    patch.object(Apps, 'reload_app')
-    patch.many(os, ['kill', 'getpid'])
-    notif = magic()
-    notif.payload = 'app_id'
-    conn.notifies = [notif]
-    loop = magic()
 
-    Apps.listen_to_releases(config, logger, loop)
+def test_stop_listening_to_releases(magic):
+    listener = magic()
+    Apps.release_listener = listener
+    Apps.stop_listening_to_releases()
+    listener.close.assert_called_once()
+    assert Apps.release_listener is None
+    Apps.stop_listening_to_releases()
+
+
+@mark.asyncio
+async def test_reload_queued_apps(patch, async_mock, config, logger):
+    patch.object(Database, 'get_queued_app_uuids',
+                 new=async_mock(return_value=[{'uuid': 'a'}, {'uuid': 'b'}]))
+    patch.object(Apps, 'get_deploy_scheduler')
 
-    conn.cursor().execute.assert_called_with('listen release;')
-    Apps.reload_app.assert_called_with(config, logger, 'app_id')
-    conn.set_isolation_level.assert_called_with(
-        psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
-    asyncio.run_coroutine_threadsafe.assert_called_with(
-        Apps.reload_app(), loop)
+    await Apps.reload_queued_apps(config, logger)
 
-    os.kill.assert_called_with(os.getpid.return_value, signal.SIGINT)
+    Database.get_queued_app_uuids.mock.assert_called_with(config)
+    assert Apps.get_deploy_scheduler().submit.mock_calls == [
+        mock.call('a'),
+        mock.call('b')
+    ]
+
+
+@mark.asyncio
+async def test_get_deploy_scheduler(patch, async_mock, config, logger):
+    Apps.deploy_scheduler = None
+    patch.object(Apps, 'reload_app', new=async_mock())
+
+    scheduler = Apps.get_deploy_scheduler(config, logger)
+
+    assert Apps.get_deploy_scheduler(config, logger) is scheduler
+    assert scheduler.concurrency == Apps_module.DEPLOYMENT_CONCURRENCY
+    assert scheduler.logger == logger
+    await scheduler.deploy('app_id', 'release')
+    Apps.reload_app.mock.assert_called_with(config, logger, 'app_id',
+                                            release='release')
+
+    patch.object(scheduler, 'close')
+    Apps.close_deploy_scheduler()
+    scheduler.close.assert_called_once()
+    assert Apps.deploy_scheduler is None
+    Apps.close_deploy_scheduler()
 
 
 @mark.asyncio
@@ -99,6 +141,23 @@ async def test_destroy_all(patch, async_mock, magic):
     Containers.clean_app.mock.assert_called()
 
 
+@mark.parametrize('keep_containers', [True, False])
+@mark.asyncio
+async def test_destroy_app_keep_containers(patch, async_mock, magic,
+                                           keep_containers):
+    patch.object(Containers, 'clean_app', new=async_mock())
+    app = magic()
+    app.destroy = async_mock()
+    app.app_id = 'app_id'
+    Apps.apps = {'app_id': app}
+    await Apps.destroy_all(keep_containers=keep_containers)
+    app.destroy.mock.assert_called()
+    if keep_containers:
+        Containers.clean_app.mock.assert_not_called()
+    else:
+        Containers.clean_app.mock.assert_called_with(app)
+
+
 @mark.asyncio
 async def test_destroy_all_exc(patch, async_mock, magic):
     app = magic()
@@ -118,30 +177,40 @@ async def test_destroy_all_exc(patch, async_mock, magic):
 
 
 @mark.asyncio
-async def test_init_all(patch, magic, async_mock, config, logger, db):
-    db()
+async def test_init_all(patch, magic, async_mock, config, logger):
     patch.object(Sentry, 'init')
-    patch.init(Thread)
-    patch.object(Thread, 'start')
-
-    apps = [{
-        'uuid': 'my_app_uuid'
-    }]
-    patch.object(Database, 'get_all_app_uuids_for_deployment',
-                 return_value=apps)
-    patch.object(Apps, 'reload_app', new=async_mock())
+    patch.object(Apps, 'listen_to_releases', new=async_mock())
+
+    patch.object(Apps, 'reload_apps', new=async_mock())
 
     await Apps.init_all('sentry_dsn', 'release_ver', config, logger)
-    Apps.reload_app.mock.assert_called_with(
-        config, logger, 'my_app_uuid')
+    Apps.reload_apps.mock.assert_called_with(config, logger)
 
     Sentry.init.assert_called_with('sentry_dsn', 'release_ver')
+    Apps.listen_to_releases.mock.assert_called_with(config, logger)
+
+
+@mark.asyncio
+async def test_reload_apps(patch, magic, async_mock, config, logger):
+    releases = [magic(app_uuid=f'app_{i}') for i in range(3)]
+    scheduler = magic()
+    scheduler.join = async_mock()
+
+    async def get_releases(config_):
+        assert config_ == config
+        for release in releases:
+            yield release
+
+    patch.object(Database, 'get_releases_for_deployment', new=get_releases)
+    patch.object(Apps, 'get_deploy_scheduler', return_value=scheduler)
 
-    loop = asyncio.get_event_loop()
-    Thread.__init__.assert_called_with(target=Apps.listen_to_releases,
-                                       args=[config, logger, loop],
-                                       daemon=True)
-    Thread.start.assert_called()
+    await Apps.reload_apps(config, logger)
+
+    Apps.get_deploy_scheduler.assert_called_with(config, logger)
+    assert scheduler.submit.mock_calls == [
+        mock.call(release.app_uuid, release) for release in releases
+    ]
+    scheduler.join.mock.assert_called_once()
 
 
 def test_get(magic):
@@ -151,16 +220,54 @@ def test_get(magic):
 
 
 @mark.asyncio
-async def test_reload_app_ongoing_deployment(config, logger, patch):
+async def test_reload_app_ongoing_deployment(config, logger, patch,
+                                             async_mock):
     app_id = 'my_app'
-    patch.object(Database, 'new_pg_conn')
+    patch.object(Database, 'get_release_for_deployment', new=async_mock())
 
     await Apps.deployment_lock.try_acquire(app_id)
 
     await Apps.reload_app(config, logger, app_id)
 
     logger.warn.assert_called()
-    Database.new_pg_conn.assert_not_called()
+    Database.get_release_for_deployment.mock.assert_not_called()
+    assert await Apps.deployment_lock.release(app_id) is True
+
+
+@mark.asyncio
+async def test_reload_app_burst(patch, magic, async_mock, config, logger):
+    """
+    A burst of releases pushed for an app results in (at most) two
+    deployments, the last one being of the latest release.
+    """
+    Apps.apps = {}
+    Apps.deploy_scheduler = None
+    latest = {'version': 0}
+    deployed = []
+    burst_done = asyncio.Event()
+
+    async def get_release(config_, app_id):
+        return magic(app_uuid=app_id, version=latest['version'],
+                     state='QUEUED')
+
+    async def deploy_release(config, release, old_app):
+        await burst_done.wait()
+        deployed.append(release.version)
+
+    patch.object(Database, 'get_release_for_deployment', new=get_release)
+    patch.object(Apps, 'deploy_release', new=deploy_release)
+    scheduler = Apps.get_deploy_scheduler(config, logger)
+
+    for version in range(1, 21):
+        latest['version'] = version
+        scheduler.submit('app_id', priority=PRIORITY_NOTIFIED)
+        await asyncio.sleep(0)
+
+    burst_done.set()
+    await scheduler.join()
+    Apps.close_deploy_scheduler()
+
+    assert deployed == [1, 20]
 
 
 @mark.asyncio
@@ -185,18 +292,65 @@ async def test_reload_app_no_story(patch, config, logger, db, async_mock):
         owner_uuid='owner_uuid',
         owner_email='owner_email'
     )
-    patch.object(Database, 'get_release_for_deployment', return_value=release)
+    patch.object(Database, 'get_release_for_deployment',
+                 new=async_mock(return_value=release))
 
     await Apps.reload_app(config, logger, app_id)
 
     Apps.deploy_release.mock.assert_not_called()
 
 
+@mark.parametrize('state,deleted,overlap', [
+    ('QUEUED', False, True),
+    ('QUEUED', True, False),
+    ('FAILED', False, False)
+])
+@mark.asyncio
+async def test_reload_app_overlap(patch, config, logger, async_mock,
+                                  magic, state, deleted, overlap):
+    old_app = magic()
+    old_app.stories = {'foo': {}}
+    old_app.services = {}
+    Apps.apps = {'app_id': old_app}
+    patch.object(Apps, 'destroy_app', new=async_mock())
+    patch.object(Apps, 'deploy_release', new=async_mock())
+
+    release = Release(
+        app_uuid='app_id',
+        app_name='app_name',
+        version=2,
+        environment={},
+        stories={},
+        maintenance=False,
+        always_pull_images=False,
+        app_dns='app_dns',
+        state=state,
+        deleted=deleted,
+        owner_uuid='owner_uuid',
+        owner_email='example@example.com'
+    )
+
+    try:
+        await Apps.reload_app(config, logger, 'app_id', release=release)
+    finally:
+        Apps.apps = {}
+
+    if overlap:
+        # The old app keeps running until the new release replaces it.
+        Apps.destroy_app.mock.assert_not_called()
+        Apps.deploy_release.mock.assert_called_with(
+            config=config, release=release, old_app=old_app)
+    else:
+        Apps.destroy_app.mock.assert_called_with(
+            old_app, silent=True, update_db_state=True)
+
+
 @mark.parametrize('raise_exc', [None, exc, asyncio_timeout_exc])
 @mark.parametrize('previous_state', ['QUEUED', 'FAILED'])
+@mark.parametrize('prefetched', [False, True])
 @mark.asyncio
 async def test_reload_app(patch, config, logger, db, async_mock,
-                          magic, raise_exc, previous_state):
+                          magic, raise_exc, previous_state, prefetched):
     old_app = magic()
     app_id = 'app_id'
     app_name = 'app_name'
@@ -205,7 +359,7 @@ async def test_reload_app(patch, config, logger, db, async_mock,
     patch.object(Sentry, 'capture_exc')
     app_logger = magic()
     patch.object(Apps, 'make_logger_for_app', return_value=app_logger)
-    patch.object(Database, 'update_release_state')
+    patch.object(Database, 'update_release_state', new=async_mock())
 
     patch.object(Apps, 'destroy_app', new=async_mock())
     if raise_exc:
@@ -228,9 +382,16 @@ async def test_reload_app(patch, config, logger, db, async_mock,
         owner_uuid='owner_uuid',
         owner_email='example@example.com'
     )
-    patch.object(Database, 'get_release_for_deployment', return_value=release)
+    patch.object(Database, 'get_release_for_deployment',
+                 new=async_mock(return_value=release))
 
-    await Apps.reload_app(config, logger, app_id)
+    if prefetched:
+        await Apps.reload_app(config, logger, app_id, release=release)
+        Database.get_release_for_deployment.mock.assert_not_called()
+    else:
+        await Apps.reload_app(config, logger, app_id)
+        Database.get_release_for_deployment.mock.assert_called_with(
+            config, app_id)
 
     Apps.destroy_app.mock.assert_called_with(old_app, silent=True,
                                              update_db_state=True)
@@ -241,7 +402,7 @@ async def test_reload_app(patch, config, logger, db, async_mock,
         return
 
     Apps.deploy_release.mock.assert_called_with(
-        config=config, release=release
+        config=config, release=release, old_app=None
     )
 
     if raise_exc:
@@ -251,14 +412,14 @@ async def test_reload_app(patch, config, logger, db, async_mock,
         logger.error.assert_not_called()
 
     if raise_exc == asyncio_timeout_exc:
-        Database.update_release_state.assert_called_with(
+        Database.update_release_state.mock.assert_called_with(
             app_logger, config, 'app_id', 1, ReleaseState.TIMED_OUT)
 
 
 @mark.asyncio
-async def test_deploy_release_many_services(patch):
+async def test_deploy_release_many_services(patch, async_mock):
     patch.object(Apps, 'make_logger_for_app')
-    patch.object(Database, 'update_release_state')
+    patch.object(Database, 'update_release_state', new=async_mock())
     patch.init(TooManyServices)
     patch.object(TooManyServices, '__str__', return_value='too_many_services')
 
@@ -286,13 +447,13 @@ async def test_deploy_release_many_services(patch):
     )
 
     TooManyServices.__init__.assert_called_with(20, 15)
-    Database.update_release_state.assert_called()
+    Database.update_release_state.mock.assert_called()
 
 
 @mark.asyncio
-async def test_deploy_release_many_apps(patch, magic):
+async def test_deploy_release_many_apps(patch, magic, async_mock):
     patch.object(Apps, 'make_logger_for_app')
-    patch.object(Database, 'update_release_state')
+    patch.object(Database, 'update_release_state', new=async_mock())
     patch.init(TooManyActiveApps)
     patch.object(TooManyActiveApps, '__str__', return_value='too_many')
 
@@ -321,7 +482,7 @@ async def test_deploy_release_many_apps(patch, magic):
         ))
 
         TooManyActiveApps.__init__.assert_called_with(20, 5)
-        Database.update_release_state.assert_called()
+        Database.update_release_state.mock.assert_called()
     finally:
         Apps.apps = {}  # Cleanup.
 
@@ -337,7 +498,7 @@ def test_get_app_config(patch):
 @mark.asyncio
 async def test_deploy_release_many_volumes(patch, async_mock):
     patch.object(Apps, 'make_logger_for_app')
-    patch.object(Database, 'update_release_state')
+    patch.object(Database, 'update_release_state', new=async_mock())
     patch.init(TooManyVolumes)
     patch.object(TooManyVolumes, '__str__', return_value='too_many_vols')
 
@@ -374,7 +535,7 @@ async def test_deploy_release_many_volumes(patch, async_mock):
     )
 
     TooManyVolumes.__init__.assert_called_with(20, 15)
-    Database.update_release_state.assert_called()
+    Database.update_release_state.mock.assert_called()
 
 
 @mark.parametrize('raise_exc', [None, exc, asyncy_exc])
@@ -386,9 +547,9 @@ async def test_deploy_release(config, magic, patch, deleted,
                               async_mock, raise_exc, maintenance,
                               always_pull_images):
     patch.object(Sentry, 'capture_exc')
-    patch.object(Kubernetes, 'clean_namespace', new=async_mock())
+    patch.object(Containers, 'prune', new=async_mock())
     patch.object(Containers, 'init', new=async_mock())
-    patch.object(Database, 'update_release_state')
+    patch.object(Database, 'update_release_state', new=async_mock())
     app_logger = magic()
     patch.object(Apps, 'make_logger_for_app', return_value=app_logger)
     Apps.apps = {}
@@ -424,14 +585,14 @@ async def test_deploy_release(config, magic, patch, deleted,
     )
 
     if maintenance:
-        assert Database.update_release_state.call_count == 0
+        assert Database.update_release_state.mock.call_count == 0
         app_logger.warn.assert_called()
     elif deleted:
         app_logger.warn.assert_called()
-        Database.update_release_state.assert_called_with(
+        Database.update_release_state.mock.assert_called_with(
             app_logger, config, 'app_id', 'version', ReleaseState.NO_DEPLOY)
     else:
-        assert Database.update_release_state.mock_calls[0] == mock.call(
+        assert Database.update_release_state.mock.mock_calls[0] == mock.call(
             app_logger, config, 'app_id', 'version', ReleaseState.DEPLOYING)
 
         App.__init__.assert_called_with(app_data=AppData(
@@ -445,15 +606,398 @@ async def test_deploy_release(config, magic, patch, deleted,
         App.bootstrap.mock.assert_called()
         Containers.init.mock.assert_called()
         if raise_exc is not None:
+            Containers.prune.mock.assert_not_called()
             assert Apps.apps.get('app_id') is None
             if raise_exc == exc:
                 Sentry.capture_exc.assert_called()
-            assert Database.update_release_state.mock_calls[1] == mock.call(
+            calls = Database.update_release_state.mock.mock_calls
+            assert calls[1] == mock.call(
                 app_logger, config, 'app_id', 'version', ReleaseState.FAILED)
         else:
-            assert Database.update_release_state.mock_calls[1] == mock.call(
+            calls = Database.update_release_state.mock.mock_calls
+            assert calls[1] == mock.call(
                 app_logger, config, 'app_id', 'version', ReleaseState.DEPLOYED)
             assert Apps.apps.get('app_id') is not None
+            Containers.prune.mock.assert_called_once()
+
+
+@mark.parametrize('state', ['QUEUED', 'DEPLOYED'])
+@mark.parametrize('adopted', [True, False])
+@mark.asyncio
+async def test_deploy_release_adopt(config, magic, patch, async_mock,
+                                    state, adopted):
+    patch.object(Containers, 'prune', new=async_mock())
+    patch.object(Containers, 'init', new=async_mock())
+    patch.object(Database, 'update_release_state', new=async_mock())
+    patch.object(Apps, 'make_logger_for_app')
+    patch.object(Apps, 'get_app_config')
+    patch.object(Apps, 'get_services', new=async_mock())
+    patch.init(App)
+    patch.object(App, 'adopt', new=async_mock(return_value=adopted))
+    patch.object(App, 'bootstrap', new=async_mock())
+    Apps.apps = {}
+
+    release = Release(
+        app_uuid='app_id',
+        app_name='app_name',
+        version='version',
+        environment='env',
+        stories={'stories': True},
+        maintenance=False,
+        always_pull_images=False,
+        app_dns='app_dns',
+        state=state,
+        deleted=False,
+        owner_uuid='owner_uuid',
+        owner_email='owner_email'
+    )
+
+    try:
+        await Apps.deploy_release(config=config, release=release)
+
+        if state == 'DEPLOYED':
+            App.adopt.mock.assert_called_once()
+        else:
+            App.adopt.mock.assert_not_called()
+
+        if state == 'DEPLOYED' and adopted:
+            Containers.init.mock.assert_not_called()
+            App.bootstrap.mock.assert_not_called()
+            Containers.prune.mock.assert_not_called()
+        else:
+            Containers.init.mock.assert_called_once()
+            App.bootstrap.mock.assert_called_once()
+            Containers.prune.mock.assert_called_once()
+
+        assert Apps.apps.get('app_id') is not None
+        calls = Database.update_release_state.mock.mock_calls
+        assert calls[-1][1][-1] == ReleaseState.DEPLOYED
+    finally:
+        Apps.apps = {}
+
+
+@mark.parametrize('fail', [None, 'prepare', 'switch_over', 'retire'])
+@mark.asyncio
+async def test_deploy_release_overlap(config, magic, patch, async_mock,
+                                      fail):
+    patch.object(Sentry, 'capture_exc')
+    patch.object(Containers, 'prune', new=async_mock())
+    patch.object(Containers, 'init', new=async_mock())
+    patch.object(Database, 'update_release_state', new=async_mock())
+    patch.object(Apps, 'make_logger_for_app')
+    patch.object(Apps, 'get_app_config')
+    patch.object(Apps, 'get_services', new=async_mock())
+    patch.init(App)
+    patch.object(App, 'adopt', new=async_mock())
+    patch.object(App, 'bootstrap', new=async_mock())
+    if fail == 'prepare':
+        patch.object(App, 'prepare', new=async_mock(side_effect=exc()))
+    else:
+        patch.object(App, 'prepare', new=async_mock())
+    if fail == 'switch_over':
+        patch.object(Apps, 'switch_over', new=async_mock(side_effect=exc()))
+    else:
+        patch.object(Apps, 'switch_over', new=async_mock())
+    if fail == 'retire':
+        patch.object(Apps, 'retire_app', new=async_mock(side_effect=exc()))
+    else:
+        patch.object(Apps, 'retire_app', new=async_mock())
+
+    old_app = magic()
+    old_app.owner_uuid = 'owner_uuid'
+    Apps.apps = {'app_id': old_app}
+    release = Release(
+        app_uuid='app_id',
+        app_name='app_name',
+        version='version',
+        environment='env',
+        stories={'stories': True},
+        maintenance=False,
+        always_pull_images=False,
+        app_dns='app_dns',
+        state='DEPLOYED',
+        deleted=False,
+        owner_uuid='owner_uuid',
+        owner_email='owner_email'
+    )
+    patch.object(Apps_module, 'MAX_ACTIVE_APPS', 1)
+
+    try:
+        await Apps.deploy_release(config=config, release=release,
+                                  old_app=old_app)
+
+        # The running release is replaced, rather than adopted.
+        App.adopt.mock.assert_not_called()
+        # The stories are run by Apps#switch_over.
+        App.bootstrap.mock.assert_not_called()
+        if fail in ['prepare', 'switch_over']:
+            # The old app keeps serving, and the containers created for
+            # the new release are removed.
+            if fail == 'prepare':
+                Apps.switch_over.mock.assert_not_called()
+            Apps.retire_app.mock.assert_not_called()
+            Containers.prune.mock.assert_called_once_with(old_app)
+            assert Apps.apps['app_id'] is old_app
+            calls = Database.update_release_state.mock.mock_calls
+            assert calls[-1][1][-1] == ReleaseState.FAILED
+            return
+
+        new_app = Apps.switch_over.mock.call_args[0][1]
+        Apps.switch_over.mock.assert_called_with(old_app, new_app)
+        Apps.retire_app.mock.assert_called_with(old_app)
+        assert Apps.apps['app_id'] is new_app
+        calls = Database.update_release_state.mock.mock_calls
+        assert calls[-1][1][-1] == ReleaseState.DEPLOYED
+        if fail == 'retire':
+            Sentry.capture_exc.assert_called()
+            Containers.prune.mock.assert_not_called()
+        else:
+            Containers.prune.mock.assert_called_with(new_app)
+    finally:
+        Apps.apps = {}
+
+
+@mark.parametrize('destroy_fails', [True, False])
+@mark.parametrize('run_fails', [True, False])
+@mark.asyncio
+async def test_switch_over(patch, magic, async_mock, destroy_fails,
+                           run_fails):
+    patch.object(Database, 'update_release_state', new=async_mock())
+    patch.object(Metrics, 'app_switchover_seconds')
+    old_app = magic()
+    old_app.app_id = 'app_id'
+    old_app.version = 1
+    app = magic()
+    app.app_id = 'app_id'
+    app.version = 2
+    Apps.apps = {'app_id': old_app}
+
+    def destroy():
+        # The old app is still in place while it's unsubscribed.
+        assert Apps.apps['app_id'] is old_app
+        if destroy_fails:
+            raise Exception()
+
+    patch.object(Story, 'run', new=async_mock())
+    handler = StoryEventHandler(magic(), magic(), logger=magic())
+    handler.get_req().files = {}
+    stories_run = []
+
+    async def run_stories():
+        # An event for the new release, delivered as soon as its first
+        # story has subscribed, goes to the new app.
+        assert Apps.apps['app_id'] is app
+        assert await handler.run_story('app_id', 'a.story', '1', {})
+        assert Story.run.mock.call_args[0][0] is app
+        stories_run.append(True)
+        if run_fails:
+            raise Exception()
+
+    def switch_back(old, new):
+        Apps.apps['app_id'] = old
+
+    old_app.destroy = async_mock(side_effect=destroy)
+    app.run_stories = run_stories
+    patch.object(Apps, 'switch_back', new=async_mock(side_effect=switch_back))
+
+    try:
+        if run_fails:
+            with pytest.raises(Exception):
+                await Apps.switch_over(old_app, app)
+            Apps.switch_back.mock.assert_called_once_with(old_app, app)
+            assert Apps.apps['app_id'] is old_app
+        else:
+            await Apps.switch_over(old_app, app)
+            Apps.switch_back.mock.assert_not_called()
+            assert Apps.apps['app_id'] is app
+    finally:
+        Apps.apps = {}
+
+    Database.update_release_state.mock.assert_called_with(
+        old_app.logger, old_app.config, 'app_id', 1,
+        ReleaseState.TERMINATING)
+    old_app.destroy.mock.assert_called_once()
+    assert stories_run == [True]
+    if destroy_fails:
+        old_app.logger.error.assert_called()
+    Metrics.app_switchover_seconds.labels.assert_called_with(app_id='app_id')
+    Metrics.app_switchover_seconds.labels().observe.assert_called_once()
+
+
+@mark.parametrize('fail', [None, 'destroy', 'run_stories'])
+@mark.asyncio
+async def test_switch_back(patch, magic, async_mock, fail):
+    patch.object(Database, 'update_release_state', new=async_mock())
+    patch.object(Sentry, 'capture_exc')
+    old_app = magic()
+    old_app.app_id = 'app_id'
+    old_app.version = 1
+    app = magic()
+    old_app.run_stories = async_mock(
+        side_effect=exc() if fail == 'run_stories' else None)
+    app.destroy = async_mock(
+        side_effect=exc() if fail == 'destroy' else None)
+    Apps.apps = {}
+
+    try:
+        await Apps.switch_back(old_app, app)
+        assert Apps.apps['app_id'] is old_app
+    finally:
+        Apps.apps = {}
+
+    app.destroy.mock.assert_called_once()
+    old_app.run_stories.mock.assert_called_once()
+    if fail == 'run_stories':
+        old_app.logger.error.assert_called()
+        Database.update_release_state.mock.assert_not_called()
+    else:
+        Database.update_release_state.mock.assert_called_once_with(
+            old_app.logger, old_app.config, 'app_id', 1,
+            ReleaseState.DEPLOYED)
+    if fail == 'destroy':
+        app.logger.error.assert_called()
+
+
+@mark.parametrize('drained', [True, False])
+@mark.asyncio
+async def test_retire_app(patch, magic, async_mock, drained):
+    patch.object(Database, 'update_release_state', new=async_mock())
+    patch.object(Metrics, 'app_drain_seconds')
+    app = magic()
+    app.app_id = 'app_id'
+    app.version = 1
+    app.drain = async_mock(return_value=drained)
+
+    await Apps.retire_app(app)
+
+    app.drain.mock.assert_called_with(Apps_module.DRAIN_TIMEOUT_SECONDS)
+    if drained:
+        app.logger.warn.assert_not_called()
+    else:
+        app.logger.warn.assert_called()
+    Metrics.app_drain_seconds.labels.assert_called_with(app_id='app_id')
+    Metrics.app_drain_seconds.labels().observe.assert_called_once()
+    Database.update_release_state.mock.assert_called_with(
+        app.logger, app.config, 'app_id', 1, ReleaseState.TERMINATED)
+
+
+def _release(**kwargs):
+    release = Release(
+        app_uuid='app_id',
+        app_name='app_name',
+        version=1,
+        environment={'foo': 'bar'},
+        stories={'stories': {'a.story': {}}, 'entrypoint': ['a.story'],
+                 'services': ['alpine'], 'yaml': {}},
+        maintenance=False,
+        always_pull_images=False,
+        app_dns='app_dns',
+        state='DEPLOYED',
+        deleted=False,
+        owner_uuid='owner_uuid',
+        owner_email='owner_email'
+    )
+    return release._replace(**kwargs)
+
+
+@mark.parametrize('changes,story_only', [
+    ({}, True),
+    ({'version': 2, 'state': 'QUEUED'}, True),
+    ({'stories': {'stories': {'b.story': {}}, 'entrypoint': ['b.story'],
+                  'services': ['alpine'], 'yaml': {}}}, True),
+    ({'stories': {'stories': {}, 'entrypoint': [],
+                  'services': ['alpine', 'redis'], 'yaml': {}}}, False),
+    ({'environment': {'foo': 'baz'}}, False),
+    ({'always_pull_images': True}, False),
+    ({'state': 'FAILED'}, False),
+    ({'deleted': True}, False),
+    ({'maintenance': True}, False),
+    ({'stories': None}, False)
+])
+def test_is_story_only_change(magic, changes, story_only):
+    app = magic()
+    app.release = _release()
+    assert Apps.is_story_only_change(app, _release(**changes)) is story_only
+
+
+def test_is_story_only_change_always_pull(magic):
+    app = magic()
+    app.release = _release(always_pull_images=True)
+    # Every release pulls the images again, so it's deployed.
+    assert Apps.is_story_only_change(
+        app, _release(version=2, always_pull_images=True)) is False
+
+
+@mark.parametrize('fail', [False, True, 'other_containers'])
+@mark.asyncio
+async def test_hot_swap(patch, magic, async_mock, config, fail):
+    app = magic()
+    app.app_id = 'app_id'
+    app.version = 1
+    release = _release(version=2)
+    app_logger = magic()
+    patch.object(Apps, 'make_logger_for_app', return_value=app_logger)
+    patch.object(Database, 'update_release_state', new=async_mock())
+
+    def hot_swap(release, logger):
+        if fail == 'other_containers':
+            # Nothing is swapped.
+            return False
+        elif fail:
+            # The app is put back on the old release.
+            raise Exception()
+
+        app.version = release.version
+        return True
+
+    app.hot_swap = async_mock(side_effect=hot_swap)
+
+    ret = await Apps.hot_swap(config, app, release)
+
+    assert ret is not bool(fail)
+    app.hot_swap.mock.assert_called_with(release, app_logger)
+    Apps.make_logger_for_app.assert_called_with(config, 'app_id', 2)
+    calls = Database.update_release_state.mock.mock_calls
+    assert calls[0] == mock.call(app_logger, config, 'app_id', 2,
+                                 ReleaseState.DEPLOYING)
+    if fail:
+        # The old release stays deployed.
+        assert len(calls) == 1
+    else:
+        assert calls[1:] == [
+            mock.call(app_logger, config, 'app_id', 1,
+                      ReleaseState.TERMINATED),
+            mock.call(app_logger, config, 'app_id', 2,
+                      ReleaseState.DEPLOYED)
+        ]
+
+
+@mark.parametrize('swapped', [True, False])
+@mark.asyncio
+async def test_reload_app_hot_swap(patch, magic, async_mock, config, logger,
+                                   swapped):
+    app = magic()
+    Apps.apps = {'app_id': app}
+    release = _release(version=2)
+    patch.object(Apps, 'is_story_only_change', return_value=True)
+    patch.object(Apps, 'hot_swap', new=async_mock(return_value=swapped))
+    patch.object(Apps, 'destroy_app', new=async_mock())
+    patch.object(Apps, 'deploy_release', new=async_mock())
+
+    try:
+        await Apps.reload_app(config, logger, 'app_id', release=release)
+    finally:
+        Apps.apps = {}
+
+    Apps.is_story_only_change.assert_called_with(app, release)
+    Apps.hot_swap.mock.assert_called_with(config, app, release)
+    Apps.destroy_app.mock.assert_not_called()
+    if swapped:
+        Apps.deploy_release.mock.assert_not_called()
+    else:
+        Apps.deploy_release.mock.assert_called_with(config=config,
+                                                    release=release,
+                                                    old_app=app)
 
 
 def test_make_logger_for_app(patch, config):
@@ -524,7 +1068,8 @@ async def test_destroy_app_exc(patch, async_mock, magic,
                                silent, update_db):
     app = magic()
     app.destroy = async_mock(side_effect=exc())
-    patch.object(Database, 'update_release_state')
+    patch.object(Database, 'update_release_state', new=async_mock())
+    patch.object(Containers, 'close_app')
 
     if silent:
         await Apps.destroy_app(app, silent, update_db_state=update_db)
@@ -532,8 +1077,9 @@ async def test_destroy_app_exc(patch, async_mock, magic,
         with pytest.raises(Exception):
             await Apps.destroy_app(app, silent, update_db_state=update_db)
 
+    Containers.close_app.assert_called_with(app)
     if update_db:
-        assert Database.update_release_state.mock_calls == [
+        assert Database.update_release_state.mock.mock_calls == [
             mock.call(app.logger, app.config, app.app_id, app.version,
                       ReleaseState.TERMINATING),
             mock.call(app.logger, app.config, app.app_id, app.version,
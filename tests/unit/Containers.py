@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import hashlib
+from unittest import mock
 from unittest.mock import MagicMock
 
 from asyncy.AppConfig import Expose
@@ -7,6 +8,7 @@ from asyncy.Containers import Containers
 from asyncy.Exceptions import ActionNotFound, ContainerSpecNotRegisteredError,\
     EnvironmentVariableNotFound, K8sError
 from asyncy.Kubernetes import Kubernetes
+from asyncy.Types import StreamingService
 from asyncy.constants.LineConstants import LineConstants
 from asyncy.constants.ServiceConstants import ServiceConstants
 from asyncy.db.Database import Database
@@ -52,8 +54,8 @@ def test_is_service_reusable(story):
 @mark.parametrize('name', ['alpine', 'a!lpine', 'ALPINE', '__aLpInE'])
 def test_get_container_name(patch, story, line, reusable, name):
     patch.object(Containers, 'is_service_reusable', return_value=reusable)
+    patch.object(Containers, 'hash_service_spec', return_value='spec')
     story.app.app_id = 'my_app'
-    story.app.version = 'v2'
     ret = Containers.get_container_name(story.app, story.name, line, name)
     if reusable:
         assert ret == f'alpine-{Containers.hash_service_name(story.app, name)}'
@@ -63,8 +65,7 @@ def test_get_container_name(patch, story, line, reusable, name):
         assert ret == f'alpine-{h}'
 
 
-def test_get_containerconfig_name(app):
-    app.version = 'v1'
+def test_get_containerconfig_name():
     config = ContainerConfig(name='name_with_special_!!!_characters', data={
         'auths': {
             'registry_url': {
@@ -72,8 +73,13 @@ def test_get_containerconfig_name(app):
             }
         }
     })
-    r = Containers.get_containerconfig_name(app, config.name)
-    assert r == 'namewithspecialchara-95b9733c79792f385564973c20be433f6f6832e9'
+    r = Containers.get_containerconfig_name(config)
+    assert r == 'namewithspecialchara-6673daa71fd5d0ca485a805ba56cd5ffb334a450'
+
+    # Named after their contents, so that they aren't created again.
+    assert Containers.get_containerconfig_name(config) == r
+    changed = ContainerConfig(name=config.name, data={})
+    assert Containers.get_containerconfig_name(changed) != r
 
 
 @mark.asyncio
@@ -116,6 +122,37 @@ async def test_clean_app(patch, async_mock):
     Kubernetes.clean_namespace.mock.assert_called_with(app)
 
 
+@mark.parametrize('deployments,adopted', [
+    ({'a': True, 'b': True}, True),
+    ({'a': True, 'b': False}, False),
+    ({'a': True}, False),
+    ({'a': True, 'b': True, 'c': True}, False)
+])
+@mark.asyncio
+async def test_adopt(patch, async_mock, app, deployments, adopted):
+    app.app_id = 'my_app'
+    patch.object(Kubernetes, 'get_deployments_readiness',
+                 new=async_mock(return_value=deployments))
+
+    assert await Containers.adopt(app, {'a', 'b'}) is adopted
+
+    Kubernetes.get_deployments_readiness.mock.assert_called_with(app)
+    if adopted:
+        assert sorted(app.add_container.mock_calls) == [
+            mock.call('a', 'a.my_app.svc.cluster.local'),
+            mock.call('b', 'b.my_app.svc.cluster.local')
+        ]
+    else:
+        app.add_container.assert_not_called()
+
+
+def test_close_app(patch):
+    patch.object(Kubernetes, 'close_informer')
+    app = MagicMock()
+    Containers.close_app(app)
+    Kubernetes.close_informer.assert_called_with(app)
+
+
 @mark.asyncio
 async def test_remove_volume(patch, story, line, async_mock):
     patch.object(Kubernetes, 'remove_volume', new=async_mock())
@@ -129,6 +166,7 @@ async def test_prepare_for_deployment(patch, async_mock):
     story = MagicMock()
     await Containers.prepare_for_deployment(story)
     Kubernetes.clean_namespace.mock.assert_called_with(story.app)
+    story.app.clear_containers.assert_called()
 
 
 def test_format_command(logger, app, echo_service, echo_line):
@@ -158,13 +196,17 @@ def test_hash_ingress_name():
     e = Expose(service='service',
                service_expose_name='expose_name',
                http_path='expose_path')
-    ret = Containers.hash_ingress_name(e)
-    assert ret == 'exposename-0cf994f170f9d213bb814f74baca87ea149f7536'
+    ret = Containers.hash_ingress_name(e, 'container', 'hostname')
+    assert ret == 'exposename-fe985bc75ef1057664f9b4a1bd52efbace1537f8'
+    assert Containers.hash_ingress_name(e, 'other', 'hostname') != ret
 
 
+@mark.parametrize('registered', [True, False])
 @mark.asyncio
-async def test_expose_service(app, patch, async_mock):
+async def test_expose_service(app, patch, async_mock, registered):
     container_name = 'container_name'
+    app.get_container_hostname.return_value = \
+        'hostname' if registered else None
     patch.object(Containers, 'get_container_name',
                  return_value=container_name)
 
@@ -175,13 +217,20 @@ async def test_expose_service(app, patch, async_mock):
                service_expose_name='expose_name',
                http_path='expose_path')
 
-    ingress_name = Containers.hash_ingress_name(e)
     hostname = f'{app.app_dns}--{Containers.get_simple_name(e.service)}'
+    ingress_name = Containers.hash_ingress_name(e, container_name, hostname)
 
     await Containers.expose_service(app, e)
 
-    Containers.create_and_start.mock.assert_called_with(app, None, e.service,
-                                                        container_name)
+    app.get_container_hostname.assert_called_with(container_name)
+    if registered:
+        Containers.create_and_start.mock.assert_not_called()
+        app.add_container.assert_not_called()
+    else:
+        Containers.create_and_start.mock.assert_called_with(
+            app, None, e.service, container_name)
+        app.add_container.assert_called_with(
+            container_name, Kubernetes.get_hostname(app, container_name))
 
     Kubernetes.create_ingress.mock.assert_called_with(ingress_name, app, e,
                                                       container_name,
@@ -190,25 +239,111 @@ async def test_expose_service(app, patch, async_mock):
 
 def test_service_name_and_story_line(patch, story):
     patch.object(hashlib, 'sha1')
+    patch.object(Containers, 'hash_service_spec', return_value='spec')
     story.name = 'story_name'
-    story.app.version = 'v29'
+    line = {'ln': '1'}
     ret = Containers.hash_service_name_and_story_line(
-        story.app, story.name, {'ln': '1'}, 'alpine')
+        story.app, story.name, line, 'alpine')
 
-    hashlib.sha1.assert_called_with(f'alpine-v29-{story.name}-1'
+    Containers.hash_service_spec.assert_called_with(story.app, line, 'alpine')
+    hashlib.sha1.assert_called_with(f'alpine-spec-{story.name}-1'
                                     .encode('utf-8'))
     assert ret == hashlib.sha1().hexdigest()
 
 
 def test_service_name(patch, story):
-    story.app.version = 'v2'
     patch.object(hashlib, 'sha1')
+    patch.object(Containers, 'hash_service_spec', return_value='spec')
     ret = Containers.hash_service_name(story.app, 'alpine')
 
-    hashlib.sha1.assert_called_with(f'alpine-v2'.encode('utf-8'))
+    Containers.hash_service_spec.assert_called_with(story.app, None, 'alpine')
+    hashlib.sha1.assert_called_with(f'alpine-spec'.encode('utf-8'))
     assert ret == hashlib.sha1().hexdigest()
 
 
+def test_hash_service_spec(story):
+    story.app.services = {
+        'alpine': {
+            ServiceConstants.config: {
+                'image': 'alpine:latest',
+                'actions': {'echo': {'run': {'command': ['echo']}}},
+                'environment': {'foo': {}}
+            }
+        }
+    }
+    story.app.environment = {'alpine': {'foo': 'bar'}}
+    story.app.image_pull_policy.return_value = 'IfNotPresent'
+    story.app.always_pull_images = False
+    story.app.service_spec_hashes = {}
+    line = {LineConstants.command: 'echo'}
+
+    h = Containers.hash_service_spec(story.app, None, 'alpine')
+    # A new version of the app doesn't change it.
+    story.app.version = 'v3'
+    assert Containers.hash_service_spec(story.app, None, 'alpine') == h
+    assert Containers.hash_service_spec(story.app, line, 'alpine') != h
+
+    story.app.service_spec_hashes = {}
+    story.app.environment = {'alpine': {'foo': 'baz'}}
+    assert Containers.hash_service_spec(story.app, None, 'alpine') != h
+
+    story.app.service_spec_hashes = {}
+    story.app.environment = {'alpine': {'foo': 'bar'}}
+    story.app.services['alpine'][ServiceConstants.config]['image'] = \
+        'alpine:3.8'
+    assert Containers.hash_service_spec(story.app, None, 'alpine') != h
+
+
+def test_hash_service_spec_always_pull(story):
+    story.app.services = {
+        'alpine': {ServiceConstants.config: {'image': 'alpine:latest'}}
+    }
+    story.app.environment = {}
+    story.app.image_pull_policy.return_value = 'Always'
+    story.app.always_pull_images = True
+    story.app.service_spec_hashes = {}
+    story.app.version = 'v1'
+    h = Containers.hash_service_spec(story.app, None, 'alpine')
+
+    # Every release pulls the image again, even if nothing else changed.
+    story.app.service_spec_hashes = {}
+    story.app.version = 'v2'
+    assert Containers.hash_service_spec(story.app, None, 'alpine') != h
+
+
+def test_hash_service_spec_cached(patch, story):
+    story.app.services = {
+        'alpine': {ServiceConstants.config: {'image': 'alpine:latest'}}
+    }
+    story.app.environment = {}
+    story.app.image_pull_policy.return_value = 'IfNotPresent'
+    story.app.service_spec_hashes = {}
+    line = {LineConstants.command: 'echo'}
+    patch.object(Containers, 'get_start_command', return_value=['echo'])
+
+    h = Containers.hash_service_spec(story.app, line, 'alpine')
+    assert Containers.hash_service_spec(story.app, line, 'alpine') == h
+    Containers.get_start_command.assert_called_once()
+    assert story.app.service_spec_hashes == {('alpine', 'echo'): h}
+
+
+@mark.asyncio
+async def test_prune(patch, app, async_mock):
+    e = Expose(service='service', service_expose_name='expose_name',
+               http_path='expose_path')
+    app.app_dns = 'app_dns'
+    app.app_config.get_expose_config.return_value = [e]
+    app.get_container_names.return_value = {'a', 'b'}
+    patch.object(Containers, 'get_container_name', return_value='b')
+    patch.object(Kubernetes, 'prune_namespace', new=async_mock())
+
+    await Containers.prune(app)
+
+    ingress_name = Containers.hash_ingress_name(e, 'b', 'app_dns--service')
+    Kubernetes.prune_namespace.mock.assert_called_with(app, {'a', 'b'},
+                                                       {ingress_name})
+
+
 @mark.asyncio
 async def test_create_and_start_no_action(story):
     story.app.services = {'alpine': {'configuration': {}}}
@@ -279,9 +414,12 @@ async def test_start(patch, story, async_mock,
 
     patch.object(Containers, 'get_container_name',
                  return_value='asyncy-alpine')
+    patch.object(Containers, 'get_hostname',
+                 new=async_mock(return_value='alpine-host'))
+    story.app.get_container_hostname.return_value = None
 
     patch.object(Database, 'get_container_configs',
-                 return_value=[])
+                 new=async_mock(return_value=[]))
 
     expected_volumes = []
     if with_volumes:
@@ -298,7 +436,7 @@ async def test_start(patch, story, async_mock,
             await Containers.start(story, line)
         return
     else:
-        await Containers.start(story, line)
+        ret = await Containers.start(story, line)
 
     Kubernetes.create_pod.mock.assert_called_with(
         app=story.app, service='alpine',
@@ -308,6 +446,35 @@ async def test_start(patch, story, async_mock,
         env={'alpine_only': True, 'param_1': 'hello_world'},
         volumes=expected_volumes,
         container_configs=[])
+    story.app.add_container.assert_called_with('asyncy-alpine',
+                                               'alpine-host')
+    assert ret == StreamingService(name='alpine', command='echo',
+                                   container_name='asyncy-alpine',
+                                   hostname='alpine-host')
+
+
+@mark.asyncio
+async def test_start_registered(patch, story, async_mock):
+    line = {
+        LineConstants.service: 'alpine',
+        LineConstants.command: 'echo',
+        'ln': '1'
+    }
+    patch.object(Containers, 'get_container_name',
+                 return_value='asyncy-alpine')
+    patch.object(Containers, 'create_and_start', new=async_mock())
+    patch.object(Containers, 'get_hostname', new=async_mock())
+    story.app.get_container_hostname.return_value = 'alpine-host'
+
+    ret = await Containers.start(story, line)
+
+    story.app.get_container_hostname.assert_called_with('asyncy-alpine')
+    Containers.create_and_start.mock.assert_not_called()
+    Containers.get_hostname.mock.assert_not_called()
+    story.app.add_container.assert_not_called()
+    assert ret == StreamingService(name='alpine', command='echo',
+                                   container_name='asyncy-alpine',
+                                   hostname='alpine-host')
 
 
 @mark.asyncio
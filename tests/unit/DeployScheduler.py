@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from asyncy.DeployScheduler import DeployScheduler
+
+from pytest import mark
+
+
+def release(services):
+    class Release:
+        stories = {'services': services}
+
+    return Release()
+
+
+def test_priority():
+    assert DeployScheduler.priority(None) == 0
+    assert DeployScheduler.priority(release(['a', 'b'])) == 2
+    assert DeployScheduler.priority(release([])) == 0
+
+
+@mark.asyncio
+async def test_submit_priority(logger):
+    deployed = []
+
+    async def deploy(app_id, release):
+        deployed.append(app_id)
+
+    scheduler = DeployScheduler(deploy, 1, logger)
+    scheduler.submit('big', release(['a', 'b', 'c']))
+    scheduler.submit('small', release(['a']))
+    scheduler.submit('notified', priority=-1)
+    scheduler.submit('unknown')
+    scheduler.submit('small_2', release(['b']))
+
+    await scheduler.join()
+    scheduler.close()
+
+    assert deployed == ['notified', 'unknown', 'small', 'small_2', 'big']
+
+
+@mark.asyncio
+async def test_concurrency(logger):
+    deploying = set()
+    max_deploying = 0
+    done = []
+
+    async def deploy(app_id, release):
+        nonlocal max_deploying
+        deploying.add(app_id)
+        max_deploying = max(max_deploying, len(deploying))
+        # The first app is slow, but mustn't hold up the others.
+        await asyncio.sleep(0.05 if app_id == 0 else 0)
+        deploying.remove(app_id)
+        done.append(app_id)
+
+    scheduler = DeployScheduler(deploy, 3, logger)
+    for i in range(10):
+        scheduler.submit(i)
+
+    assert len(scheduler.workers) == 3
+    await scheduler.join()
+    scheduler.close()
+
+    assert max_deploying == 3
+    assert done[-1] == 0
+    assert sorted(done) == list(range(10))
+
+
+@mark.asyncio
+async def test_deploy_exc(logger):
+    async def deploy(app_id, release):
+        if app_id == 'a':
+            raise Exception()
+
+    scheduler = DeployScheduler(deploy, 1, logger)
+    scheduler.submit('a')
+    scheduler.submit('b')
+    await scheduler.join()
+
+    logger.error.assert_called_once()
+    assert len(scheduler.workers) == 1
+    assert not scheduler.workers[0].done()
+    scheduler.close()
+    assert scheduler.workers == []
+
+
+@mark.asyncio
+async def test_submit_coalesces(logger):
+    deployed = []
+
+    async def deploy(app_id, release):
+        deployed.append((app_id, release))
+
+    scheduler = DeployScheduler(deploy, 1, logger)
+    scheduler.submit('a', release(['a', 'b']))
+    scheduler.submit('b', release(['a']))
+    newer = release(['a', 'b'])
+    scheduler.submit('a', newer)
+    scheduler.submit('a', priority=-1)
+    scheduler.submit('a', newer)
+    assert len(scheduler.queued) == 2
+
+    await scheduler.join()
+    scheduler.close()
+
+    assert deployed == [('a', newer), ('b', deployed[1][1])]
+    assert scheduler.queued == {}
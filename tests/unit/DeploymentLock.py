@@ -18,3 +18,16 @@ async def test_locking():
     assert await lock.try_acquire('my_app_2') is False
     await lock.release('my_app_2')
     assert await lock.try_acquire('my_app_2') is True
+
+
+@mark.asyncio
+async def test_pending():
+    lock = DeploymentLock()
+    assert await lock.try_acquire('my_app_3') is True
+    assert await lock.release('my_app_3') is False
+    assert await lock.try_acquire('my_app_3') is True
+    assert await lock.try_acquire('my_app_3') is False
+    assert await lock.try_acquire('my_app_3') is False
+    assert await lock.release('my_app_3') is True
+    assert await lock.try_acquire('my_app_3') is True
+    assert await lock.release('my_app_3') is False
@@ -2,7 +2,6 @@
 import asyncio
 import base64
 import json
-import ssl
 import time
 import urllib.parse
 from unittest import mock
@@ -11,17 +10,17 @@ from unittest.mock import MagicMock
 from asyncy.AppConfig import AppConfig, Expose, KEY_EXPOSE
 from asyncy.Exceptions import K8sError
 from asyncy.Kubernetes import Kubernetes
+from asyncy.KubernetesClient import KubernetesClient, WATCH_TIMEOUT_SECONDS
+from asyncy.KubernetesInformer import KubernetesInformer
+from asyncy.RateLimiter import LANE_BULK, LANE_CRITICAL
 from asyncy.constants.LineConstants import LineConstants
 from asyncy.constants.ServiceConstants import ServiceConstants
 from asyncy.entities.ContainerConfig import ContainerConfig
 from asyncy.entities.Volume import Volume
-from asyncy.utils.HttpUtils import HttpUtils
 
 import pytest
 from pytest import fixture, mark
 
-from tornado.httpclient import AsyncHTTPClient
-
 
 @fixture
 def line():
@@ -143,29 +142,154 @@ async def test_create_namespace_if_required(patch, app,
 
 @mark.asyncio
 async def test_clean_namespace(patch, story, async_mock):
-    patch.object(Kubernetes, '_list_resource_names',
-                 new=async_mock(side_effect=[['service_1', 'service_2'],
-                                             ['depl_1', 'depl_2'],
-                                             ['pod_1', 'pod_2'],
-                                             ['ing_1', 'ing_2'],
-                                             ['secret_1', 'secret_2']]))
+    patch.object(Kubernetes, '_delete_collection', new=async_mock())
+
+    await Kubernetes.clean_namespace(story.app)
+
+    assert Kubernetes._delete_collection.mock.mock_calls == [
+        mock.call(story.app, 'services', 'app'),
+        mock.call(story.app, 'deployments', 'app'),
+        mock.call(story.app, 'pods', 'app'),
+        mock.call(story.app, 'ingresses'),
+        mock.call(story.app, 'secrets')
+    ]
+
 
+@mark.asyncio
+async def test_prune_namespace(patch, story, magic, async_mock):
+    names = {
+        'deployments': ['a', 'old_a'],
+        'services': ['a', 'old_a'],
+        'ingresses': ['ing', 'old_ing']
+    }
+    patch.object(Kubernetes, '_list_resource_names',
+                 new=async_mock(side_effect=lambda app, resource, label=None:
+                                names[resource]))
     patch.object(Kubernetes, '_delete_resource', new=async_mock())
 
-    await Kubernetes.clean_namespace(story.app)
+    def secret(name, type='kubernetes.io/dockerconfigjson'):
+        return {'metadata': {'name': name}, 'type': type}
+
+    informer = magic()
+    objects = {
+        'deployments': [{'spec': {'template': {'spec': {
+            'imagePullSecrets': [{'name': 'used'}]
+        }}}}],
+        'secrets': [secret('used'), secret('unused'),
+                    secret('token', 'kubernetes.io/service-account-token')]
+    }
+    informer.get_all = async_mock(side_effect=lambda resource:
+                                  objects[resource])
+    patch.object(Kubernetes, 'get_informer', return_value=informer)
 
+    await Kubernetes.prune_namespace(story.app, {'a', 'b'}, {'ing'})
+
+    assert Kubernetes._list_resource_names.mock.mock_calls == [
+        mock.call(story.app, 'deployments', 'app'),
+        mock.call(story.app, 'services', 'app'),
+        mock.call(story.app, 'ingresses')
+    ]
     assert Kubernetes._delete_resource.mock.mock_calls == [
-        mock.call(story.app, 'services', 'service_1'),
-        mock.call(story.app, 'services', 'service_2'),
-        mock.call(story.app, 'deployments', 'depl_1'),
-        mock.call(story.app, 'deployments', 'depl_2'),
-        mock.call(story.app, 'pods', 'pod_1'),
-        mock.call(story.app, 'pods', 'pod_2'),
-        mock.call(story.app, 'ingresses', 'ing_1'),
-        mock.call(story.app, 'ingresses', 'ing_2'),
-        mock.call(story.app, 'secrets', 'secret_1'),
-        mock.call(story.app, 'secrets', 'secret_2')
+        mock.call(story.app, 'deployments', 'old_a'),
+        mock.call(story.app, 'services', 'old_a'),
+        mock.call(story.app, 'ingresses', 'old_ing'),
+        mock.call(story.app, 'secrets', 'unused')
+    ]
+
+
+def _list(names, version='1'):
+    return _create_response(200, {
+        'metadata': {'resourceVersion': version},
+        'items': [{'metadata': {'name': name}} for name in names]
+    })
+
+
+@mark.parametrize('label', [None, 'app'])
+@mark.asyncio
+async def test_delete_collection(patch, story, magic, async_mock, label):
+    story.app.app_id = 'my_app'
+    patch.object(Kubernetes, 'make_k8s_call', new=async_mock(side_effect=[
+        _create_response(200),
+        _list(['a', 'b', 'c'], '1'),
+        _list(['b', 'c'], '2')
+    ]))
+    patch.object(asyncio, 'sleep', new=async_mock())
+    informer = magic()
+    patch.object(Kubernetes, 'get_informer', return_value=informer)
+
+    def watch(app, resource, resource_version, until, label_selector, lane):
+        assert label_selector == label
+        assert lane == LANE_BULK
+        if resource_version == '1':
+            until({'type': 'DELETED', 'object': {'metadata': {'name': 'a'}}})
+            return False
+
+        assert until({'type': 'MODIFIED',
+                      'object': {'metadata': {'name': 'b'}}}) is False
+        assert until({'type': 'DELETED',
+                      'object': {'metadata': {'name': 'b'}}}) is False
+        return until({'type': 'DELETED',
+                      'object': {'metadata': {'name': 'c'}}})
+
+    patch.object(Kubernetes, 'watch', new=async_mock(side_effect=watch))
+
+    await Kubernetes._delete_collection(story.app, 'pods', label)
+
+    delete_params = {
+        'gracePeriodSeconds': 0,
+        'propagationPolicy': 'Foreground'
+    }
+    list_params = {}
+    if label is not None:
+        delete_params['labelSelector'] = label
+        list_params['labelSelector'] = label
+    path = '/api/v1/namespaces/my_app/pods'
+    assert Kubernetes.make_k8s_call.mock.mock_calls == [
+        mock.call(story.app.config, story.app.logger,
+                  f'{path}?{urllib.parse.urlencode(delete_params)}',
+                  method='delete', lane=LANE_BULK),
+        mock.call(story.app.config, story.app.logger,
+                  f'{path}?{urllib.parse.urlencode(list_params)}',
+                  lane=LANE_BULK),
+        mock.call(story.app.config, story.app.logger,
+                  f'{path}?{urllib.parse.urlencode(list_params)}',
+                  lane=LANE_BULK)
     ]
+    asyncio.sleep.mock.assert_called_once_with(0.7)
+    informer.invalidate.assert_called_once_with('pods')
+
+
+@mark.parametrize('code', [200, 405, 500])
+@mark.asyncio
+async def test_delete_collection_unsupported(patch, story, async_mock,
+                                             code):
+    patch.object(Kubernetes, 'make_k8s_call', new=async_mock(side_effect=[
+        _create_response(code),
+        _list([])
+    ]))
+    patch.object(Kubernetes, '_list_resource_names',
+                 new=async_mock(return_value=['a', 'b']))
+    patch.object(Kubernetes, '_delete_resource', new=async_mock())
+    patch.object(Kubernetes, 'watch', new=async_mock())
+
+    if code == 500:
+        with pytest.raises(K8sError):
+            await Kubernetes._delete_collection(story.app, 'services', 'app')
+        return
+
+    await Kubernetes._delete_collection(story.app, 'services', 'app')
+
+    if code == 405:
+        Kubernetes._list_resource_names.mock.assert_called_once_with(
+            story.app, 'services', 'app')
+        assert Kubernetes._delete_resource.mock.mock_calls == [
+            mock.call(story.app, 'services', 'a'),
+            mock.call(story.app, 'services', 'b')
+        ]
+    else:
+        # Nothing was left to wait for.
+        assert Kubernetes.make_k8s_call.mock.call_count == 2
+        Kubernetes.watch.mock.assert_not_called()
 
 
 def test_get_hostname(story):
@@ -191,12 +315,14 @@ async def test_delete_resource(patch, story, async_mock, first_res, resource):
     story.app.app_id = 'my_app'
     api_responses = [
         _create_response(first_res),
-        _create_response(200),
-        _create_response(200),
+        _create_response(200, {'metadata': {'resourceVersion': '1'}}),
+        _create_response(200, {'metadata': {'resourceVersion': '2'}}),
         _create_response(404),
     ]
     patch.object(Kubernetes, 'make_k8s_call',
                  new=async_mock(side_effect=api_responses))
+    patch.object(Kubernetes, 'watch',
+                 new=async_mock(side_effect=[False, True]))
     patch.object(asyncio, 'sleep', new=async_mock())
     if resource == 'unknown':
         with pytest.raises(Exception):
@@ -215,63 +341,122 @@ async def test_delete_resource(patch, story, async_mock, first_res, resource):
         mock.call(story.app.config, story.app.logger,
                   f'{prefix}/my_app/{resource}/foo'
                   f'?gracePeriodSeconds=0',
-                  method='delete'),
-        mock.call(story.app.config, story.app.logger,
-                  f'{prefix}/my_app/{resource}/foo'),
+                  method='delete', lane=LANE_BULK),
         mock.call(story.app.config, story.app.logger,
-                  f'{prefix}/my_app/{resource}/foo'),
+                  f'{prefix}/my_app/{resource}/foo', lane=LANE_BULK),
         mock.call(story.app.config, story.app.logger,
-                  f'{prefix}/my_app/{resource}/foo'),
+                  f'{prefix}/my_app/{resource}/foo', lane=LANE_BULK),
     ]
 
+    watch_calls = Kubernetes.watch.mock.mock_calls
+    assert [c[1][2] for c in watch_calls] == ['1', '2']
+    assert watch_calls[0][2] == {'field_selector': 'metadata.name=foo',
+                                 'lane': LANE_BULK}
+    assert watch_calls[0][1][3]({'type': 'DELETED'}) is True
+    assert watch_calls[0][1][3]({'type': 'MODIFIED'}) is False
+    asyncio.sleep.mock.assert_called_once_with(0.7)
 
-@mark.parametrize('method', ['patch', 'post'])
-@mark.asyncio
-async def test_make_k8s_call(patch, story, async_mock, method):
-    patch.object(HttpUtils, 'fetch_with_retry', new=async_mock())
-
-    context = MagicMock()
-    patch.object(Kubernetes, 'new_ssl_context', return_value=context)
-    context.load_verify_locations = MagicMock()
-
-    patch.init(AsyncHTTPClient)
 
-    client = AsyncHTTPClient()
-
-    story.app.config.CLUSTER_CERT = 'this_is\\nmy_cert'  # Notice the \\n.
-    story.app.config.CLUSTER_AUTH_TOKEN = 'my_token'
-    story.app.config.CLUSTER_HOST = 'k8s.local'
-
-    path = '/hello_world'
-
-    payload = {
-        'foo': 'bar'
-    }
-
-    expected_kwargs = {
-        'ssl_options': context,
-        'headers': {
-            'Authorization': 'bearer my_token',
-            'Content-Type': 'application/json; charset=utf-8'
-        },
-        'method': method.upper(),
-        'body': json.dumps(payload)
+@mark.parametrize('field_selector', [None, 'metadata.name=foo'])
+@mark.parametrize('label_selector', [None, 'app=foo'])
+@mark.asyncio
+async def test_watch(patch, story, async_mock, magic, field_selector,
+                     label_selector):
+    story.app.app_id = 'my_app'
+    client = magic()
+    client.watch = async_mock(return_value=True)
+    patch.object(Kubernetes, 'get_client', return_value=client)
+    until = magic()
+
+    ret = await Kubernetes.watch(story.app, 'pods', '10', until,
+                                 field_selector=field_selector,
+                                 label_selector=label_selector)
+
+    assert ret is True
+    params = {
+        'watch': 'true',
+        'resourceVersion': '10',
+        'timeoutSeconds': WATCH_TIMEOUT_SECONDS
     }
+    if field_selector is not None:
+        params['fieldSelector'] = field_selector
+    if label_selector is not None:
+        params['labelSelector'] = label_selector
+    qs = urllib.parse.urlencode(params)
+    Kubernetes.get_client.assert_called_with(story.app.config)
+    client.watch.mock.assert_called_with(
+        story.app.logger, f'/api/v1/namespaces/my_app/pods?{qs}', until,
+        WATCH_TIMEOUT_SECONDS, LANE_CRITICAL)
 
-    if method == 'patch':
-        expected_kwargs['headers']['Content-Type'] = \
-            'application/merge-patch+json; charset=utf-8'
-
-    assert await Kubernetes.make_k8s_call(story.app.config, story.app.logger,
-                                          path, payload, method=method) \
-        == HttpUtils.fetch_with_retry.mock.return_value
 
-    HttpUtils.fetch_with_retry.mock.assert_called_with(
-        3, story.app.logger, 'https://k8s.local/hello_world', client,
-        expected_kwargs)
-
-    # Notice the \n. \\n MUST be converted to \n in Kubernetes#make_k8s_call.
-    context.load_verify_locations.assert_called_with(cadata='this_is\nmy_cert')
+@mark.asyncio
+async def test_make_k8s_call(patch, story, async_mock, magic):
+    client = magic()
+    client.request = async_mock()
+    patch.object(Kubernetes, 'get_client', return_value=client)
+
+    ret = await Kubernetes.make_k8s_call(story.app.config, story.app.logger,
+                                         '/path', {'foo': 'bar'}, 'patch',
+                                         LANE_BULK)
+
+    Kubernetes.get_client.assert_called_with(story.app.config)
+    client.request.mock.assert_called_with(story.app.logger, '/path',
+                                           {'foo': 'bar'}, 'patch',
+                                           LANE_BULK)
+    assert ret == client.request.mock.return_value
+
+
+def test_get_client(patch, config):
+    Kubernetes.client = None
+    patch.init(KubernetesClient)
+    client = Kubernetes.get_client(config)
+    assert isinstance(client, KubernetesClient)
+    assert Kubernetes.get_client(config) is client
+    KubernetesClient.__init__.assert_called_once_with(config)
+
+    patch.object(client, 'close')
+    informer = MagicMock()
+    Kubernetes.informers = {'my_app': informer}
+    Kubernetes.close_client()
+    client.close.assert_called_once()
+    informer.close.assert_called_once()
+    assert Kubernetes.client is None
+    assert Kubernetes.informers == {}
+    Kubernetes.close_client()
+
+
+def test_get_informer(patch, app):
+    Kubernetes.informers = {}
+    app.app_id = 'my_app'
+    patch.init(KubernetesInformer)
+    informer = Kubernetes.get_informer(app)
+    assert isinstance(informer, KubernetesInformer)
+    assert Kubernetes.get_informer(app) is informer
+    KubernetesInformer.__init__.assert_called_once_with(app)
+
+    patch.object(informer, 'close')
+    Kubernetes.close_informer(app)
+    informer.close.assert_called_once()
+    assert Kubernetes.informers == {}
+    Kubernetes.close_informer(app)
+
+
+@mark.parametrize('synced', [True, False])
+def test_cache_created(patch, magic, app, synced):
+    informer = magic()
+    informer.is_synced.return_value = synced
+    patch.object(Kubernetes, 'get_informer', return_value=informer)
+    res = _create_response(201, {'metadata': {'name': 'foo'}})
+
+    Kubernetes.cache_created(app, 'services', res)
+
+    Kubernetes.get_informer.assert_called_with(app)
+    informer.is_synced.assert_called_with('services')
+    if synced:
+        informer.put.assert_called_with('services',
+                                        {'metadata': {'name': 'foo'}})
+    else:
+        informer.put.assert_not_called()
 
 
 @mark.asyncio
@@ -283,69 +468,61 @@ async def test_remove_volume(patch, story, async_mock):
         story.app, 'persistentvolumeclaims', name)
 
 
-@mark.parametrize('resource', ['persistentvolumeclaims', 'deployments',
-                               'services', 'foo'])
-@mark.parametrize('res_code', [404, 200, 500])
+@mark.parametrize('exists', [True, False])
 @mark.asyncio
-async def test_does_resource_exist(patch, story, resource,
-                                   async_mock, res_code):
-    resp = MagicMock()
-    resp.code = res_code
-    patch.object(Kubernetes, 'make_k8s_call',
-                 new=async_mock(return_value=resp))
+async def test_does_resource_exist(patch, story, magic, async_mock, exists):
+    informer = magic()
+    informer.get = async_mock(return_value=magic() if exists else None)
+    patch.object(Kubernetes, 'get_informer', return_value=informer)
 
-    if res_code == 500 or resource == 'foo':
-        with pytest.raises(Exception):
-            await Kubernetes._does_resource_exist(story.app, resource, 'name')
-        return
+    ret = await Kubernetes._does_resource_exist(story.app, 'services', 'name')
 
-    ret = await Kubernetes._does_resource_exist(story.app, resource, 'name')
-
-    if res_code == 200:
-        assert ret is True
-    else:
-        assert ret is False
-
-    expected_path = Kubernetes._get_api_path_prefix(resource) + \
-        f'/{story.app.app_id}/{resource}/name'
-    Kubernetes.make_k8s_call.mock.assert_called_with(story.app.config,
-                                                     story.app.logger,
-                                                     expected_path)
+    assert ret is exists
+    Kubernetes.get_informer.assert_called_with(story.app)
+    informer.get.mock.assert_called_with('services', 'name')
 
 
 @mark.asyncio
-async def test_list_resource_names(story, patch, async_mock):
-    mock_res = MagicMock()
-    mock_res.body = json.dumps({
-        'items': [
-            {'metadata': {'name': 'hello'}},
-            {'metadata': {'name': 'world'}},
-        ]
-    })
+async def test_list_resource_names(story, patch, magic, async_mock):
+    informer = magic()
+    informer.list_names = async_mock(return_value=['hello', 'world'])
+    patch.object(Kubernetes, 'get_informer', return_value=informer)
 
-    patch.object(Kubernetes, 'make_k8s_call',
-                 new=async_mock(return_value=mock_res))
-    patch.object(Kubernetes, '_get_api_path_prefix', return_value='prefix')
     ret = await Kubernetes._list_resource_names(story.app, 'services')
-    Kubernetes.make_k8s_call.mock.assert_called_with(
-        story.app.config, story.app.logger,
-        f'prefix/{story.app.app_id}/services?includeUninitialized=true')
 
     assert ret == ['hello', 'world']
+    Kubernetes.get_informer.assert_called_with(story.app)
+    informer.list_names.mock.assert_called_with('services', None)
 
 
-def test_new_ssl_context():
-    assert isinstance(Kubernetes.new_ssl_context(), ssl.SSLContext)
+@mark.asyncio
+async def test_get_deployments_readiness(story, patch, magic, async_mock):
+    informer = magic()
+    informer.get_all = async_mock(return_value=[
+        {'metadata': {'name': 'a'}}, {'metadata': {'name': 'b'}}
+    ])
+    patch.object(Kubernetes, 'get_informer', return_value=informer)
+    patch.object(Kubernetes, 'is_deployment_ready',
+                 side_effect=lambda d: d['metadata']['name'] == 'a')
+
+    ret = await Kubernetes.get_deployments_readiness(story.app)
 
+    assert ret == {'a': True, 'b': False}
+    informer.get_all.mock.assert_called_with('deployments')
 
-@mark.parametrize('res_code', [200, 400])
+
+@mark.parametrize('service_exists', [True, False])
+@mark.parametrize('exists', [True, False])
 @mark.asyncio
-async def test_create_pod(patch, async_mock, story, line, res_code):
-    res = MagicMock()
-    res.code = res_code
+async def test_create_pod(patch, async_mock, story, line, exists,
+                          service_exists):
     patch.object(Kubernetes, 'create_deployment', new=async_mock())
     patch.object(Kubernetes, 'create_service', new=async_mock())
-    patch.object(Kubernetes, 'make_k8s_call', new=async_mock(return_value=res))
+    patch.object(Kubernetes, 'wait_for_deployment', new=async_mock())
+    patch.object(Kubernetes, '_does_resource_exist',
+                 new=async_mock(side_effect=lambda app, resource, name:
+                                exists if resource == 'deployments'
+                                else service_exists))
 
     image = 'alpine/alpine:latest'
     start_command = ['/bin/sleep', '1d']
@@ -358,13 +535,18 @@ async def test_create_pod(patch, async_mock, story, line, res_code):
         story.app, line[LineConstants.service], image,
         container_name, start_command, None, env, [], [])
 
-    Kubernetes.make_k8s_call.mock.assert_called_with(
-        story.app.config, story.app.logger,
-        '/apis/apps/v1/namespaces/my_app/deployments/asyncy--alpine-1')
+    assert Kubernetes._does_resource_exist.mock.mock_calls[0] == mock.call(
+        story.app, 'deployments', 'asyncy--alpine-1')
 
-    if res_code == 200:
+    if exists:
         assert Kubernetes.create_deployment.mock.called is False
-        assert Kubernetes.create_service.mock.called is False
+        Kubernetes.wait_for_deployment.mock.assert_called_with(
+            story.app, container_name)
+        if service_exists:
+            assert Kubernetes.create_service.mock.called is False
+        else:
+            Kubernetes.create_service.mock.assert_called_with(
+                story.app, line[LineConstants.service], container_name)
     else:
         Kubernetes.create_deployment.mock.assert_called_with(
             story.app, line[LineConstants.service],
@@ -425,11 +607,15 @@ async def test_create_volume(story, patch, async_mock,
         Kubernetes.raise_if_not_2xx.assert_called_with(res)
 
 
+@mark.parametrize('exists', [True, False])
 @mark.asyncio
-async def test_create_imagepullsecret(story, patch, async_mock):
+async def test_create_imagepullsecret(story, patch, async_mock, exists):
     res = MagicMock()
     res.code = 200
     patch.object(Kubernetes, 'make_k8s_call', new=async_mock(return_value=res))
+    patch.object(Kubernetes, 'cache_created')
+    patch.object(Kubernetes, '_does_resource_exist',
+                 new=async_mock(return_value=exists))
 
     container_config = ContainerConfig(name='first', data={
         'auths': {
@@ -460,6 +646,12 @@ async def test_create_imagepullsecret(story, patch, async_mock):
 
     await Kubernetes.create_imagepullsecret(story.app, container_config)
 
+    Kubernetes._does_resource_exist.mock.assert_called_with(
+        story.app, 'secrets', 'first')
+    if exists:
+        Kubernetes.make_k8s_call.mock.assert_not_called()
+        return
+
     Kubernetes.make_k8s_call.mock.assert_called_with(
         story.app.config, story.app.logger, expected_path, expected_payload)
 
@@ -746,10 +938,14 @@ async def test_create_deployment(patch, async_mock, story, image_pull_policy):
     patch.object(Kubernetes, 'make_k8s_call', new=async_mock(side_effect=[
         _create_response(404),
         _create_response(201),
-        _create_response(200, {'status': {'readyReplicas': 0}}),
-        _create_response(200, {'status': {'readyReplicas': 0}}),
-        _create_response(200, {'status': {'readyReplicas': 1}})
+        _create_response(200, {'status': {'readyReplicas': 0},
+                               'metadata': {'resourceVersion': '1'}}),
+        _create_response(200, {'status': {'readyReplicas': 1},
+                               'metadata': {'resourceVersion': '2'}})
     ]))
+    patch.object(Kubernetes, 'check_for_image_errors',
+                 new=async_mock(return_value='5'))
+    patch.object(Kubernetes, 'watch', new=async_mock(return_value=False))
 
     await Kubernetes.create_deployment(story.app, 'alpine', image,
                                        container_name,
@@ -776,10 +972,61 @@ async def test_create_deployment(patch, async_mock, story, image_pull_policy):
         mock.call(story.app.config, story.app.logger,
                   expected_create_path, expected_payload),
         mock.call(story.app.config, story.app.logger, expected_verify_path),
-        mock.call(story.app.config, story.app.logger, expected_verify_path),
         mock.call(story.app.config, story.app.logger, expected_verify_path)
     ]
 
+    Kubernetes.check_for_image_errors.mock.assert_called_once_with(
+        story.app, container_name)
+    watch_calls = Kubernetes.watch.mock.mock_calls
+    assert [c[1][1:3] for c in watch_calls] == [('deployments', '1'),
+                                                ('pods', '5')]
+    assert watch_calls[0][2] == {
+        'field_selector': f'metadata.name={container_name}'}
+    assert watch_calls[1][2] == {'label_selector': f'app={container_name}'}
+
+
+@mark.parametrize('pod_state', ['ContainerCreating', 'ErrImagePull'])
+@mark.asyncio
+async def test_wait_for_deployment_watch(patch, async_mock, story,
+                                         pod_state):
+    story.app.app_id = 'my_app'
+    patch.object(Kubernetes, 'make_k8s_call', new=async_mock(
+        return_value=_create_response(200, {
+            'status': {},
+            'metadata': {'resourceVersion': '1'}
+        })))
+    patch.object(Kubernetes, 'check_for_image_errors',
+                 new=async_mock(return_value='5'))
+    pod = {
+        'status': {
+            'containerStatuses': [{
+                'image': 'alpine',
+                'state': {'waiting': {'reason': pod_state}}
+            }]
+        }
+    }
+    ready = asyncio.Event()
+
+    async def watch(app, resource, resource_version, until, **kwargs):
+        if resource == 'pods':
+            assert until({'type': 'MODIFIED', 'object': pod}) is False
+            ready.set()
+            # Runs until it's cancelled.
+            await asyncio.get_event_loop().create_future()
+
+        await ready.wait()
+        assert until({'object': {'status': {}}}) is False
+        return until({'object': {'status': {'readyReplicas': 1}}})
+
+    patch.object(Kubernetes, 'watch', side_effect=watch)
+
+    if pod_state == 'ErrImagePull':
+        with pytest.raises(K8sError):
+            await Kubernetes.wait_for_deployment(story.app, 'alpine')
+    else:
+        await Kubernetes.wait_for_deployment(story.app, 'alpine')
+        Kubernetes.make_k8s_call.mock.assert_called_once()
+
 
 @mark.parametrize('unavailable', [True, False])
 @mark.asyncio
@@ -867,6 +1114,7 @@ async def test_check_for_image_errors(patch, app, async_mock):
 
     patch.object(Kubernetes, 'make_k8s_call', new=async_mock(side_effect=[
         _create_response(200, {
+            'metadata': {'resourceVersion': '10'},
             'items': [{
                 'status': {
                     'containerStatuses': [{
@@ -896,7 +1144,8 @@ async def test_check_for_image_errors(patch, app, async_mock):
         }),
     ]))
 
-    await Kubernetes.check_for_image_errors(app, container_name)
+    assert await Kubernetes.check_for_image_errors(app,
+                                                   container_name) == '10'
     with pytest.raises(K8sError) as exc:
         await Kubernetes.check_for_image_errors(app, container_name)
     assert exc.value.message == 'ImagePullBackOff - Failed to pull image test'
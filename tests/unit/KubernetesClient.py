@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import os
+import sys
+
+from asyncy import KubernetesClient as KubernetesClientModule
+from asyncy import Metrics
+from asyncy.KubernetesClient import KubernetesClient, \
+    THROTTLED_MAX_DELAY_SECONDS, THROTTLED_TRIES, WATCH_TIMEOUT_SECONDS
+from asyncy.RateLimiter import LANE_BULK
+from asyncy.utils.HttpUtils import HttpUtils
+from asyncy.utils.WatchHTTPClient import WatchHTTPClient
+
+import pytest
+from pytest import fixture, mark
+
+
+@fixture
+def config(config):
+    config.CLUSTER_CERT = 'this_is\\nmy_cert'  # Notice the \\n.
+    config.CLUSTER_AUTH_TOKEN = 'my_token'
+    config.CLUSTER_HOST = 'k8s.local'
+    config.K8S_MAX_CLIENTS = '20'
+    config.K8S_QPS = '10'
+    config.K8S_BURST = '30'
+    return config
+
+
+@fixture
+def curl(patch, magic):
+    curl = magic()
+    patch.dict(sys.modules, {'tornado.curl_httpclient': curl})
+    return curl
+
+
+@fixture
+def client(config, curl):
+    client = KubernetesClient(config)
+    yield client
+    if client.ca_certs is not None:
+        os.remove(client.ca_certs)
+
+
+def test_init(client, curl):
+    curl.CurlAsyncHTTPClient.assert_called_with(force_instance=True,
+                                                max_clients=20)
+    assert client.http_client == curl.CurlAsyncHTTPClient()
+    # Notice the \n. \\n MUST be converted to \n.
+    with open(client.ca_certs) as f:
+        assert f.read() == 'this_is\nmy_cert'
+    assert client.ssl_kwargs == {'ca_certs': client.ca_certs}
+    assert client.limiter.qps == 10
+    assert client.limiter.burst == 30
+
+
+@mark.parametrize('path,resource', [
+    ('/api/v1/namespaces/app_id', 'namespaces'),
+    ('/api/v1/namespaces', 'namespaces'),
+    ('/api/v1/namespaces/app_id/pods?labelSelector=app', 'pods'),
+    ('/apis/apps/v1/namespaces/app_id/deployments/foo', 'deployments'),
+    ('/apis/extensions/v1beta1/namespaces/app_id/ingresses', 'ingresses'),
+    ('/version', 'version')
+])
+def test_get_resource(path, resource):
+    assert KubernetesClient.get_resource(path) == resource
+
+
+@mark.parametrize('method', ['get', 'patch', 'post', 'delete'])
+@mark.parametrize('payload', [None, {'foo': 'bar'}])
+@mark.asyncio
+async def test_request(patch, magic, async_mock, logger, client,
+                       method, payload):
+    res = magic(code=200)
+    patch.object(HttpUtils, 'fetch_with_retry',
+                 new=async_mock(return_value=res))
+    patch.many(Metrics, ['k8s_requests_in_flight', 'k8s_request_seconds',
+                         'k8s_requests_total'])
+
+    ret = await client.request(logger, '/api/v1/namespaces/app_id/pods',
+                               payload, method)
+    assert ret == res
+
+    expected_kwargs = {
+        'ca_certs': client.ca_certs,
+        'headers': {
+            'Authorization': 'bearer my_token',
+            'Content-Type': 'application/json; charset=utf-8'
+        },
+        'method': method.upper()
+    }
+
+    if method == 'patch':
+        expected_kwargs['headers']['Content-Type'] = \
+            'application/merge-patch+json; charset=utf-8'
+
+    if payload is not None:
+        expected_kwargs['body'] = json.dumps(payload)
+        if method == 'get':
+            expected_kwargs['method'] = 'POST'
+
+    HttpUtils.fetch_with_retry.mock.assert_called_with(
+        3, logger, 'https://k8s.local/api/v1/namespaces/app_id/pods',
+        client.http_client, expected_kwargs)
+
+    verb = expected_kwargs['method']
+    Metrics.k8s_requests_in_flight.labels.assert_called_with(
+        verb=verb, resource='pods')
+    Metrics.k8s_requests_in_flight.labels().inc.assert_called_once()
+    Metrics.k8s_requests_in_flight.labels().dec.assert_called_once()
+    Metrics.k8s_request_seconds.labels.assert_called_with(
+        verb=verb, resource='pods')
+    Metrics.k8s_requests_total.labels.assert_called_with(
+        verb=verb, resource='pods', code=200)
+    Metrics.k8s_requests_total.labels().inc.assert_called_once()
+
+
+@mark.parametrize('headers,attempt,delay', [
+    ({'Retry-After': '3'}, 0, 3),
+    ({'Retry-After': '300'}, 0, THROTTLED_MAX_DELAY_SECONDS),
+    ({'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}, 2, 2),
+    ({}, 0, 0.5),
+    ({}, 3, 4),
+    ({}, 10, THROTTLED_MAX_DELAY_SECONDS)
+])
+def test_get_retry_after(magic, headers, attempt, delay):
+    res = magic(headers=headers)
+    assert KubernetesClient.get_retry_after(res, attempt) == delay
+
+
+@mark.parametrize('throttled', [1, THROTTLED_TRIES])
+@mark.asyncio
+async def test_request_throttled(patch, magic, async_mock, logger, client,
+                                 throttled):
+    responses = [magic(code=429, headers={'Retry-After': '2'})] * throttled
+    responses.append(magic(code=200))
+    patch.object(client, 'fetch', new=async_mock(side_effect=responses))
+    patch.object(client.limiter, 'acquire', new=async_mock())
+    patch.object(client.limiter, 'pause')
+    patch.object(Metrics, 'k8s_throttled_total')
+
+    ret = await client.request(logger, '/api/v1/namespaces/app_id/pods',
+                               lane=LANE_BULK)
+
+    if throttled == THROTTLED_TRIES:
+        assert ret.code == 429
+    else:
+        assert ret.code == 200
+
+    assert client.fetch.mock.call_count == min(throttled + 1,
+                                               THROTTLED_TRIES)
+    client.limiter.acquire.mock.assert_called_with(LANE_BULK)
+    assert client.limiter.acquire.mock.call_count == \
+        client.fetch.mock.call_count
+    client.limiter.pause.assert_called_with(2)
+    assert client.limiter.pause.call_count == \
+        client.fetch.mock.call_count - 1
+    Metrics.k8s_throttled_total.labels.assert_called_with(resource='pods')
+
+
+@fixture
+def watch_client(magic, client):
+    """
+    The client of a watch, which keeps track of its open requests.
+    """
+    watch_client = magic()
+    watch_client.open_requests = []
+
+    def close():
+        watch_client.open_requests.clear()
+
+    watch_client.close.side_effect = close
+    client.new_watch_client = magic(return_value=watch_client)
+    return watch_client
+
+
+@mark.asyncio
+async def test_new_watch_client():
+    watch_client = KubernetesClient.new_watch_client()
+    assert isinstance(watch_client, WatchHTTPClient)
+    watch_client.close()
+
+
+def _event(event_type: str, name: str) -> bytes:
+    return json.dumps({
+        'type': event_type,
+        'object': {'metadata': {'name': name}}
+    }).encode() + b'\n'
+
+
+@mark.parametrize('chunks,code,expected', [
+    # The event is split across chunks. The stream is left open.
+    ([_event('ADDED', 'a')[:10], _event('ADDED', 'a')[10:],
+      _event('MODIFIED', 'b')], None, True),
+    ([_event('ADDED', 'a') + b'\n' + _event('MODIFIED', 'b')], None, True),
+    ([_event('ERROR', 'a'), _event('MODIFIED', 'b')], None, False),
+    # The watch timed out.
+    ([_event('ADDED', 'a')], 200, False),
+    ([], 500, False),
+])
+@mark.asyncio
+async def test_watch(patch, magic, logger, client, watch_client, chunks,
+                     code, expected):
+    patch.many(Metrics, ['k8s_requests_in_flight', 'k8s_request_seconds',
+                         'k8s_requests_total'])
+    seen = []
+    path = '/api/v1/namespaces/app_id/pods?watch=true'
+
+    def fetch(url, **kwargs):
+        assert url == f'https://k8s.local{path}'
+        assert kwargs['request_timeout'] == WATCH_TIMEOUT_SECONDS + 5
+        assert kwargs['raise_error'] is False
+        assert kwargs['method'] == 'GET'
+        assert kwargs['ca_certs'] == client.ca_certs
+        for chunk in chunks:
+            kwargs['streaming_callback'](chunk)
+
+        future = asyncio.get_event_loop().create_future()
+        if code is not None:
+            future.set_result(magic(code=code))
+
+        return future
+
+    def until(event):
+        seen.append(event['object']['metadata']['name'])
+        return event['type'] == 'MODIFIED'
+
+    watch_client.fetch = fetch
+    assert await client.watch(logger, path, until) is expected
+    watch_client.close.assert_called_once()
+
+    if code is None:
+        code = 200
+    Metrics.k8s_requests_total.labels.assert_called_with(
+        verb='WATCH', resource='pods', code=code)
+    Metrics.k8s_requests_in_flight.labels().dec.assert_called_once()
+    if expected:
+        assert seen == ['a', 'b']
+
+
+@mark.asyncio
+async def test_watch_until_raises(magic, logger, client, watch_client):
+    def fetch(url, **kwargs):
+        kwargs['streaming_callback'](_event('MODIFIED', 'a'))
+        return asyncio.get_event_loop().create_future()
+
+    watch_client.fetch = fetch
+    until = magic(side_effect=ValueError())
+    with pytest.raises(ValueError):
+        await client.watch(logger, '/api/v1/namespaces/app_id/pods', until)
+    watch_client.close.assert_called_once()
+
+
+@mark.asyncio
+async def test_watch_cancelled(patch, magic, logger, client,
+                               watch_client):
+    patch.many(Metrics, ['k8s_requests_in_flight', 'k8s_request_seconds',
+                         'k8s_requests_total'])
+    callbacks = []
+
+    def fetch(url, **kwargs):
+        callbacks.append(kwargs['streaming_callback'])
+        watch_client.open_requests.append(url)
+        return asyncio.get_event_loop().create_future()
+
+    watch_client.fetch = fetch
+    until = magic(return_value=False)
+    task = asyncio.ensure_future(
+        client.watch(logger, '/api/v1/namespaces/app_id/pods', until))
+    await asyncio.sleep(0)
+    assert len(watch_client.open_requests) == 1
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    # The request is aborted, rather than left open.
+    assert len(watch_client.open_requests) == 0
+
+    # The rest of the stream is ignored.
+    callbacks[0](_event('ADDED', 'a'))
+    until.assert_not_called()
+    Metrics.k8s_requests_in_flight.labels().dec.assert_called_once()
+
+
+@mark.asyncio
+async def test_watch_uncapped(magic, logger, config, curl):
+    """
+    Watches don't take up the requests' clients (of which there are
+    K8S_MAX_CLIENTS).
+    """
+    config.K8S_MAX_CLIENTS = '1'
+    client = KubernetesClient(config)
+    watch_clients = []
+
+    def new_watch_client():
+        watch_client = magic()
+        watch_client.fetch.return_value = \
+            asyncio.get_event_loop().create_future()
+        watch_clients.append(watch_client)
+        return watch_client
+
+    client.new_watch_client = new_watch_client
+    tasks = [
+        asyncio.ensure_future(client.watch(
+            logger, '/api/v1/namespaces/app_id/pods', magic()))
+        for _ in range(3)
+    ]
+    await asyncio.sleep(0)
+    curl.CurlAsyncHTTPClient.assert_called_once_with(force_instance=True,
+                                                     max_clients=1)
+    client.http_client.fetch.assert_not_called()
+    assert len(watch_clients) == 3
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.wait(tasks)
+    client.close()
+
+
+def test_close(magic, client):
+    client.http_client = magic()
+    ca_certs = client.ca_certs
+    client.close()
+    client.http_client.close.assert_called_once()
+    assert os.path.exists(ca_certs) is False
+    assert client.ca_certs is None
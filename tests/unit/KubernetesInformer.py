@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+
+from asyncy import Metrics
+from asyncy.Exceptions import K8sError
+from asyncy.Kubernetes import Kubernetes
+from asyncy.KubernetesInformer import INFORMER_WATCH_SECONDS, \
+    KubernetesInformer
+from asyncy.RateLimiter import LANE_BULK, LANE_CRITICAL
+
+import pytest
+from pytest import fixture, mark
+
+
+@fixture
+def informer(patch, app):
+    app.app_id = 'my_app'
+    patch.many(Metrics, ['k8s_cache_hits_total', 'k8s_cache_misses_total'])
+    return KubernetesInformer(app)
+
+
+def _list_response(magic, names, version='1', code=200):
+    return magic(code=code, body=json.dumps({
+        'metadata': {'resourceVersion': version},
+        'items': [{'metadata': {'name': name}} for name in names]
+    }))
+
+
+@mark.asyncio
+async def test_get(patch, magic, async_mock, app, informer):
+    patch.object(Kubernetes, 'make_k8s_call', new=async_mock(
+        return_value=_list_response(magic, ['foo', 'bar'])))
+    patch.object(informer, 'watch', new=async_mock())
+
+    assert await informer.get('services', 'foo') == \
+        {'metadata': {'name': 'foo'}}
+    assert await informer.get('services', 'baz') is None
+    assert await informer.list_names('services') == ['foo', 'bar']
+    assert informer.is_synced('services') is True
+    assert informer.is_synced('pods') is False
+
+    # Listed only once.
+    Kubernetes.make_k8s_call.mock.assert_called_once_with(
+        app.config, app.logger,
+        '/api/v1/namespaces/my_app/services?includeUninitialized=true',
+        lane=LANE_CRITICAL)
+    await asyncio.sleep(0)
+    informer.watch.mock.assert_called_once_with('services', '1')
+
+    Metrics.k8s_cache_misses_total.labels.assert_called_with(
+        resource='services')
+    assert Metrics.k8s_cache_misses_total.labels().inc.call_count == 1
+    assert Metrics.k8s_cache_hits_total.labels().inc.call_count == 2
+
+
+@mark.asyncio
+async def test_get_all(patch, magic, async_mock, informer):
+    patch.object(Kubernetes, 'make_k8s_call', new=async_mock(
+        return_value=_list_response(magic, ['foo', 'bar'])))
+    patch.object(informer, 'watch', new=async_mock())
+
+    assert await informer.get_all('deployments') == [
+        {'metadata': {'name': 'foo'}},
+        {'metadata': {'name': 'bar'}}
+    ]
+
+
+@mark.asyncio
+async def test_get_concurrent(patch, magic, async_mock, informer):
+    patch.object(Kubernetes, 'make_k8s_call', new=async_mock(
+        return_value=_list_response(magic, ['foo'])))
+    patch.object(informer, 'watch', new=async_mock())
+
+    ret = await asyncio.gather(informer.get('pods', 'foo'),
+                               informer.get('pods', 'foo'))
+
+    assert ret == [{'metadata': {'name': 'foo'}}] * 2
+    Kubernetes.make_k8s_call.mock.assert_called_once()
+
+
+@mark.asyncio
+async def test_get_list_fails(patch, magic, async_mock, informer):
+    patch.object(Kubernetes, 'make_k8s_call', new=async_mock(side_effect=[
+        _list_response(magic, [], code=500),
+        _list_response(magic, ['foo'])
+    ]))
+    patch.object(informer, 'watch', new=async_mock())
+
+    with pytest.raises(K8sError):
+        await informer.get('pods', 'foo')
+    assert informer.is_synced('pods') is False
+
+    assert await informer.get('pods', 'foo') is not None
+
+
+@mark.asyncio
+async def test_get_unsupported(informer):
+    with pytest.raises(Exception):
+        await informer.get('foo', 'bar')
+
+
+@mark.asyncio
+async def test_put_remove(patch, magic, async_mock, informer):
+    informer.put('pods', {'metadata': {'name': 'new'}})
+    informer.remove('pods', 'foo')
+    assert 'pods' not in informer.objects
+
+    patch.object(Kubernetes, 'make_k8s_call', new=async_mock(
+        return_value=_list_response(magic, ['foo'])))
+    patch.object(informer, 'watch', new=async_mock())
+    await informer.get('pods', 'foo')
+
+    informer.put('pods', {'metadata': {'name': 'new'}})
+    informer.remove('pods', 'foo')
+    assert await informer.list_names('pods') == ['new']
+
+
+@mark.asyncio
+async def test_list_names_label(patch, magic, async_mock, informer):
+    patch.object(Kubernetes, 'make_k8s_call', new=async_mock(
+        return_value=magic(code=200, body=json.dumps({
+            'metadata': {'resourceVersion': '1'},
+            'items': [
+                {'metadata': {'name': 'a', 'labels': {'app': 'a'}}},
+                {'metadata': {'name': 'b', 'labels': {'foo': 'b'}}},
+                {'metadata': {'name': 'c'}}
+            ]
+        }))))
+    patch.object(informer, 'watch', new=async_mock())
+
+    assert await informer.list_names('pods', 'app') == ['a']
+    assert await informer.list_names('pods') == ['a', 'b', 'c']
+
+
+@mark.asyncio
+async def test_invalidate(patch, magic, async_mock, informer):
+    patch.object(Kubernetes, 'make_k8s_call', new=async_mock(
+        return_value=_list_response(magic, ['foo'])))
+    patch.object(informer, 'watch', new=async_mock())
+    await informer.get('pods', 'foo')
+    task = informer.tasks['pods']
+
+    informer.invalidate('pods')
+    informer.invalidate('pods')
+    await asyncio.sleep(0)
+
+    assert task.cancelled()
+    assert informer.is_synced('pods') is False
+    assert 'pods' not in informer.objects
+    await informer.get('pods', 'foo')
+    assert Kubernetes.make_k8s_call.mock.call_count == 2
+
+
+def test_on_event(informer):
+    informer.objects['pods'] = {}
+    obj = {'metadata': {'name': 'foo'}}
+    assert informer.on_event('pods', {'type': 'ADDED', 'object': obj}) \
+        is False
+    assert informer.objects['pods'] == {'foo': obj}
+
+    obj = {'metadata': {'name': 'foo'}, 'status': {}}
+    informer.on_event('pods', {'type': 'MODIFIED', 'object': obj})
+    assert informer.objects['pods'] == {'foo': obj}
+
+    informer.on_event('pods', {'type': 'DELETED', 'object': obj})
+    informer.on_event('pods', {'type': 'DELETED', 'object': obj})
+    assert informer.objects['pods'] == {}
+
+
+@mark.asyncio
+async def test_watch(patch, async_mock, app, informer):
+    informer.synced['pods'] = asyncio.get_event_loop().create_future()
+    informer.synced['pods'].set_result(None)
+    informer.objects['pods'] = {}
+    patch.object(asyncio, 'sleep', new=async_mock())
+    patch.object(informer, 'list', new=async_mock(
+        side_effect=['2', K8sError(message='oops')]))
+
+    def watch(app, resource, resource_version, until, timeout_seconds,
+              lane):
+        until({'type': 'ADDED', 'object': {'metadata': {'name': 'foo'}}})
+        return False
+
+    patch.object(Kubernetes, 'watch', new=async_mock(side_effect=watch))
+
+    await informer.watch('pods', '1')
+
+    assert [c[1][2] for c in Kubernetes.watch.mock.mock_calls] == ['1', '2']
+    assert Kubernetes.watch.mock.mock_calls[0][2] == {
+        'timeout_seconds': INFORMER_WATCH_SECONDS, 'lane': LANE_BULK}
+    informer.list.mock.assert_called_with('pods', LANE_BULK)
+    assert informer.objects['pods'] == {'foo': {'metadata': {'name': 'foo'}}}
+    app.logger.error.assert_called_once()
+    # The next lookup lists the pods again.
+    assert informer.is_synced('pods') is False
+
+
+@mark.asyncio
+async def test_close(informer):
+    task = asyncio.ensure_future(asyncio.sleep(10))
+    informer.tasks['pods'] = task
+    informer.objects['pods'] = {}
+    informer.close()
+    await asyncio.sleep(0)
+    assert task.cancelled()
+    assert informer.tasks == {}
+    assert informer.objects == {}
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from asyncy import Metrics
+from asyncy.RateLimiter import LANE_BULK, LANE_CRITICAL, RateLimiter
+
+import pytest
+from pytest import fixture, mark
+
+
+@fixture
+def limiter(patch):
+    patch.object(Metrics, 'k8s_rate_limiter_wait_seconds')
+    return RateLimiter(qps=100, burst=2)
+
+
+@mark.asyncio
+async def test_acquire_burst(limiter):
+    await limiter.acquire()
+    await limiter.acquire(LANE_BULK)
+    assert limiter.tokens < 1
+    Metrics.k8s_rate_limiter_wait_seconds.labels.assert_called_with(
+        lane=LANE_BULK)
+
+
+@mark.asyncio
+async def test_acquire_waits(limiter):
+    await limiter.acquire()
+    await limiter.acquire()
+    loop = asyncio.get_event_loop()
+    start = loop.time()
+    await limiter.acquire()
+    # One token is added every 10ms.
+    assert loop.time() - start >= 0.005
+
+
+@mark.asyncio
+async def test_acquire_lanes(limiter):
+    limiter.tokens = 0
+    order = []
+
+    async def acquire(lane, i):
+        await limiter.acquire(lane)
+        order.append(i)
+
+    await asyncio.gather(acquire(LANE_BULK, 1), acquire(LANE_BULK, 2),
+                         acquire(LANE_CRITICAL, 3), acquire(LANE_BULK, 4),
+                         acquire(LANE_CRITICAL, 5))
+
+    # Critical calls jump ahead of the bulk calls queued before them.
+    assert order == [3, 5, 1, 2, 4]
+
+
+@mark.asyncio
+async def test_acquire_cancelled(limiter):
+    limiter.tokens = 0
+    task = asyncio.ensure_future(limiter.acquire(LANE_BULK))
+    await asyncio.sleep(0)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert len(limiter.waiters[LANE_BULK]) == 0
+    await limiter.acquire()
+
+
+@mark.asyncio
+async def test_pause(limiter):
+    limiter.pause(0.05)
+    assert limiter.tokens < -4
+    loop = asyncio.get_event_loop()
+    start = loop.time()
+    await limiter.acquire()
+    assert loop.time() - start >= 0.04
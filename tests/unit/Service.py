@@ -4,7 +4,9 @@ import sys
 from unittest.mock import MagicMock
 
 from asyncy.Apps import Apps
+from asyncy.Kubernetes import Kubernetes
 from asyncy.Service import Service
+from asyncy.db.Database import Database
 
 from click.testing import CliRunner
 
@@ -81,9 +83,18 @@ async def test_service_shutdown_app(patch, async_mock):
     patch.object(asyncio, 'get_event_loop')
     patch.object(tornado, 'ioloop')
     patch.object(Apps, 'destroy_all', new=async_mock())
+    patch.object(Database, 'close_pool')
+    patch.object(Apps, 'stop_listening_to_releases')
+    patch.object(Apps, 'close_deploy_scheduler')
+    patch.object(Kubernetes, 'close_client')
     await Service.shutdown_app()
 
-    Apps.destroy_all.mock.assert_called_once()
+    Kubernetes.close_client.assert_called_once()
+
+    Apps.stop_listening_to_releases.assert_called_once()
+    Apps.close_deploy_scheduler.assert_called_once()
+    Apps.destroy_all.mock.assert_called_once_with(keep_containers=True)
+    Database.close_pool.assert_called_once()
 
     tornado.ioloop.IOLoop.instance() \
         .stop.assert_called_once()
@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
 import pathlib
 import time
+from types import MappingProxyType
 
 from asyncy.Stories import MAX_BYTES_LOGGING, Stories
+from asyncy.processing.Compiler import Compiler
 from asyncy.utils import Dict, Resolver
 
 from pytest import mark
@@ -97,6 +99,23 @@ def test_stories_first_line(patch, story):
     assert result == '16'
 
 
+def test_stories_swapped(app, logger):
+    app.stories = {
+        'a.story': {'tree': {'1': {}}, 'entrypoint': '1',
+                    'functions': {'f': '1'}}
+    }
+    story = Stories(app, 'a.story', logger)
+    app.stories = {
+        'a.story': {'tree': {'2': {}}, 'entrypoint': '2',
+                    'functions': {'f': '2'}}
+    }
+
+    # Stories which are executing keep running on their tree.
+    assert story.first_line() == '1'
+    assert story.function_line_by_name('f') == {}
+    assert story.tree == {'1': {}}
+
+
 def test_stories_function_line_by_name(patch, story):
     patch.object(story, 'line')
     ret = story.function_line_by_name('execute')
@@ -242,6 +261,44 @@ def test_stories_prepare_context(story, app):
     assert story.context == context
 
 
+def test_stories_set_context(story, app):
+    app.base_context = MappingProxyType({'app': {'version': 'v1'}})
+    context = {'foo': 'bar'}
+    story.set_context(context)
+    assert story.context['foo'] == 'bar'
+    assert story.context['app'] == {'version': 'v1'}
+
+    # Writes go to the given context, and can shadow the app's context.
+    story.context['app'] = 'baz'
+    story.context['foo'] = 'foo'
+    assert context == {'foo': 'foo', 'app': 'baz'}
+    assert app.base_context['app'] == {'version': 'v1'}
+
+
+def test_stories_set_context_layered(story, app):
+    app.base_context = {}
+    story.set_context({})
+    context = story.context
+    story.set_context(context)
+    assert story.context is context
+    assert len(story.context.maps) == 2
+
+
+def test_stories_set_variable_app(story, app):
+    app.base_context = MappingProxyType({
+        'app': MappingProxyType({'version': 'v1', 'hostname': 'host'})
+    })
+    story.set_context({})
+    story.set_variable({'paths': ['app', 'version']}, 'v2')
+    assert story.context['app'] == {'version': 'v2', 'hostname': 'host'}
+    # The app's context is copied, rather than written to.
+    assert app.base_context['app']['version'] == 'v1'
+
+    other = Stories(app, 'other.story', story.logger)
+    other.set_context({})
+    assert other.context['app']['version'] == 'v1'
+
+
 def test_stories_next_block_simple(patch, story):
     story.tree = {
         '2': {'ln': '2', 'enter': '3', 'next': '3'},
@@ -383,3 +440,68 @@ def test_stories_next_block_nested_inner(patch, story):
     assert isinstance(story, Stories)
 
     assert story.tree['7'] == story.next_block(story.line('4'))
+
+
+def test_stories_argument_by_name_compiled(patch, story):
+    line = Compiler.compile_tree({
+        '1': {
+            'ln': '1',
+            'args': [
+                {
+                    '$OBJECT': 'argument',
+                    'name': 'foo',
+                    'argument': {'$OBJECT': 'string', 'string': 'bar'}
+                }
+            ]
+        }
+    })['1']
+
+    patch.object(story, 'resolve')
+    result = story.argument_by_name(line, 'foo')
+    story.resolve.assert_called_with(line['args'][0]['argument'],
+                                     encode=False)
+    assert result == story.resolve.return_value
+    assert story.argument_by_name(line, 'bar') is None
+
+
+def test_stories_line_has_parent_compiled(story):
+    story.tree = Compiler.compile_tree({
+        '2': {'ln': '2', 'enter': '3', 'next': '3'},
+        '3': {'ln': '3', 'parent': '2', 'next': '4'},
+        '4': {'ln': '4', 'enter': '5', 'parent': '2', 'next': '5'},
+        '5': {'ln': '5', 'parent': '4', 'next': '6'},
+        '6': {'ln': '6'}
+    })
+
+    assert story.line_has_parent('2', story.line('3')) is True
+    assert story.line_has_parent('2', story.line('5')) is True
+    assert story.line_has_parent('4', story.line('5')) is True
+    assert story.line_has_parent('4', story.line('3')) is False
+    assert story.line_has_parent('2', story.line('6')) is False
+
+
+def test_stories_next_block_compiled(story):
+    story.tree = Compiler.compile_tree({
+        '2': {'ln': '2', 'enter': '3', 'next': '3'},
+        '3': {'ln': '3', 'parent': '2', 'next': '4'},
+        '4': {'ln': '4', 'enter': '5', 'parent': '2', 'next': '5'},
+        '5': {'ln': '5', 'parent': '4', 'next': '6'},
+        '6': {'ln': '6', 'parent': '4', 'next': '7'},
+        '7': {'ln': '7', 'parent': '2', 'next': '8'},
+        '8': {'ln': '8'}
+    })
+
+    assert story.next_block(story.line('2')) is story.tree['8']
+    assert story.next_block(story.line('4')) is story.tree['7']
+    assert story.next_block(story.line('8')) is None
+
+
+def test_stories_fork(story):
+    story.context = {'a': 1}
+    story._stack = ['1']
+    fork = story.fork({'b': 2})
+    assert fork.context == {'b': 2}
+    assert story.context == {'a': 1}
+    assert fork.results is story.results
+    fork.get_stack().append('2')
+    assert story.get_stack() == ['1']
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from asyncy.TaskGraph import TaskGraph
+
+import pytest
+from pytest import mark
+
+
+@mark.asyncio
+async def test_run_dependencies():
+    graph = TaskGraph(concurrency=10)
+    order = []
+
+    def task(name, delay):
+        async def fn():
+            await asyncio.sleep(delay)
+            order.append(name)
+
+        return fn
+
+    graph.add('story', 'stories', task('story', 0),
+              depends_on=['slow', 'fast', 'unknown'])
+    graph.add('slow', 'containers', task('slow', 0.02))
+    graph.add('fast', 'containers', task('fast', 0))
+    graph.add('other', 'stories', task('other', 0))
+
+    await graph.run()
+
+    assert order == ['fast', 'other', 'slow', 'story']
+    assert graph.phase_seconds['containers'] >= 0.015
+    assert set(graph.phase_seconds.keys()) == {'containers', 'stories'}
+
+
+@mark.asyncio
+async def test_run_concurrency():
+    graph = TaskGraph(concurrency=2)
+    running = {'now': 0, 'max': 0}
+
+    async def fn():
+        running['now'] += 1
+        running['max'] = max(running['max'], running['now'])
+        await asyncio.sleep(0.001)
+        running['now'] -= 1
+
+    for i in range(5):
+        graph.add(str(i), 'phase', fn)
+
+    await graph.run()
+    assert running['max'] == 2
+
+
+@mark.asyncio
+async def test_run_exc():
+    graph = TaskGraph(concurrency=10)
+    cancelled = asyncio.Event()
+
+    async def fails():
+        raise Exception('oops')
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError as e:
+            cancelled.set()
+            raise e
+
+    async def dependent():
+        raise AssertionError('Must not run')
+
+    graph.add('fails', 'a', fails)
+    graph.add('slow', 'b', slow)
+    graph.add('dependent', 'c', dependent, depends_on=['fails'])
+
+    with pytest.raises(Exception, match='oops'):
+        await graph.run()
+
+    await asyncio.sleep(0)
+    assert cancelled.is_set()
+    assert 'a' in graph.phase_seconds
+    assert 'c' not in graph.phase_seconds
+
+
+@mark.asyncio
+async def test_add_twice():
+    graph = TaskGraph(concurrency=1)
+    calls = []
+
+    async def first():
+        calls.append('first')
+
+    async def second():
+        calls.append('second')
+
+    graph.add('a', 'phase', first)
+    graph.add('a', 'phase', second)
+    assert graph.has('a') is True
+    assert graph.has('b') is False
+
+    await graph.run()
+    await TaskGraph(concurrency=1).run()
+    assert calls == ['first']
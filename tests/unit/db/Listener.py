@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import socket
+
+from asyncy.db import Listener as ListenerModule
+from asyncy.db.Listener import Listener
+from asyncy.db.PooledConnection import PooledConnection
+
+import psycopg2
+
+import pytest
+from pytest import fixture, mark
+
+
+@fixture
+def sockets():
+    a, b = socket.socketpair()
+    yield a, b
+    a.close()
+    b.close()
+
+
+@fixture
+def conn(magic, sockets):
+    conn = magic()
+    conn.conn.fileno.return_value = sockets[0].fileno()
+    conn.conn.notifies = []
+    return conn
+
+
+@fixture
+def listener(logger, magic):
+    return Listener('dsn', 'release', logger, magic(), magic())
+
+
+def notify(payload):
+    return psycopg2.extensions.Notify(1, 'release', payload)
+
+
+@mark.asyncio
+async def test_connect(patch, async_mock, listener, conn):
+    conn.run = async_mock()
+    patch.object(PooledConnection, 'connect',
+                 new=async_mock(return_value=conn))
+    assert await listener.connect() == conn
+    PooledConnection.connect.mock.assert_called_with('dsn')
+    conn.run.mock.assert_called_with('listen release;')
+
+
+@mark.asyncio
+async def test_connect_exc(patch, async_mock, listener, conn):
+    conn.run = async_mock(side_effect=psycopg2.OperationalError())
+    patch.object(PooledConnection, 'connect',
+                 new=async_mock(return_value=conn))
+    with pytest.raises(psycopg2.OperationalError):
+        await listener.connect()
+    conn.close.assert_called_once()
+
+
+@mark.asyncio
+async def test_start_close(patch, async_mock, listener, conn):
+    patch.object(listener, 'connect', new=async_mock(return_value=conn))
+    patch.object(listener, 'run', new=async_mock())
+    await listener.start()
+    task = listener.task
+    await asyncio.sleep(0)
+    listener.run.mock.assert_called_with(conn)
+    listener.close()
+    assert listener.task is None
+    assert task.done()
+
+
+@mark.asyncio
+async def test_consume(listener, conn, sockets):
+    def poll():
+        conn.conn.notifies.append(notify('app_1'))
+        conn.conn.notifies.append(notify('app_2'))
+        conn.conn.poll.side_effect = psycopg2.OperationalError()
+
+    conn.conn.poll.side_effect = poll
+    sockets[1].send(b'x')
+
+    with pytest.raises(psycopg2.OperationalError):
+        await listener.consume(conn)
+
+    assert [c[1] for c in listener.on_notify.mock_calls] == [
+        ('app_1',), ('app_2',)
+    ]
+    assert conn.conn.notifies == []
+
+
+@mark.parametrize('error', [
+    psycopg2.OperationalError(),
+    psycopg2.InterfaceError(),
+    psycopg2.ProgrammingError(),
+    psycopg2.DatabaseError()
+])
+@mark.asyncio
+async def test_run_reconnects(patch, async_mock, listener, conn, magic,
+                              error):
+    new_conn = magic()
+    listener.on_reconnect = async_mock()
+    patch.object(listener, 'consume', new=async_mock(side_effect=[
+        error, asyncio.CancelledError()
+    ]))
+    patch.object(listener, 'reconnect', new=async_mock(return_value=new_conn))
+
+    with pytest.raises(asyncio.CancelledError):
+        await listener.run(conn)
+
+    conn.close.assert_called_once()
+    new_conn.close.assert_called_once()
+    listener.reconnect.mock.assert_called_once()
+    listener.on_reconnect.mock.assert_called_once()
+    listener.logger.error.assert_called()
+
+
+@mark.asyncio
+async def test_reconnect_backoff(patch, async_mock, listener, conn):
+    patch.object(ListenerModule, 'RECONNECT_MAX_SECONDS', 3)
+    patch.object(listener, 'connect', new=async_mock(side_effect=[
+        psycopg2.OperationalError(), psycopg2.ProgrammingError(),
+        psycopg2.InterfaceError(), conn
+    ]))
+    patch.object(asyncio, 'sleep', new=async_mock())
+
+    assert await listener.reconnect() == conn
+
+    assert [c[1] for c in asyncio.sleep.mock.mock_calls] == [
+        (1,), (2,), (3,)
+    ]
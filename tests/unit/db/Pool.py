@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from asyncy.db.Pool import Pool
+from asyncy.db.PooledConnection import PooledConnection
+from asyncy.db.Statement import Statement
+
+import psycopg2
+
+import pytest
+from pytest import fixture, mark
+
+
+@fixture
+def connect(patch, magic, async_mock):
+    def new_conn(dsn):
+        conn = magic()
+        conn.closed = False
+        conn.close.side_effect = lambda: setattr(conn, 'closed', True)
+        conn.execute = async_mock()
+        return conn
+
+    patch.object(PooledConnection, 'connect',
+                 new=async_mock(side_effect=new_conn))
+    return PooledConnection.connect.mock
+
+
+@mark.asyncio
+async def test_acquire_release(connect):
+    pool = Pool('dsn', max_size=2)
+    a = await pool.acquire()
+    connect.assert_called_with('dsn')
+    assert pool.size == 1
+    pool.release(a)
+    b = await pool.acquire()
+    assert a is b
+    assert connect.call_count == 1
+
+
+@mark.asyncio
+async def test_acquire_waits(connect):
+    pool = Pool('dsn', max_size=1)
+    a = await pool.acquire()
+    waiter = asyncio.ensure_future(pool.acquire())
+    await asyncio.sleep(0)
+    assert not waiter.done()
+
+    pool.release(a)
+    assert await waiter is a
+    assert pool.size == 1
+    assert connect.call_count == 1
+
+
+@mark.asyncio
+async def test_acquire_cancelled(connect):
+    pool = Pool('dsn', max_size=1)
+    a = await pool.acquire()
+    waiter = asyncio.ensure_future(pool.acquire())
+    await asyncio.sleep(0)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+
+    assert len(pool._waiters) == 0
+    pool.release(a)
+    assert await pool.acquire() is a
+
+
+@mark.asyncio
+async def test_release_closed(connect):
+    pool = Pool('dsn', max_size=1)
+    a = await pool.acquire()
+    a.closed = True
+    pool.release(a)
+    assert pool.size == 0
+    b = await pool.acquire()
+    assert b is not a
+    assert connect.call_count == 2
+
+
+@mark.asyncio
+async def test_acquire_connect_exc(patch, async_mock):
+    patch.object(PooledConnection, 'connect',
+                 new=async_mock(side_effect=psycopg2.OperationalError()))
+    pool = Pool('dsn', max_size=1)
+    with pytest.raises(psycopg2.OperationalError):
+        await pool.acquire()
+    assert pool.size == 0
+
+
+@mark.asyncio
+async def test_close(connect):
+    pool = Pool('dsn', max_size=2)
+    a = await pool.acquire()
+    b = await pool.acquire()
+    pool.release(a)
+    pool.close()
+    a.close.assert_called_once()
+    pool.release(b)
+    b.close.assert_called_once()
+    assert pool.size == 0
+
+
+@mark.parametrize('exc', [None, psycopg2.IntegrityError,
+                          psycopg2.OperationalError,
+                          asyncio.CancelledError])
+@mark.asyncio
+async def test_execute(connect, exc):
+    pool = Pool('dsn', max_size=1)
+    statement = Statement(name='foo', query='select 1')
+    conn = await pool.acquire()
+    pool.release(conn)
+    if exc is not None:
+        conn.execute.mock.side_effect = exc()
+        with pytest.raises(exc):
+            await pool.execute(statement, ('a',), fetch='one')
+    else:
+        ret = await pool.execute(statement, ('a',), fetch='one')
+        assert ret == conn.execute.mock.return_value
+
+    conn.execute.mock.assert_called_with(statement, ('a',), 'one')
+    if exc in (None, psycopg2.IntegrityError):
+        conn.close.assert_not_called()
+    else:
+        conn.close.assert_called()
+    assert len(pool._idle) == (0 if conn.closed else 1)
+
+
+@mark.asyncio
+async def test_fetch(patch, async_mock):
+    pool = Pool('dsn')
+    patch.object(pool, 'execute', new=async_mock())
+    statement = Statement(name='foo', query='select 1')
+    ret = pool.execute.mock.return_value
+    assert await pool.fetch_all(statement, ('a',)) == ret
+    pool.execute.mock.assert_called_with(statement, ('a',), fetch='all')
+    assert await pool.fetch_one(statement) == ret
+    pool.execute.mock.assert_called_with(statement, (), fetch='one')
+
+
+@mark.parametrize('stop_early', [False, True])
+@mark.asyncio
+async def test_stream(connect, stop_early):
+    pool = Pool('dsn', max_size=1)
+    conn = await pool.acquire()
+    pool.release(conn)
+    statement = Statement(name='foo', query='select 1')
+
+    async def stream(statement_, size):
+        assert statement_ == statement
+        assert size == 100
+        for row in [1, 2, 3]:
+            yield row
+
+    conn.stream = stream
+
+    rows = []
+    gen = pool.stream(statement)
+    async for row in gen:
+        rows.append(row)
+        if stop_early:
+            break
+
+    if stop_early:
+        await gen.aclose()
+        assert rows == [1]
+        conn.close.assert_called()
+    else:
+        assert rows == [1, 2, 3]
+        conn.close.assert_not_called()
+
+    assert len(pool._idle) == (0 if stop_early else 1)
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+import socket
+from unittest import mock
+
+from asyncy.db.PooledConnection import PooledConnection
+from asyncy.db.Statement import Statement
+
+import psycopg2
+from psycopg2.extensions import POLL_ERROR, POLL_OK, POLL_READ, POLL_WRITE
+from psycopg2.extras import RealDictCursor
+
+import pytest
+from pytest import fixture, mark
+
+
+@fixture
+def sockets():
+    a, b = socket.socketpair()
+    yield a, b
+    a.close()
+    b.close()
+
+
+@fixture
+def conn(magic, sockets):
+    conn = magic()
+    conn.closed = 0
+    conn.poll.return_value = POLL_OK
+    conn.fileno.return_value = sockets[0].fileno()
+    return conn
+
+
+@mark.asyncio
+async def test_connect(patch, conn):
+    conn.poll.side_effect = [POLL_WRITE, POLL_OK]
+    patch.object(psycopg2, 'connect', return_value=conn)
+    ret = await PooledConnection.connect('dsn')
+    psycopg2.connect.assert_called_with('dsn', async_=True)
+    assert ret.conn == conn
+    assert conn.poll.call_count == 2
+
+
+@mark.asyncio
+async def test_connect_exc(patch, conn):
+    conn.poll.return_value = POLL_ERROR
+    patch.object(psycopg2, 'connect', return_value=conn)
+    with pytest.raises(psycopg2.OperationalError):
+        await PooledConnection.connect('dsn')
+    conn.close.assert_called_once()
+
+
+@mark.asyncio
+async def test_wait_read(conn, sockets):
+    conn.poll.side_effect = [POLL_READ, POLL_OK]
+    sockets[1].send(b'x')
+    await PooledConnection(conn).wait()
+    assert conn.poll.call_count == 2
+
+
+def test_closed(conn):
+    pooled = PooledConnection(conn)
+    assert pooled.closed is False
+    pooled.close()
+    conn.close.assert_called_once()
+    conn.closed = 1
+    assert pooled.closed is True
+    pooled.close()
+    conn.close.assert_called_once()
+
+
+@mark.parametrize('fetch', [None, 'all', 'one'])
+@mark.asyncio
+async def test_execute(conn, fetch):
+    pooled = PooledConnection(conn)
+    cur = conn.cursor.return_value
+    statement = Statement(name='foo', query='select $1, $2')
+
+    ret = await pooled.execute(statement, ('a', 'b'), fetch=fetch)
+    await pooled.execute(statement, ('a', 'b'), fetch=fetch)
+
+    conn.cursor.assert_called_with(cursor_factory=RealDictCursor)
+    assert cur.execute.mock_calls[0][1] == ('prepare foo as select $1, $2',
+                                            None)
+    assert cur.execute.mock_calls[1][1] == ('execute foo (%s, %s)',
+                                            ('a', 'b'))
+    # Prepared once per connection.
+    assert cur.execute.call_count == 3
+    assert cur.close.call_count == 3
+
+    if fetch == 'all':
+        assert ret == cur.fetchall()
+    elif fetch == 'one':
+        assert ret == cur.fetchone()
+    else:
+        assert ret is None
+
+
+@mark.asyncio
+async def test_execute_no_args(conn):
+    pooled = PooledConnection(conn)
+    pooled.prepared.add('foo')
+    await pooled.execute(Statement(name='foo', query='select 1'))
+    conn.cursor().execute.assert_called_once_with('execute foo', None)
+
+
+@mark.parametrize('fetch', [None, 'all', 'one'])
+@mark.asyncio
+async def test_run(conn, fetch):
+    cur = conn.cursor.return_value
+    ret = await PooledConnection(conn).run('select %s', ('a',), fetch)
+    conn.cursor.assert_called_with(cursor_factory=RealDictCursor)
+    cur.execute.assert_called_with('select %s', ('a',))
+    cur.close.assert_called_once()
+
+    if fetch == 'all':
+        assert ret == cur.fetchall()
+    elif fetch == 'one':
+        assert ret == cur.fetchone()
+    else:
+        assert ret is None
+
+
+@mark.asyncio
+async def test_stream(patch, async_mock, conn):
+    pooled = PooledConnection(conn)
+    patch.object(pooled, 'run', new=async_mock(side_effect=[
+        None, None, [1, 2], [3], None
+    ]))
+    statement = Statement(name='foo', query='select 1')
+
+    rows = [row async for row in pooled.stream(statement, size=2)]
+
+    assert rows == [1, 2, 3]
+    assert pooled.run.mock.mock_calls == [
+        mock.call('begin;'),
+        mock.call('declare foo no scroll cursor for select 1'),
+        mock.call('fetch 2 from foo;', fetch='all'),
+        mock.call('fetch 2 from foo;', fetch='all'),
+        mock.call('commit;')
+    ]
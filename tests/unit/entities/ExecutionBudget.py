@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+
+from asyncy.Exceptions import StoryscriptRuntimeError
+from asyncy.entities.ExecutionBudget import ExecutionBudget
+
+import pytest
+from pytest import mark
+
+
+def test_execution_budget_from_config(magic):
+    config = magic(STORY_SLICE_LINES='100', STORY_SLICE_MICROSECONDS='5000',
+                   STORY_MAX_STEPS='10', STORY_MAX_SECONDS=60)
+    budget = ExecutionBudget.from_config(config)
+    assert budget.slice_lines == 100
+    assert budget.slice_seconds == 0.005
+    assert budget.max_steps == 10
+    assert budget.max_seconds == 60
+
+
+def test_execution_budget_unlimited():
+    budget = ExecutionBudget()
+    for _ in range(10000):
+        budget.step()
+
+    assert budget.steps == 10000
+    assert budget.should_yield() is False
+
+
+def test_execution_budget_max_steps(story):
+    budget = ExecutionBudget(max_steps=2)
+    budget.step()
+    budget.step()
+    with pytest.raises(StoryscriptRuntimeError) as e:
+        budget.step(story, 'line')
+
+    assert e.value.story == story
+    assert e.value.line == 'line'
+
+
+def test_execution_budget_max_seconds(patch):
+    patch.object(time, 'monotonic', side_effect=[0, 5, 11])
+    budget = ExecutionBudget(max_seconds=10)
+    budget.step()
+    with pytest.raises(StoryscriptRuntimeError):
+        budget.step()
+
+
+def test_execution_budget_slice_lines():
+    budget = ExecutionBudget(slice_lines=2)
+    budget.step()
+    assert budget.should_yield() is False
+    budget.step()
+    assert budget.should_yield() is True
+
+
+def test_execution_budget_slice_seconds(patch):
+    patch.object(time, 'monotonic', side_effect=[0, 0.001, 0.01])
+    budget = ExecutionBudget(slice_seconds=0.005)
+    assert budget.should_yield() is False
+    assert budget.should_yield() is True
+
+
+@mark.asyncio
+async def test_execution_budget_yield(patch, async_mock):
+    patch.object(asyncio, 'sleep', new=async_mock())
+    budget = ExecutionBudget(slice_lines=1)
+    budget.step()
+    assert budget.should_yield() is True
+    await budget.yield_()
+    asyncio.sleep.mock.assert_called_with(0)
+    assert budget.slice_steps == 0
+    assert budget.should_yield() is False
+    assert budget.steps == 1
@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 import json
 
+from asyncy import Metrics
 from asyncy.Apps import Apps
+from asyncy.Exceptions import AppNotDeployedError
 from asyncy.constants import ContextConstants
 from asyncy.entities.Multipart import FileFormField
 from asyncy.http_handlers.StoryEventHandler import CLOUD_EVENTS_FILE_KEY, \
@@ -115,3 +117,18 @@ async def test_post(patch, logger, magic, async_mock, throw_exc, handler):
             Apps.get('app_id'), Apps.get('app_id').logger,
             story_name='hello.story',
             context=expected_context, block='1')
+
+
+@mark.asyncio
+async def test_run_story_app_not_deployed(patch, async_mock, handler):
+    patch.object(Apps, 'get', return_value=None)
+    patch.object(Story, 'run', new=async_mock())
+    patch.object(Metrics, 'app_unavailable_events_total')
+
+    with pytest.raises(AppNotDeployedError):
+        await handler.run_story('app_id', 'hello.story', '1', {})
+
+    Story.run.mock.assert_not_called()
+    Metrics.app_unavailable_events_total.labels.assert_called_with(
+        app_id='app_id')
+    Metrics.app_unavailable_events_total.labels().inc.assert_called_once()
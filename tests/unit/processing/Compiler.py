@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+from asyncy.entities.Line import Line
+from asyncy.processing import Lexicon
+from asyncy.processing.Compiler import Compiler
+from asyncy.processing.Services import Services
+
+from pytest import fixture, mark
+
+
+@fixture
+def tree():
+    return {
+        '1': {'ln': '1', 'method': 'for', 'enter': '2', 'next': '2'},
+        '2': {'ln': '2', 'method': 'execute', 'parent': '1', 'next': '3',
+              'args': [
+                  {
+                      '$OBJECT': 'argument',
+                      'name': 'msg',
+                      'argument': {'$OBJECT': 'string', 'string': 'foo'}
+                  },
+                  {
+                      '$OBJECT': 'argument',
+                      'name': 'msg',
+                      'argument': {'$OBJECT': 'string', 'string': 'bar'}
+                  }
+              ]},
+        '3': {'ln': '3', 'method': 'set'}
+    }
+
+
+def test_compiler_compile_tree(tree):
+    lines = Compiler.compile_tree(tree)
+
+    for line_number, line in lines.items():
+        assert isinstance(line, Line)
+        assert line == tree[line_number]
+
+    assert lines['1'].next_line is lines['2']
+    assert lines['1'].enter_line is lines['2']
+    assert lines['1'].parent_line is None
+    assert lines['2'].parent_line is lines['1']
+    assert lines['2'].next_line is lines['3']
+    assert lines['3'].next_line is None
+
+    assert lines['1'].handler == Lexicon.for_loop
+    assert lines['2'].handler == Lexicon.execute
+    assert lines['3'].handler == Lexicon.set
+
+
+def test_compiler_compile_tree_arguments(tree):
+    lines = Compiler.compile_tree(tree)
+    assert lines['1'].arguments == {}
+    assert lines['2'].arguments == {
+        'msg': {'$OBJECT': 'string', 'string': 'foo'}
+    }
+
+
+def test_compiler_compile_story_does_not_modify(tree):
+    story = {'tree': tree, 'entrypoint': '1', 'functions': {}}
+    compiled = Compiler.compile_story(story)
+    assert compiled['entrypoint'] == '1'
+    assert compiled['functions'] == {}
+    assert isinstance(compiled['tree']['1'], Line)
+    assert not isinstance(story['tree']['1'], Line)
+
+
+def test_compiler_compile_stories(patch):
+    patch.object(Compiler, 'compile_story')
+    assert Compiler.compile_stories({'a': 'foo', 'b': 'bar'}) == {
+        'a': Compiler.compile_story.return_value,
+        'b': Compiler.compile_story.return_value
+    }
+
+
+@mark.parametrize('method,name', [
+    ('if', 'if_condition'),
+    ('elif', 'if_condition'),
+    ('else', 'if_condition'),
+    ('for', 'for_loop'),
+    ('execute', 'execute'),
+    ('set', 'set'),
+    ('expression', 'set'),
+    ('mutation', 'set'),
+    ('call', 'call'),
+    ('function', 'function'),
+    ('when', 'when'),
+    ('return', 'ret'),
+    ('break', 'break_'),
+    ('foo_method', None)
+])
+def test_compiler_handler(patch, method, name):
+    if name is not None:
+        patch.object(Lexicon, name)
+        expected = getattr(Lexicon, name)
+    else:
+        expected = None
+
+    assert Compiler.handler({'method': method}) == expected
+
+
+def test_compiler_handler_compiled(tree):
+    line = Compiler.compile_tree(tree)['1']
+    line.handler = 'foo'
+    assert Compiler.handler(line) == 'foo'
+
+
+def test_compiler_index_blocks():
+    lines = Compiler.compile_tree({
+        '1': {'ln': '1', 'next': '2'},
+        '2': {'ln': '2', 'enter': '3', 'next': '3'},
+        '3': {'ln': '3', 'parent': '2', 'next': '4'},
+        '4': {'ln': '4', 'enter': '5', 'parent': '2', 'next': '5'},
+        '5': {'ln': '5', 'parent': '4', 'next': '6'},
+        '6': {'ln': '6', 'parent': '4', 'next': '7'},
+        '7': {'ln': '7', 'parent': '2', 'next': '8'},
+        '8': {'ln': '8'}
+    })
+
+    assert lines['1'].ancestors == frozenset()
+    assert lines['5'].ancestors == {'2', '4'}
+    assert lines['7'].ancestors == {'2'}
+
+    assert lines['1'].depth == 0
+    assert lines['3'].depth == 1
+    assert lines['6'].depth == 2
+
+    assert lines['1'].exit_line is lines['2']
+    assert lines['2'].exit_line is lines['8']
+    assert lines['4'].exit_line is lines['7']
+    assert lines['6'].exit_line is lines['7']
+    assert lines['7'].exit_line is lines['8']
+    assert lines['8'].exit_line is None
+
+
+def test_compiler_index_blocks_last_line():
+    lines = Compiler.compile_tree({
+        '2': {'ln': '2', 'enter': '3', 'next': '3'},
+        '3': {'ln': '3', 'parent': '2', 'next': '4'},
+        '4': {'ln': '4', 'enter': '5', 'parent': '2', 'next': '5'},
+        '5': {'ln': '5', 'parent': '4'}
+    })
+
+    assert lines['2'].exit_line is None
+    assert lines['4'].exit_line is None
+
+
+def test_compiler_index_async_lines():
+    lines = Compiler.compile_tree({
+        '1': {'ln': '1', 'method': 'for', 'enter': '2', 'next': '2'},
+        '2': {'ln': '2', 'method': 'for', 'parent': '1', 'enter': '3',
+              'next': '3'},
+        '3': {'ln': '3', 'method': 'set', 'parent': '2', 'next': '4'},
+        '4': {'ln': '4', 'method': 'for', 'parent': '1', 'enter': '5',
+              'next': '5'},
+        '5': {'ln': '5', 'method': 'if', 'parent': '4', 'enter': '6',
+              'next': '6'},
+        '6': {'ln': '6', 'method': 'execute', 'parent': '5', 'next': '7'},
+        '7': {'ln': '7', 'method': 'foo_method', 'next': '8'},
+        '8': {'ln': '8', 'method': 'for', 'enter': '9', 'next': '9'},
+        '9': {'ln': '9', 'method': 'set', 'parent': '8'}
+    })
+
+    # Outer loops always yield in between iterations.
+    assert lines['1'].is_async is True
+    assert lines['1'].handler == Lexicon.for_loop
+    assert lines['8'].is_async is True
+    assert lines['8'].handler == Lexicon.for_loop
+
+    assert lines['2'].is_async is False
+    assert lines['2'].handler == Lexicon.for_loop_sync
+    assert lines['3'].is_async is False
+    assert lines['4'].is_async is True
+    assert lines['4'].handler == Lexicon.for_loop
+    assert lines['5'].is_async is False
+    assert lines['6'].is_async is True
+    assert lines['7'].is_async is True
+    assert lines['9'].is_async is False
+
+
+def test_compiler_index_dataflow():
+    lines = Compiler.compile_tree({
+        '1': {'ln': '1', 'method': 'set', 'name': ['a', 'b'],
+              'args': [{'$OBJECT': 'expression', 'expression': 'sum',
+                        'values': [
+                            {'$OBJECT': 'path', 'paths': ['x']},
+                            {'$OBJECT': 'path', 'paths': [
+                                'y', {'$OBJECT': 'path', 'paths': ['z']}
+                            ]}
+                        ]}]},
+        '2': {'ln': '2', 'method': 'for', 'output': ['item'],
+              'args': [{'$OBJECT': 'path', 'paths': ['items']}]},
+        '3': {'ln': '3', 'method': 'execute', 'service': 'foo'}
+    })
+
+    assert lines['1'].reads == {'x', 'y', 'z'}
+    assert lines['1'].writes == {'a'}
+    assert lines['2'].reads == {'items'}
+    assert lines['2'].writes == {'item'}
+    assert lines['3'].reads == frozenset()
+    assert lines['3'].writes == frozenset()
+
+
+def execute_line(ln, next_ln, service='foo', reads=None, writes=None,
+                 **kwargs):
+    line = {'ln': ln, 'method': 'execute', 'service': service,
+            'command': 'bar', 'next': next_ln, **kwargs}
+    if reads is not None:
+        line['args'] = [{'$OBJECT': 'argument', 'name': 'a',
+                         'argument': {'$OBJECT': 'path', 'paths': [reads]}}]
+    if writes is not None:
+        line['name'] = [writes]
+    return line
+
+
+services = {
+    'foo': {'configuration': {'actions': {'bar': {'http': {}}}}},
+    'baz': {'configuration': {'actions': {'bar': {'http': {}}}}},
+    'inline': {'configuration': {'actions': {
+        'bar': {'http': {'use_event_conn': True}}
+    }}}
+}
+
+
+def test_compiler_index_batches(patch):
+    patch.object(Services, 'internal_services', {'log': 'log'})
+    lines = Compiler.compile_tree({
+        '1': execute_line('1', '2', writes='a'),
+        '2': execute_line('2', '3', service='baz', writes='b'),
+        '3': execute_line('3', '4', reads='a', writes='c'),
+        '4': execute_line('4', '5', service='baz', writes='d'),
+        '5': execute_line('5', '6', service='log'),
+        '6': execute_line('6', '7', writes='e'),
+        '7': {'ln': '7', 'method': 'set', 'next': '8'},
+        '8': execute_line('8', '9'),
+        '9': execute_line('9', '10', service='inline'),
+        '10': execute_line('10', '11', enter='11'),
+        '11': execute_line('11', '12', parent='10'),
+        '12': execute_line('12', '13', service='baz', parent='10'),
+        '13': execute_line('13', None, service='baz', writes='c')
+    }, services)
+
+    assert lines['1'].batch == (lines['1'], lines['2'])
+    assert lines['2'].batch is None
+    assert lines['3'].batch == (lines['3'], lines['4'])
+    assert lines['6'].batch is None
+    assert lines['8'].batch is None
+    assert lines['10'].batch is None
+    assert lines['11'].batch == (lines['11'], lines['12'])
+    assert lines['13'].batch is None
+
+
+def test_compiler_index_batches_same_service():
+    # eg: redis set, then redis get, then an insert on postgres.
+    lines = Compiler.compile_tree({
+        '1': execute_line('1', '2'),
+        '2': execute_line('2', '3', writes='x'),
+        '3': execute_line('3', None, service='baz')
+    }, services)
+
+    assert lines['1'].batch is None
+    assert lines['2'].batch == (lines['2'], lines['3'])
+
+
+def test_compiler_index_batches_no_services():
+    lines = Compiler.compile_tree({
+        '1': execute_line('1', '2'),
+        '2': execute_line('2', None)
+    })
+    assert lines['1'].batch is None
+
+
+@mark.parametrize('line,expected', [
+    ({'method': 'set', 'service': 'foo', 'command': 'bar'}, False),
+    ({'method': 'execute', 'service': 'foo', 'command': 'bar'}, True),
+    ({'method': 'execute', 'service': 'foo', 'command': 'baz'}, False),
+    ({'method': 'execute', 'service': 'foo', 'command': 'bar',
+      'enter': '2'}, False),
+    ({'method': 'execute', 'service': 'unknown', 'command': 'bar'}, False),
+    ({'method': 'execute', 'service': 'inline', 'command': 'bar'}, False),
+    ({'method': 'execute', 'service': 'log', 'command': 'bar'}, False)
+])
+def test_compiler_is_concurrent(patch, line, expected):
+    patch.object(Services, 'internal_services', {'log': 'log'})
+    assert Compiler.is_concurrent(line, {**services, 'log': {}}) is expected
+
+
+def path(name):
+    return {'$OBJECT': 'path', 'paths': [name]}
+
+
+def loop(*block):
+    """
+    Returns a for loop over items (as item), with the given lines as
+    it's block. Line numbers are assigned in order, starting from 2.
+    """
+    tree = {'1': {'ln': '1', 'method': 'for', 'output': ['item'],
+                  'args': [path('items')], 'enter': '2', 'next': '2'}}
+    for i, child in enumerate(block):
+        ln = str(i + 2)
+        tree[ln] = {'ln': ln, 'parent': '1', 'next': str(i + 3), **child}
+
+    return tree
+
+
+def call(name=None, *reads):
+    line = {'method': 'execute', 'service': 'foo', 'command': 'bar',
+            'args': [{'$OBJECT': 'argument', 'name': 'a',
+                      'argument': path(r)} for r in reads]}
+    if name is not None:
+        line['name'] = [name]
+    return line
+
+
+@mark.parametrize('tree,expected', [
+    (loop(call('r', 'item'), call(None, 'r')), True),
+    (loop(call('r', 'item'), {'method': 'set', 'name': ['x'],
+                              'args': [path('r')]}), True),
+    (loop({'method': 'set', 'name': ['x'], 'args': [path('item')]}), False),
+    (loop(call(None, 'total'),
+          {'method': 'set', 'name': ['total'], 'args': [path('item')]}),
+     False),
+    (loop(call('r', 'item'), {'method': 'set', 'name': ['r', 'x'],
+                              'args': [path('item')]}), False),
+    (loop(call('r', 'item'), {'method': 'set', 'name': ['x'],
+                              'args': [path('r'),
+                                       {'$OBJECT': 'mutation'}]}), False),
+    (loop(call('r', 'item'), {'method': 'mutation', 'args': [path('r')]}),
+     False),
+    (loop(call('r', 'item'), {'method': 'when', 'service': 'foo'}), False),
+    (loop({**call('r', 'item'), 'enter': '3'}), False),
+    (loop({'method': 'if', 'enter': '3', 'args': [path('item')]},
+          {**call('r', 'item'), 'parent': '2'},
+          call(None, 'r')), False)
+])
+def test_compiler_index_loops(tree, expected):
+    lines = Compiler.compile_tree(tree)
+    assert lines['1'].parallel is expected
@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import gc
 from unittest import mock
 from unittest.mock import MagicMock, Mock
 
@@ -10,6 +12,7 @@ from asyncy.constants.LineConstants import LineConstants
 from asyncy.constants.LineSentinels import LineSentinels
 from asyncy.constants.ServiceConstants import ServiceConstants
 from asyncy.processing import Lexicon, Story
+from asyncy.processing.Compiler import Compiler
 from asyncy.processing.Mutations import Mutations
 from asyncy.processing.Services import Services
 from asyncy.utils.HttpUtils import HttpUtils
@@ -70,13 +73,12 @@ async def test_lexicon_execute_none(patch, logger, story, line, async_mock):
     assert result is None
 
 
-@mark.asyncio
-async def test_lexicon_set(patch, logger, story):
+def test_lexicon_set(patch, logger, story):
     story.context = {}
     patch.object(Lexicon, 'line_number_or_none')
     line = {'ln': '1', 'name': ['out'], 'args': ['values'], 'next': '2'}
     story.resolve.return_value = 'resolved'
-    result = await Lexicon.set(logger, story, line)
+    result = Lexicon.set(logger, story, line)
     story.resolve.assert_called_with(line['args'][0])
     story.end_line.assert_called_with(
         line['ln'], assign={'paths': ['out'], '$OBJECT': 'path'},
@@ -85,8 +87,7 @@ async def test_lexicon_set(patch, logger, story):
     assert result == Lexicon.line_number_or_none()
 
 
-@mark.asyncio
-async def test_lexicon_set_mutation(patch, logger, story):
+def test_lexicon_set_mutation(patch, logger, story):
     story.context = {}
     patch.object(Lexicon, 'line_number_or_none')
     patch.object(Mutations, 'mutate')
@@ -102,7 +103,7 @@ async def test_lexicon_set_mutation(patch, logger, story):
         'next': '2'
     }
     Mutations.mutate.return_value = 'mutated_result'
-    result = await Lexicon.set(logger, story, line)
+    result = Lexicon.set(logger, story, line)
     story.resolve.assert_called_with(line['args'][0])
     story.end_line.assert_called_with(
         line['ln'], assign={'paths': ['out'], '$OBJECT': 'path'},
@@ -113,8 +114,7 @@ async def test_lexicon_set_mutation(patch, logger, story):
     assert result == Lexicon.line_number_or_none()
 
 
-@mark.asyncio
-async def test_lexicon_set_invalid_operation(patch, logger, story):
+def test_lexicon_set_invalid_operation(patch, logger, story):
     story.context = {}
     patch.object(Lexicon, 'line_number_or_none')
     line = {
@@ -128,31 +128,28 @@ async def test_lexicon_set_invalid_operation(patch, logger, story):
         'next': '2'
     }
     with pytest.raises(StoryscriptError):
-        await Lexicon.set(logger, story, line)
+        Lexicon.set(logger, story, line)
 
 
-@mark.asyncio
-async def test_lexicon_function(patch, logger, story, line):
+def test_lexicon_function(patch, logger, story, line):
     patch.object(story, 'next_block')
     patch.object(Lexicon, 'line_number_or_none', return_value='1')
-    assert await Lexicon.function(logger, story, line) == '1'
+    assert Lexicon.function(logger, story, line) == '1'
     story.next_block.assert_called_with(line)
 
 
 @mark.parametrize('method', ['elif', 'else'])
-@mark.asyncio
-async def test_if_condition_elif_else(patch, logger, story, line, method):
+def test_if_condition_elif_else(patch, logger, story, line, method):
     line['method'] = method
     patch.object(Lexicon, 'line_number_or_none')
     patch.object(story, 'next_block')
-    ret = await Lexicon.if_condition(logger, story, line)
+    ret = Lexicon.if_condition(logger, story, line)
     story.next_block.assert_called_with(line)
     Lexicon.line_number_or_none.assert_called_with(story.next_block())
     assert ret == Lexicon.line_number_or_none()
 
 
-@mark.asyncio
-async def test_if_condition_1(patch, logger, magic):
+def test_if_condition_1(patch, logger, magic):
     tree = {
         '1': {
             'ln': '1',
@@ -173,12 +170,11 @@ async def test_if_condition_1(patch, logger, magic):
     story = Stories(magic(), 'foo', logger)
 
     story.tree = tree
-    ret = await Lexicon.if_condition(logger, story, tree['1'])
+    ret = Lexicon.if_condition(logger, story, tree['1'])
     assert ret is None
 
 
-@mark.asyncio
-async def test_if_condition_2(patch, logger, magic):
+def test_if_condition_2(patch, logger, magic):
     tree = {
         '1': {
             'ln': '1',
@@ -202,7 +198,7 @@ async def test_if_condition_2(patch, logger, magic):
     story = Stories(magic(), 'foo', logger)
 
     story.tree = tree
-    ret = await Lexicon.if_condition(logger, story, tree['1'])
+    ret = Lexicon.if_condition(logger, story, tree['1'])
     assert ret == '3'
 
 
@@ -231,8 +227,7 @@ def test__is_if_condition_true_complex(patch, story):
     [[False, False, True], '6'],
     [[False, False, False], '8'],
 ])
-@mark.asyncio
-async def test_if_condition(patch, logger, magic, case):
+def test_if_condition(patch, logger, magic, case):
     tree = {
         '1': {
             'ln': '1',
@@ -288,23 +283,22 @@ async def test_if_condition(patch, logger, magic, case):
     story = Stories(magic(), 'foo', logger)
 
     story.tree = tree
-    ret = await Lexicon.if_condition(logger, story, tree['1'])
+    ret = Lexicon.if_condition(logger, story, tree['1'])
     assert ret == case[1]
 
 
 @mark.parametrize('valid_usage', [True, False])
-@mark.asyncio
-async def test_break(logger, story, line, patch, valid_usage):
+def test_break(logger, story, line, patch, valid_usage):
     patch.object(Lexicon, '_does_line_have_parent_method',
                  return_value=valid_usage)
     if valid_usage:
-        ret = await Lexicon.break_(logger, story, line)
+        ret = Lexicon.break_(logger, story, line)
         assert ret == LineSentinels.BREAK
         Lexicon._does_line_have_parent_method.assert_called_with(
             story, line, 'for')
     else:
         with pytest.raises(InvalidKeywordUsage):
-            await Lexicon.break_(logger, story, line)
+            Lexicon.break_(logger, story, line)
 
 
 def test_lexicon_unless(logger, story, line):
@@ -364,6 +358,219 @@ async def test_lexicon_for_loop(patch, logger, story, line,
     assert story.context.get('element') is None
 
 
+@mark.parametrize('concurrency', [1, 4])
+@mark.asyncio
+async def test_lexicon_for_loop_parallel_dispatch(patch, logger, story,
+                                                  async_mock, concurrency):
+    line = Compiler.compile_tree({
+        '1': {'ln': '1', 'method': 'for', 'output': ['el'], 'args': ['x']}
+    })['1']
+    line.parallel = True
+    story.app.app_config.get_loop_concurrency.return_value = concurrency
+    patch.object(Lexicon, 'for_loop_parallel', new=async_mock())
+    patch.object(Story, 'execute_block', new=async_mock())
+    story.context = {}
+    story.resolve.return_value = ['one']
+    await Lexicon.for_loop(logger, story, line)
+    if concurrency > 1:
+        Lexicon.for_loop_parallel.mock.assert_called_with(logger, story, line,
+                                                          concurrency)
+    else:
+        Lexicon.for_loop_parallel.mock.assert_not_called()
+
+
+@mark.parametrize('sentinel', [None, LineSentinels.BREAK,
+                               LineSentinels.RETURN])
+@mark.asyncio
+async def test_lexicon_for_loop_parallel(patch, logger, story, line,
+                                         sentinel):
+    running = []
+    max_running = []
+    executed = []
+
+    async def execute_block(our_logger, our_story, our_line):
+        item = our_story.context['el']
+        running.append(item)
+        max_running.append(len(running))
+        await asyncio.sleep(0.01 if item == 0 else 0)
+        running.remove(item)
+        executed.append(item)
+        our_story.context['out'] = item
+        if item == 2:
+            return sentinel
+
+    patch.object(Story, 'execute_block', side_effect=execute_block)
+    patch.object(Lexicon, 'line_number_or_none')
+    patch.object(story, 'next_block')
+    patch.object(story, 'resolve', return_value=[0, 1, 2, 3, 4, 5])
+    line['args'] = [{'$OBJECT': 'path', 'paths': ['elements']}]
+    line['output'] = ['el']
+    story.context = {'out': None}
+
+    result = await Lexicon.for_loop_parallel(logger, story, line, 2)
+
+    assert max(max_running) == 2
+    assert 'el' not in story.context
+    if sentinel is None:
+        assert story.context['out'] == 5
+        assert sorted(executed) == [0, 1, 2, 3, 4, 5]
+        assert result == Lexicon.line_number_or_none()
+    else:
+        # Iterations after 2 are discarded, even if they ran.
+        assert story.context['out'] == 2
+        assert 5 not in executed
+        if sentinel == LineSentinels.BREAK:
+            assert result == Lexicon.line_number_or_none()
+        else:
+            assert result == sentinel
+
+
+@mark.asyncio
+async def test_lexicon_for_loop_parallel_exc(patch, logger, story, line):
+    async def execute_block(our_logger, our_story, our_line):
+        if our_story.context['el'] == 1:
+            raise StoryscriptError()
+        await asyncio.sleep(1)
+
+    patch.object(Story, 'execute_block', side_effect=execute_block)
+    patch.object(story, 'resolve', return_value=[1, 2, 3])
+    line['output'] = ['el']
+    story.context = {}
+    with pytest.raises(StoryscriptError):
+        await Lexicon.for_loop_parallel(logger, story, line, 3)
+
+    assert story.context == {}
+
+
+@mark.asyncio
+async def test_lexicon_for_loop_parallel_break_exc(patch, logger, story,
+                                                   line):
+    loop = asyncio.get_event_loop()
+    unretrieved = []
+    loop.set_exception_handler(
+        lambda loop, context: unretrieved.append(context))
+
+    async def execute_block(our_logger, our_story, our_line):
+        if our_story.context['el'] == 0:
+            await asyncio.sleep(0.01)
+            return LineSentinels.BREAK
+
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            # The iteration fails as it's cancelled.
+            raise StoryscriptError()
+
+    patch.object(Story, 'execute_block', side_effect=execute_block)
+    patch.object(Lexicon, 'line_number_or_none')
+    patch.object(story, 'next_block')
+    patch.object(story, 'resolve', return_value=[0, 1, 2])
+    line['output'] = ['el']
+    story.context = {}
+    try:
+        result = await Lexicon.for_loop_parallel(logger, story, line, 3)
+        await asyncio.sleep(0)
+        gc.collect()
+    finally:
+        loop.set_exception_handler(None)
+
+    assert result == Lexicon.line_number_or_none()
+    assert unretrieved == []
+
+
+@mark.asyncio
+async def test_lexicon_for_loop_yields(patch, logger, story, line,
+                                       async_mock):
+    patch.object(Story, 'execute_block', new=async_mock(return_value=None))
+    patch.object(story, 'next_block')
+    patch.object(story.budget, 'should_yield', return_value=True)
+    patch.object(story.budget, 'yield_', new=async_mock())
+    line['output'] = ['element']
+    story.context = {}
+    story.resolve.return_value = ['one', 'two', 'three']
+    await Lexicon.for_loop(logger, story, line)
+    assert story.budget.yield_.mock.call_count == 3
+
+
+@mark.parametrize('execute_block_return',
+                  [LineSentinels.BREAK, LineSentinels.RETURN, None])
+def test_lexicon_for_loop_sync(patch, logger, story, line,
+                               execute_block_return):
+    iterated_over_items = []
+
+    def execute_block_sync(our_logger, our_story, our_line):
+        iterated_over_items.append(story.context['element'])
+        assert our_line == line
+        return execute_block_return
+
+    patch.object(Lexicon, 'line_number_or_none')
+    patch.object(Story, 'execute_block_sync', side_effect=execute_block_sync)
+    patch.object(story, 'next_block')
+
+    line['args'] = [
+        {'$OBJECT': 'path', 'paths': ['elements']}
+    ]
+
+    line['output'] = ['element']
+    story.context = {}
+    story.resolve.return_value = ['one', 'two', 'three']
+    result = Lexicon.for_loop_sync(logger, story, line)
+
+    if execute_block_return == LineSentinels.BREAK:
+        assert iterated_over_items == ['one']
+        assert result == Lexicon.line_number_or_none(story.next_block(line))
+    elif LineSentinels.is_sentinel(execute_block_return):
+        assert iterated_over_items == ['one']
+        assert result == execute_block_return
+    else:
+        assert iterated_over_items == ['one', 'two', 'three']
+        assert result == Lexicon.line_number_or_none(story.next_block(line))
+
+    assert 'element' not in story.context
+
+
+@mark.parametrize('pending', [False, True])
+@mark.asyncio
+async def test_lexicon_for_loop_sync_yields(patch, logger, story, line,
+                                            async_mock, pending):
+    iterated_over_items = []
+
+    async def rest_of_block():
+        iterated_over_items.append('rest')
+
+    def execute_block_sync(our_logger, our_story, our_line):
+        iterated_over_items.append(story.context['element'])
+        if pending:
+            # A nested loop has used up the time slice.
+            return rest_of_block()
+
+    async def execute_block(our_logger, our_story, our_line):
+        iterated_over_items.append(story.context['element'])
+
+    patch.object(Lexicon, 'line_number_or_none')
+    patch.object(Story, 'execute_block_sync', side_effect=execute_block_sync)
+    patch.object(Story, 'execute_block', side_effect=execute_block)
+    patch.object(story, 'next_block')
+    patch.object(story.budget, 'should_yield', return_value=not pending)
+    patch.object(story.budget, 'yield_', new=async_mock())
+    line['output'] = ['element']
+    story.context = {}
+    story.resolve.return_value = ['one', 'two', 'three']
+
+    result = Lexicon.for_loop_sync(logger, story, line)
+
+    # The rest of the loop is executed asynchronously.
+    assert asyncio.iscoroutine(result)
+    assert iterated_over_items == ['one']
+    assert await result == Lexicon.line_number_or_none(story.next_block(line))
+    if pending:
+        assert iterated_over_items == ['one', 'rest', 'two', 'three']
+    else:
+        assert iterated_over_items == ['one', 'two', 'three']
+        assert story.budget.yield_.mock.call_count == 3
+    assert 'element' not in story.context
+
+
 @mark.asyncio
 async def test_lexicon_execute_streaming_container(patch, story, async_mock):
     line = {
@@ -445,8 +652,7 @@ async def test_lexicon_when(patch, story, async_mock, service_name):
         assert ret == Lexicon.line_number_or_none.return_value
 
 
-@mark.asyncio
-async def test_return_in_when(patch, logger, story):
+def test_return_in_when(patch, logger, story):
     tree = {
         '1': {'ln': '1', 'method': 'when'},
         '2': {'ln': '2', 'method': 'execute', 'parent': '1'},
@@ -464,27 +670,25 @@ async def test_return_in_when(patch, logger, story):
 
     story.tree = tree
 
-    ret = await Lexicon.ret(logger, story, tree['4'])
+    ret = Lexicon.ret(logger, story, tree['4'])
 
     assert ret == LineSentinels.RETURN
 
 
-@mark.asyncio
-async def test_return_used_outside_when(patch, logger, story):
+def test_return_used_outside_when(patch, logger, story):
     tree = {
         '1': {'ln': '1', 'method': 'return'},
     }
     with pytest.raises(StoryscriptError):
-        await Lexicon.ret(logger, story, tree['1'])
+        Lexicon.ret(logger, story, tree['1'])
 
 
-@mark.asyncio
-async def test_return_used_with_args(patch, logger, story):
+def test_return_used_with_args(patch, logger, story):
     tree = {
         '1': {'ln': '1', 'method': 'return', 'args': [{}]},
     }
     with pytest.raises(StoryscriptError):
-        await Lexicon.ret(logger, story, tree['1'])
+        Lexicon.ret(logger, story, tree['1'])
 
 
 def test_next_line_or_none():
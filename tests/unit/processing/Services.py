@@ -13,6 +13,7 @@ from asyncy.constants.LineConstants import LineConstants as Line, LineConstants
 from asyncy.constants.ServiceConstants import ServiceConstants
 from asyncy.entities.Multipart import FileFormField, FormField
 from asyncy.omg.ServiceOutputValidator import ServiceOutputValidator
+from asyncy.processing.Compiler import Compiler
 from asyncy.processing.Services import Command, Event, \
     Service, Services
 from asyncy.utils.HttpUtils import HttpUtils
@@ -180,6 +181,49 @@ def test_resolve_chain(story):
                   Event(name='foo'), Command(name='sonar')])
 
 
+def test_resolve_chain_compiled(patch, story):
+    story.app.services = {'alpine': {}}
+    story.tree = Compiler.compile_tree({
+        '1': {
+            Line.method: 'execute',
+            Line.service: 'alpine',
+            Line.command: 'echo'
+        }
+    })
+    line = story.tree['1']
+    chain = Services.resolve_chain(story, line)
+    assert line.chain is chain
+
+    patch.object(story, 'line')
+    assert Services.resolve_chain(story, line) is chain
+    story.line.assert_not_called()
+
+
+def test_command_conf_compiled(patch, story):
+    line = Compiler.compile_tree({'1': {'ln': '1'}})['1']
+    patch.object(Services, 'resolve_chain')
+    patch.object(Services, 'get_command_conf', return_value={'x': 'y'})
+    assert Services.command_conf(story, line) == {'x': 'y'}
+    assert Services.command_conf(story, line) == {'x': 'y'}
+    Services.get_command_conf.assert_called_once_with(
+        story, Services.resolve_chain())
+
+
+@mark.parametrize('compiled', [True, False])
+def test_is_internal_line(patch, story, compiled):
+    line = {'ln': '1'}
+    if compiled:
+        line = Compiler.compile_tree({'1': line})['1']
+
+    patch.object(Services, 'resolve_chain', return_value=deque([
+        Service('my_service'), Command('my_command')]))
+    patch.object(Services, 'is_internal', return_value=True)
+    assert Services.is_internal_line(story, line) is True
+    assert Services.is_internal_line(story, line) is True
+    Services.is_internal.assert_called_with('my_service', 'my_command')
+    assert Services.is_internal.call_count == (1 if compiled else 2)
+
+
 @mark.parametrize('value', [{'a': 'b'}, [0, 2, 'hello'], 'a'])
 def test_smart_insert(patch, story, value):
     patch.object(Services, 'raise_for_type_mismatch')
@@ -795,6 +839,7 @@ async def test_when(patch, story, async_mock, service_name):
     patch.init(AsyncHTTPClient)
     patch.object(story, 'next_block')
     patch.object(story.app, 'add_subscription')
+    patch.object(story.app, 'reuse_subscription', return_value=None)
     patch.object(story, 'argument_by_name', return_value='bar')
     http_res = Mock()
     http_res.code = 204
@@ -818,6 +863,41 @@ async def test_when(patch, story, async_mock, service_name):
         await Services.when(streaming_service, story, line)
 
 
+@mark.asyncio
+async def test_when_reuse_subscription(patch, story, async_mock, magic):
+    line = {
+        'ln': '10',
+        LineConstants.service: 'time-client',
+        LineConstants.command: 'updates'
+    }
+    story.app.services = {
+        'time-client': {
+            ServiceConstants.config: {
+                'actions': {
+                    'time-server': {
+                        'events': {
+                            'updates': {
+                                'http': {'subscribe': {'path': '/sub'}}
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    }
+    story.app.app_id = 'my_app'
+    streaming_service = StreamingService('time-client', 'time-server',
+                                         'asyncy--foo-1', 'foo.com')
+    patch.object(story.app, 'reuse_subscription', return_value=magic())
+    patch.object(HttpUtils, 'fetch_with_retry', new=async_mock())
+
+    await Services.when(streaming_service, story, line)
+
+    assert story.app.reuse_subscription.call_args[0][0]['sub_body'][
+        'endpoint'].endswith(f'story={story.name}&block=10&app=my_app')
+    HttpUtils.fetch_with_retry.mock.assert_not_called()
+
+
 def test_service_get_command_conf_events(story):
     chain = deque(
         [Service('service'), Command('cmd'), Event('foo'), Command('bar')])
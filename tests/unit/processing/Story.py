@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import collections
 import time
 from unittest import mock
@@ -9,7 +10,9 @@ from asyncy.Exceptions import StoryscriptError, StoryscriptRuntimeError
 from asyncy.Stories import Stories
 from asyncy.constants import ContextConstants
 from asyncy.constants.LineSentinels import LineSentinels
+from asyncy.entities.ExecutionBudget import ExecutionBudget
 from asyncy.processing import Lexicon, Story
+from asyncy.processing.Compiler import Compiler
 from asyncy.utils import Dict
 
 import pytest
@@ -60,22 +63,25 @@ Method = collections.namedtuple('Method', 'name lexicon_name async_mock')
 
 
 @mark.parametrize('method', [
-    Method(name='if', lexicon_name='if_condition', async_mock=True),
-    Method(name='elif', lexicon_name='if_condition', async_mock=True),
-    Method(name='else', lexicon_name='if_condition', async_mock=True),
+    Method(name='if', lexicon_name='if_condition', async_mock=False),
+    Method(name='elif', lexicon_name='if_condition', async_mock=False),
+    Method(name='else', lexicon_name='if_condition', async_mock=False),
     Method(name='for', lexicon_name='for_loop', async_mock=True),
     Method(name='execute', lexicon_name='execute', async_mock=True),
-    Method(name='set', lexicon_name='set', async_mock=True),
-    Method(name='function', lexicon_name='function', async_mock=True),
+    Method(name='set', lexicon_name='set', async_mock=False),
+    Method(name='function', lexicon_name='function', async_mock=False),
     Method(name='call', lexicon_name='call', async_mock=True),
     Method(name='when', lexicon_name='when', async_mock=True),
-    Method(name='return', lexicon_name='ret', async_mock=True),
-    Method(name='break', lexicon_name='break_', async_mock=True)
+    Method(name='return', lexicon_name='ret', async_mock=False),
+    Method(name='break', lexicon_name='break_', async_mock=False)
 ])
 @mark.asyncio
 async def test_story_execute_line_generic(patch, logger, story,
                                           async_mock, method):
-    patch.object(Lexicon, method.lexicon_name, new=async_mock())
+    if method.async_mock:
+        patch.object(Lexicon, method.lexicon_name, new=async_mock())
+    else:
+        patch.object(Lexicon, method.lexicon_name)
 
     patch.object(story, 'line', return_value={'method': method.name})
     patch.many(story, ['start_line', 'new_frame'])
@@ -94,6 +100,216 @@ async def test_story_execute_line_generic(patch, logger, story,
     story.start_line.assert_called_with('1')
 
 
+@mark.asyncio
+async def test_story_execute_sync(patch, logger, story, async_mock):
+    story.tree = Compiler.compile_tree({
+        '1': {'ln': '1', 'method': 'set', 'next': '2'},
+        '2': {'ln': '2', 'method': 'execute', 'next': '3'},
+        '3': {'ln': '3', 'method': 'set'}
+    })
+    patch.object(story, 'first_line', return_value='1')
+    patch.object(Story, 'execute_line_sync', side_effect=['2', None])
+    patch.object(Story, 'execute_line', new=async_mock(return_value='3'))
+    await Story.execute(logger, story)
+    assert [
+        mock.call(logger, story, '1'),
+        mock.call(logger, story, '3')
+    ] == Story.execute_line_sync.mock_calls
+    Story.execute_line.mock.assert_called_once_with(logger, story, '2')
+
+
+@mark.asyncio
+async def test_story_execute_yields(patch, logger, story, async_mock):
+    story.tree = Compiler.compile_tree({
+        '1': {'ln': '1', 'method': 'set', 'next': '2'},
+        '2': {'ln': '2', 'method': 'set'}
+    })
+    story.budget = ExecutionBudget(slice_lines=1)
+    patch.object(story, 'first_line', return_value='1')
+    patch.object(story.tree['1'], 'handler', return_value='2')
+    patch.object(story.tree['2'], 'handler', return_value=None)
+    patch.many(story, ['start_line'])
+    patch.object(story.budget, 'yield_', new=async_mock())
+    await Story.execute(logger, story)
+    assert story.budget.yield_.mock.call_count == 2
+
+
+@mark.asyncio
+async def test_story_execute_budget_exceeded(patch, logger, story):
+    story.tree = Compiler.compile_tree({
+        '1': {'ln': '1', 'method': 'set', 'next': '1'}
+    })
+    story.budget = ExecutionBudget(max_steps=100)
+    patch.object(story, 'first_line', return_value='1')
+    patch.object(story.tree['1'], 'handler', return_value='1')
+    patch.many(story, ['start_line'])
+    with pytest.raises(StoryscriptRuntimeError):
+        await Story.execute(logger, story)
+
+    assert story.tree['1'].handler.call_count == 100
+
+
+@mark.asyncio
+async def test_story_execute_batch(patch, logger, story):
+    order = []
+
+    stories = []
+
+    async def execute_line(logger, our_story, line_number):
+        stories.append(our_story)
+        with our_story.new_frame(line_number):
+            order.append(('start', line_number))
+            await asyncio.sleep(0)
+            # The other call doesn't interleave with this one's stack.
+            assert our_story.get_stack() == [line_number]
+            order.append(('end', line_number))
+        return f'next{line_number}'
+
+    patch.object(Story, 'execute_line', side_effect=execute_line)
+    story.context = {}
+    batch = ({'ln': '1'}, {'ln': '2'})
+    assert await Story.execute_batch(logger, story, batch) == 'next2'
+    assert order[:2] == [('start', '1'), ('start', '2')]
+    assert stories[0] is not story and stories[1] is not story
+    assert stories[0].context is story.context
+    assert story.get_stack() == []
+
+
+@mark.asyncio
+async def test_story_execute_batch_cancels(patch, logger, story):
+    cancelled = []
+
+    async def execute_line(logger, story, line_number):
+        if line_number == '1':
+            raise StoryscriptError()
+
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(line_number)
+            raise
+
+    patch.object(Story, 'execute_line', side_effect=execute_line)
+    with pytest.raises(StoryscriptError):
+        await Story.execute_batch(logger, story, ({'ln': '1'}, {'ln': '2'}))
+
+    await asyncio.sleep(0)
+    assert cancelled == ['2']
+
+
+@mark.asyncio
+async def test_story_execute_block_batch(patch, logger, story, async_mock):
+    story.tree = Compiler.compile_tree({
+        '1': {'ln': '1', 'method': 'if', 'enter': '2', 'next': '2'},
+        '2': {'ln': '2', 'method': 'execute', 'service': 'foo',
+              'command': 'bar', 'parent': '1', 'next': '3'},
+        '3': {'ln': '3', 'method': 'execute', 'service': 'baz',
+              'command': 'bar', 'parent': '1'}
+    }, {'foo': {'configuration': {'actions': {'bar': {}}}},
+        'baz': {'configuration': {'actions': {'bar': {}}}}})
+    patch.object(Story, 'execute_batch', new=async_mock(return_value=None))
+    patch.object(Story, 'execute_line', new=async_mock())
+    await Story.execute_block(logger, story, story.tree['1'])
+    Story.execute_batch.mock.assert_called_once_with(
+        logger, story, story.tree['2'].batch)
+    Story.execute_line.mock.assert_not_called()
+
+
+def test_story_execute_line_sync(patch, logger, story):
+    line = Compiler.compile_tree({'1': {'ln': '1', 'method': 'set'}})['1']
+    line.handler = mock.MagicMock()
+    patch.object(story, 'line', return_value=line)
+    patch.many(story, ['start_line', 'new_frame'])
+    result = Story.execute_line_sync(logger, story, '1')
+    story.new_frame.assert_called_with('1')
+    story.start_line.assert_called_with('1')
+    line.handler.assert_called_with(logger, story, line)
+    assert result == line.handler.return_value
+
+
+@mark.parametrize('exc', [StoryscriptError, ValueError])
+def test_story_execute_line_sync_exc(patch, logger, story, exc):
+    line = Compiler.compile_tree({'1': {'ln': '1', 'method': 'set'}})['1']
+    line.handler = mock.MagicMock(side_effect=exc())
+    patch.object(story, 'line', return_value=line)
+    with pytest.raises(StoryscriptError) as e:
+        Story.execute_line_sync(logger, story, '1')
+
+    assert e.value.line == line
+    if exc is ValueError:
+        assert isinstance(e.value, StoryscriptRuntimeError)
+
+
+@mark.parametrize('line_3_result', ['4', LineSentinels.RETURN,
+                                    LineSentinels.BREAK])
+def test_story_execute_block_sync(patch, logger, story, line_3_result):
+    story.tree = Compiler.compile_tree({
+        '1': {'ln': '1', 'method': 'for', 'enter': '2', 'next': '2'},
+        '2': {'ln': '2', 'method': 'set', 'parent': '1', 'next': '3'},
+        '3': {'ln': '3', 'method': 'set', 'parent': '1', 'next': '4'},
+        '4': {'ln': '4', 'method': 'set'}
+    })
+    patch.object(Story, 'execute_line_sync', side_effect=['3', line_3_result])
+    result = Story.execute_block_sync(logger, story, story.tree['1'])
+    assert [
+        mock.call(logger, story, '2'),
+        mock.call(logger, story, '3')
+    ] == Story.execute_line_sync.mock_calls
+    if line_3_result == LineSentinels.BREAK:
+        assert result == LineSentinels.BREAK
+    else:
+        assert result is None
+
+
+@mark.parametrize('rest_result', ['4', None, LineSentinels.BREAK])
+@mark.asyncio
+async def test_story_execute_block_sync_resumes(patch, logger, story,
+                                                async_mock, rest_result):
+    story.tree = Compiler.compile_tree({
+        '1': {'ln': '1', 'method': 'for', 'enter': '2', 'next': '2'},
+        '2': {'ln': '2', 'method': 'for', 'parent': '1', 'next': '3'},
+        '3': {'ln': '3', 'method': 'set', 'parent': '2', 'next': '4'},
+        '4': {'ln': '4', 'method': 'set', 'parent': '1'}
+    })
+
+    async def rest_of_line_2():
+        return rest_result
+
+    patch.object(Story, 'execute_line_sync', return_value=rest_of_line_2())
+    patch.object(Story, 'execute_block', new=async_mock())
+    patch.object(story, 'new_frame')
+
+    result = Story.execute_block_sync(logger, story, story.tree['1'])
+    assert asyncio.iscoroutine(result)
+    result = await result
+
+    story.new_frame.assert_called_with('2')
+    if rest_result == '4':
+        Story.execute_block.mock.assert_called_once_with(
+            logger, story, story.tree['1'], story.tree['4'])
+        assert result == Story.execute_block.mock.return_value
+    else:
+        Story.execute_block.mock.assert_not_called()
+        assert result == rest_result
+
+
+@mark.asyncio
+async def test_story_execute_block_awaits_line(patch, logger, story):
+    story.tree = Compiler.compile_tree({
+        '1': {'ln': '1', 'method': 'for', 'enter': '2', 'next': '2'},
+        '2': {'ln': '2', 'method': 'for', 'parent': '1', 'next': '3'},
+        '3': {'ln': '3', 'method': 'set'}
+    })
+    story.tree['2'].is_async = False
+
+    async def rest_of_line_2():
+        return '3'
+
+    patch.object(Story, 'execute_line_sync', return_value=rest_of_line_2())
+    assert await Story.execute_block(logger, story, story.tree['1']) is None
+    Story.execute_line_sync.assert_called_once_with(logger, story, '2')
+
+
 @mark.asyncio
 @mark.parametrize('line_4_result', ['5', LineSentinels.RETURN,
                                     LineSentinels.BREAK])
@@ -162,6 +378,7 @@ async def test_story_run(patch, app, logger, async_mock, magic):
     patch.object(time, 'time')
     patch.object(Story, 'execute', new=async_mock())
     patch.object(Story, 'story')
+    patch.object(ExecutionBudget, 'from_config')
     assert Metrics.story_run_total is not None
     assert Metrics.story_run_success is not None
     Metrics.story_run_total = magic()
@@ -170,7 +387,11 @@ async def test_story_run(patch, app, logger, async_mock, magic):
     await Story.run(app, logger, 'story_name')
     Story.story.assert_called_with(app, logger, 'story_name')
     Story.story.return_value.prepare.assert_called_with(None)
+    ExecutionBudget.from_config.assert_called_with(app.config)
+    assert Story.story().budget == ExecutionBudget.from_config()
     Story.execute.mock.assert_called_with(logger, Story.story())
+    app.execution.return_value.__enter__.assert_called_once()
+    app.execution.return_value.__exit__.assert_called_once()
 
     Metrics.story_run_total.labels.assert_called_with(app_id=app.app_id,
                                                       story_name='story_name')
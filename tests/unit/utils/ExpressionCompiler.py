@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+from asyncy.Exceptions import StoryscriptRuntimeError
+from asyncy.utils import Resolver
+from asyncy.utils.ExpressionCompiler import Expression, ExpressionCompiler
+
+import pytest
+from pytest import mark
+
+# Note: Both compiled and interpreted resolution are exercised through
+# integration/Lexicon. These ensure that the two agree with each other.
+
+
+def path(*paths):
+    return {'$OBJECT': 'path', 'paths': list(paths)}
+
+
+def int_(value):
+    return {'$OBJECT': 'int', 'int': value}
+
+
+def expression(name, *values):
+    return {'$OBJECT': 'expression', 'expression': name,
+            'values': list(values)}
+
+
+data = {
+    'a': 1,
+    'b': 2.5,
+    's': 'foo',
+    'l': [10, 20, 30],
+    'm': {'x': {'y': 'z'}},
+    't': True,
+    'f': False
+}
+
+
+@mark.parametrize('item', [
+    'plain',
+    10,
+    int_(10),
+    {'$OBJECT': 'string', 'string': 'hello'},
+    {'$OBJECT': 'string', 'string': '{} {}',
+     'values': [path('a'), path('s')]},
+    {'$OBJECT': 'boolean', 'boolean': False},
+    {'$OBJECT': 'float', 'float': 1.5},
+    path('a'),
+    path('m', {'$OBJECT': 'string', 'string': 'x'},
+         {'$OBJECT': 'string', 'string': 'y'}),
+    path('m', {'$OBJECT': 'string', 'string': 'unknown'}),
+    path('unknown'),
+    path('l', int_(1)),
+    path('l', {'$OBJECT': 'range', 'range': {'start': int_(1)}}),
+    path('l', {'$OBJECT': 'range', 'range': {'end': int_(2)}}),
+    {'$OBJECT': 'list', 'items': [path('a'), int_(2)]},
+    {'$OBJECT': 'dict', 'items': [
+        [{'$OBJECT': 'string', 'string': 'k'}, path('s')]
+    ]},
+    {'foo': path('a'), 'bar': 'baz'},
+    expression('equals', path('a'), int_(1)),
+    expression('not_equal', path('a'), int_(1)),
+    expression('greater', path('b'), path('a')),
+    expression('greater_equal', path('a'), int_(1)),
+    expression('less', path('b'), path('a')),
+    expression('less_equal', path('a'), int_(0)),
+    expression('not', path('t')),
+    expression('or', path('f'), path('f'), path('t')),
+    expression('or', path('f'), path('f')),
+    expression('and', path('t'), path('t')),
+    expression('and', path('t'), path('f'), path('t')),
+    expression('sum', path('a'), path('b')),
+    expression('sum', path('s'), path('a'), path('s')),
+    expression('subtraction', path('a'), path('b')),
+    expression('multiplication', path('s'), int_(3)),
+    expression('modulus', int_(7), int_(4)),
+    expression('division', path('b'), int_(2)),
+    expression('exponential', int_(2), int_(10)),
+    expression('sum', expression('multiplication', path('a'), int_(2)),
+               int_(1))
+])
+def test_expression_compiler_matches_resolver(item):
+    compiled = ExpressionCompiler.compile(item)
+    assert compiled(data) == Resolver.resolve(item, data)
+
+
+def test_expression_compiler_out_of_bounds():
+    compiled = ExpressionCompiler.compile(path('l', int_(5)))
+    with pytest.raises(StoryscriptRuntimeError):
+        compiled(data)
+
+
+@mark.parametrize('item', [
+    expression('subtraction', path('s'), int_(1)),
+    expression('foo', int_(1), int_(1)),
+    expression('equals', int_(1))
+])
+def test_expression_compiler_invalid(item):
+    compiled = ExpressionCompiler.compile(item)
+    with pytest.raises(Exception):
+        compiled(data)
+
+
+def test_expression_compiler_compile_expression():
+    item = expression('sum', int_(1), int_(2))
+    compiled = ExpressionCompiler.compile_expression(item)
+    assert isinstance(compiled, Expression)
+    assert compiled == item
+    assert Resolver.resolve(compiled, data) == 3
+
+
+def test_expression_compiler_compile_expression_malformed():
+    item = {'$OBJECT': 'path'}
+    assert ExpressionCompiler.compile_expression(item) is item
+    assert ExpressionCompiler.compile_expression('foo') == 'foo'
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from asyncy.utils.WatchHTTPClient import WatchHTTPClient
+
+from pytest import mark
+
+
+async def _start_server():
+    """
+    Starts a server which streams a chunk, and then keeps the connection
+    open until the client closes it.
+    """
+    open_requests = set()
+
+    async def handle(reader, writer):
+        open_requests.add(writer)
+        try:
+            await reader.readuntil(b'\r\n\r\n')
+            writer.write(b'HTTP/1.1 200 OK\r\n'
+                         b'Transfer-Encoding: chunked\r\n\r\n'
+                         b'6\r\nhello\n\r\n')
+            await writer.drain()
+            await reader.read()
+        finally:
+            open_requests.discard(writer)
+            writer.close()
+
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    return server, f'http://127.0.0.1:{port}/', open_requests
+
+
+async def _wait_for(predicate):
+    for _ in range(100):
+        if predicate():
+            return
+        await asyncio.sleep(0.01)
+
+    assert predicate()
+
+
+@mark.asyncio
+async def test_close_aborts_requests():
+    server, url, open_requests = await _start_server()
+    chunks = []
+    client = WatchHTTPClient(force_instance=True)
+    fetch = client.fetch(url, streaming_callback=chunks.append,
+                         request_timeout=60, raise_error=False)
+    await _wait_for(lambda: len(chunks) == 1)
+    assert len(open_requests) == 1
+
+    client.close()
+    res = await asyncio.wait_for(fetch, timeout=1)
+    assert res.code == 599
+    await _wait_for(lambda: len(open_requests) == 0)
+    server.close()
+
+
+@mark.asyncio
+async def test_close_while_connecting():
+    server, url, open_requests = await _start_server()
+    client = WatchHTTPClient(force_instance=True)
+    fetch = client.fetch(url, request_timeout=60, raise_error=False)
+    client.close()
+    await asyncio.wait([fetch], timeout=1)
+    await _wait_for(lambda: len(open_requests) == 0)
+    server.close()